@@ -1,62 +1,99 @@
 # Import necessary modules from Flask and other libraries
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Blueprint, Request, current_app, request, jsonify, send_file, Response, stream_with_context
+import click
+import logging
 import os
 import uuid
 import json
 import time
-import logging
-from logging.handlers import RotatingFileHandler
-from openai import OpenAI
+import threading
+from contextlib import closing
 from flask_sqlalchemy import SQLAlchemy
-from config import SQLALCHEMY_DATABASE_URI, SQLALCHEMY_TRACK_MODIFICATIONS
-from datetime import datetime
+from flask_migrate import Migrate
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from config import SQLALCHEMY_DATABASE_URI, SQLALCHEMY_TRACK_MODIFICATIONS, build_engine_options
+from config import SQLITE_PERFORMANCE_PROFILE, start_wal_checkpointer
+from pool_stats import pool_stats
+from transport import build_openai_client, bind_deadline, deadline, transport_stats
+from resilience import CircuitBreaker, CircuitOpen, RetryPolicy, call_with_retry, is_deadline_expired, is_transient
+from resilience import status_code_of
+from metrics import Registry, SIZE_BUCKETS, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from static_assets import AssetIndex, ENCODINGS as STATIC_ENCODINGS
+from structured_logging import SamplingFilter, attach_queue_logging, build_handlers
+from config import LOG_LEVEL, LOG_FORMAT, LOG_FILE, LOG_FILE_MAX_BYTES, LOG_FILE_BACKUPS
+from config import LOG_PAYLOAD_SAMPLE_RATE, LOG_PAYLOAD_MAX_PER_SECOND
+from config import CHAT_WORKERS, CHAT_MAX_PENDING, CHAT_JOB_MAX_WAIT, CHAT_TURN_DEADLINE
+from config import CONVERSATION_LEASE_TTL, CHAT_COALESCE_MAX, CHAT_QUEUE_MAX_WAIT
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_RECENT_MESSAGES
+from config import BLOB_STORE_BACKEND, BLOB_STORE_PATH, OPENAI_FILE_IDLE_TTL, UPLOAD_MAX_BYTES
+from config import SCORE_CHUNK_TOKENS, SCORE_WORKERS, SCORE_SAMPLE_CHUNKS
+from config import UPLOAD_WORKERS, UPLOAD_MAX_PENDING, FILE_SCORE_MAX_WAIT, UPLOAD_REQUEUE_AFTER
+from blobstore import get_blob_store as build_blob_store
+from scoring import score_document
+from ttl_cache import TTLCache
+from config import USER_CACHE_SIZE, USER_CACHE_TTL, THREAD_CACHE_SIZE, THREAD_CACHE_TTL
+from config import OPENAI_RETRY_ATTEMPTS, OPENAI_RETRY_BASE_DELAY, OPENAI_RETRY_MAX_DELAY
+from config import OPENAI_BREAKER_FAILURES, OPENAI_BREAKER_RESET, UPLOAD_PROCESS_DEADLINE
+from config import TASK_VISIBILITY_TIMEOUT, TASK_MAX_ATTEMPTS, TASK_LEASE_MAX_BATCH, TASK_ENQUEUE_MAX_BATCH
+from config import TASK_GENERATE_WHEN_EMPTY, SUBMIT_MAX_BATCH, SUBMIT_INSERT_CHUNK
+from concurrent.futures import ThreadPoolExecutor
+from conversation_context import (
+    advance_window, build_context, dump_recent, extractive_summary, format_messages, load_recent, truncate_to_tokens
+)
+from workers import BoundedExecutor, QueueFull, long_poll
+import chat_flow
+from chat_flow import ChatSteps, RunEvents, RUN_TERMINAL_STATUSES, assistant_reply, known_thread_id, run_failure
+from chat_flow import chat_job_outcome, chat_job_settled, is_run_active_error, rerun_delay, run_flow, service_unavailable
+from chat_flow import stream_flow, turn_timed_out
+from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 import io
+from collections import namedtuple
 
-def setup_logging(app):
-    # Configure logging
-    log_formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-
-    # File Handler
-    file_handler = RotatingFileHandler('app.log', maxBytes=10240, backupCount=10)
-    file_handler.setFormatter(log_formatter)
-    file_handler.setLevel(logging.DEBUG)
-
-    # Console Handler
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(log_formatter)
-    console_handler.setLevel(logging.INFO)
-
-    # Set up the app logger
-    app.logger.addHandler(file_handler)
-    app.logger.addHandler(console_handler)
-    app.logger.setLevel(logging.DEBUG)
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Initialize the Flask application
-app = Flask(__name__, static_folder='web')
-
-# Set up logging
-setup_logging(app)
+# The Flask app's logger (Flask names it after the import name); handlers are attached by setup_logging
+logger = logging.getLogger(__name__)
 
-# Configure the app with SQLAlchemy settings
-# Get the db URL from DATABASE_URL environment variable
-db_url = os.environ.get('DATABASE_URL')
-if not db_url:
-    raise ValueError("DATABASE_URL environment variable is not set")
+# Full API payloads and per-poll lines go to a child logger that is sampled and rate limited
+payload_logger = logger.getChild('payload')
 
-# Split the URL to handle potential 'postgres://' scheme
-if db_url.startswith("postgres://"):
-    db_url = db_url.replace("postgres://", "postgresql://", 1)
-
-app.config['SQLALCHEMY_DATABASE_URI'] = db_url
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = SQLALCHEMY_TRACK_MODIFICATIONS
+def setup_logging(log_file=LOG_FILE):
+    """
+    Attach the queued file and console handlers, once per process.
 
-# Initialize SQLAlchemy
-db = SQLAlchemy(app)
+    Args:
+        log_file (str): Path of the rotating log file, or None to log to the console only
+    """
+    if logger.handlers:
+        return
+    # File and console handlers run on a background listener; request threads only enqueue records
+    handlers = build_handlers(LOG_FORMAT, log_file, LOG_FILE_MAX_BYTES, LOG_FILE_BACKUPS)
+    attach_queue_logging(logger, handlers, LOG_LEVEL)
+    payload_logger.addFilter(SamplingFilter(LOG_PAYLOAD_SAMPLE_RATE, LOG_PAYLOAD_MAX_PER_SECOND))
+
+# Extensions are bound to an app in create_app, so importing this module opens no connections
+db = SQLAlchemy()
+
+# Schema migrations live in migrations/versions (flask db upgrade)
+migrate = Migrate()
+
+# Routes, error handlers and CLI commands, registered on the app by create_app
+bp = Blueprint('app', __name__, cli_group=None)
+
+# With the SQLite performance profile, checkpoint the WAL periodically. The thread is
+# started on the first request so that each gunicorn worker runs its own after forking.
+wal_checkpointer = None
+wal_checkpointer_lock = threading.Lock()
+
+@bp.before_app_request
+def ensure_wal_checkpointer():
+    global wal_checkpointer
+    if wal_checkpointer or not SQLITE_PERFORMANCE_PROFILE or db.engine.dialect.name != 'sqlite':
+        return
+    with wal_checkpointer_lock:
+        if wal_checkpointer is None:
+            wal_checkpointer = start_wal_checkpointer(db.engine)
 
 # Define User model
 class User(db.Model):
@@ -64,13 +101,16 @@ class User(db.Model):
     user_id = db.Column(db.String, unique=True, nullable=False)
     user_score = db.Column(db.Integer, default=0)
     user_notes = db.Column(db.Text)
+    version = db.Column(db.Integer, nullable=False, default=1)  # Bumped on every profile write; lets cached copies detect they are stale
     
 # Define Conversation model
 class Conversation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.String, unique=True, nullable=False)
-    user_id = db.Column(db.String, db.ForeignKey('user.user_id'), nullable=False)
+    user_id = db.Column(db.String, db.ForeignKey('user.user_id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    context_summary = db.Column(db.Text, nullable=True)  # Rolling summary of turns older than the recent window
+    recent_messages = db.Column(db.Text, nullable=True)  # JSON list of the most recent messages, oldest first
 
 # Define Message model
 class Message(db.Model):
@@ -81,48 +121,234 @@ class Message(db.Model):
     file_id = db.Column(db.Integer, db.ForeignKey('file.id'), nullable=True)
     file = db.relationship('File', backref=db.backref('messages', lazy=True))
 
+    __table_args__ = (
+        # Serves the per-conversation history query, filtered by conversation and ordered by time
+        db.Index('ix_message_conversation_id_timestamp', 'conversation_id', 'timestamp'),
+    )
+
 # Define File model
 class File(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String, db.ForeignKey('user.user_id'), nullable=False)
     filename = db.Column(db.String, nullable=False)
-    file_content = db.Column(db.LargeBinary, nullable=False)  # BYTEA type for PostgreSQL
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # SHA-256 key of the content in the blob store
+    file_content = db.deferred(db.Column(db.LargeBinary, nullable=True))  # Legacy BYTEA copy, only set on rows not yet moved to the blob store; loaded only on access
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
     mime_type = db.Column(db.String, nullable=False)
     file_size = db.Column(db.Integer, nullable=False)
     score = db.Column(db.Integer)
+    score_status = db.Column(db.String, nullable=False, default='ready')  # pending, ready or failed
     openai_file_id = db.Column(db.String, nullable=True)  # New field to store OpenAI file ID
 
-# Create all database tables
-with app.app_context():
-    print("Creating all tables")
-    db.create_all()
-    # confirm that the tables were created
-    print(db.Model.metadata.tables.keys())
-    print("Tables created")
+    __table_args__ = (
+        # Serves per-user lookups and the keyset-paginated file listing
+        db.Index('ix_file_user_id_id', 'user_id', 'id'),
+    )
+
+# Define UploadedContent model: one row per distinct upload content, shared by every File with that hash
+class UploadedContent(db.Model):
+    content_hash = db.Column(db.String(64), primary_key=True)
+    openai_file_id = db.Column(db.String, nullable=False)
+    score = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+# Define ChatJob model for chat turns run by the background worker pool
+class ChatJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String, unique=True, nullable=False)
+    user_id = db.Column(db.String, nullable=False)
+    conversation_id = db.Column(db.String, nullable=True)
+    message = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String, nullable=False, default='queued')  # queued, running, completed or failed
+    status_code = db.Column(db.Integer, nullable=True)  # HTTP status of the finished turn
+    result = db.Column(db.Text, nullable=True)  # JSON response payload of the finished turn
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Finds a conversation's queued messages when its next run starts
+        db.Index('ix_chat_job_conversation_id_status', 'conversation_id', 'status'),
+    )
+
+# Define ConversationLease model: held by the one turn allowed to run on a conversation
+class ConversationLease(db.Model):
+    conversation_id = db.Column(db.String, primary_key=True)
+    holder = db.Column(db.String, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+# Define Task model: work handed out by /getwork, leased to one worker at a time
+class Task(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.String, unique=True, nullable=False)
+    description = db.Column(db.Text, nullable=False)
+    code_blob = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String, nullable=False, default='queued')  # queued, leased, completed or failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)  # Number of times the task has been leased
+    lease_holder = db.Column(db.String, nullable=True)  # Token of the lease that handed the task out last
+    lease_expires_at = db.Column(db.DateTime, nullable=True)  # The task is handed out again after this
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Serves the lease query: queued tasks oldest first, and leases past their visibility timeout
+        db.Index('ix_task_status_id', 'status', 'id'),
+        db.Index('ix_task_status_lease_expires_at', 'status', 'lease_expires_at'),
+        db.Index('ix_task_lease_holder', 'lease_holder'),
+    )
+
+# Define TaskResult model: the one accepted result of a task
+class TaskResult(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.String, unique=True, nullable=False)  # Unique, so a retried submission is a no-op
+    result = db.Column(db.Text, nullable=False)  # JSON-encoded result as submitted
+    submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class AppRequest(Request):
+    """
+    Request whose uploaded files a view can spool somewhere of its choosing, by
+    setting file_stream_factory to a no-argument callable before reading request.files.
+    """
+    file_stream_factory = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.file_stream_factory is not None:
+            return self.file_stream_factory()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+def create_app(config=None):
+    """
+    Build and configure the Flask application.
+
+    Nothing here touches the database or OpenAI: the schema is created by
+    migrations (flask db upgrade) and the OpenAI client on first use, so the
+    app can be built in the gunicorn master (--preload) and forked cheaply.
+
+    Args:
+        config (dict): Settings applied over the environment's, e.g. SQLALCHEMY_DATABASE_URI in tests
+
+    Returns:
+        Flask: The application
+    """
+    # Load environment variables from .env file
+    load_dotenv()
+
+    app = Flask(__name__, static_folder='web')
+    app.request_class = AppRequest
+
+    # Get the db URL from DATABASE_URL, falling back to the configured default
+    db_url = os.environ.get('DATABASE_URL', SQLALCHEMY_DATABASE_URI)
+
+    # Split the URL to handle potential 'postgres://' scheme
+    if db_url.startswith("postgres://"):
+        db_url = db_url.replace("postgres://", "postgresql://", 1)
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = db_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = SQLALCHEMY_TRACK_MODIFICATIONS
+
+    app.config.update(config or {})
+
+    # Tests log to the console only, unless they pass a LOG_FILE of their own
+    setup_logging(app.config.get('LOG_FILE', None if app.config.get('TESTING') else LOG_FILE))
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', build_engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+
+    db.init_app(app)
+    migrate.init_app(app, db)
+    app.register_blueprint(bp)
+    return app
 
 
 # Helper functions for user operations
 def get_user(user_id):
     """
-    Retrieve or create a user by user_id.
+    Retrieve a user by user_id, or None if there is no such user.
     """
-    user = User.query.filter_by(user_id=user_id).first()
-    if not user:
-        user = create_user(user_id)
-    return user
-
-    #return User.query.filter_by(user_id=user_id).first()
+    return User.query.filter_by(user_id=user_id).first()
 
 def create_user(user_id, important_notes=""):
     """
     Create a new user.
     """
-    user = User(user_id=user_id, user_notes=important_notes)
+    user = User(user_id=user_id, user_notes=important_notes, version=1)
     db.session.add(user)
     db.session.commit()
+    cache_user(user)
     return user
 
+# Snapshot of a User row plus its prepared chat context, as kept in the user cache
+CachedUser = namedtuple('CachedUser', ['user_id', 'user_score', 'user_notes', 'version', 'context'])
+
+# Per-process write-through cache of users. Each gunicorn worker has its own copy, so
+# reads may lag another worker's write by up to USER_CACHE_TTL; writes are checked
+# against the row's version and reapplied to the current row if the copy was stale.
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+def snapshot_user(user):
+    """
+    Build a CachedUser from a User row or another CachedUser.
+    """
+    return CachedUser(user.user_id, user.user_score or 0, user.user_notes, user.version or 1, prepare_user_context(user))
+
+def cache_user(user):
+    """
+    Store a snapshot of a user (a User row or CachedUser) in the cache and return it.
+    """
+    cached = snapshot_user(user)
+    user_cache.set(user.user_id, cached)
+    return cached
+
+def get_cached_user(user_id):
+    """
+    Retrieve a user snapshot, from the cache if present, otherwise from the database.
+
+    Returns:
+        CachedUser: The user, or None if there is no such user
+    """
+    cached = user_cache.get(user_id)
+    if cached is None:
+        user = get_user(user_id)
+        if user is None:
+            return None
+        cached = cache_user(user)
+    return cached
+
+def update_user_profile(cached, user_notes, score_change):
+    """
+    Stage a chat turn's notes and score change for a user in the current transaction.
+
+    The update only applies if the row still has the cached version. Otherwise
+    another worker wrote first, so the change is reapplied to the current row,
+    or to a recreated row if the user was deleted since it was cached. The caller commits and then stores the returned snapshot in the user cache.
+
+    Returns:
+        CachedUser: The updated user
+    """
+    new_score = clamp_user_score(cached.user_score + score_change)
+    result = db.session.execute(
+        db.update(User)
+        .where(User.user_id == cached.user_id, User.version == cached.version)
+        .values(user_notes=user_notes, user_score=new_score, version=cached.version + 1)
+    )
+    if result.rowcount == 1:
+        return snapshot_user(cached._replace(user_notes=user_notes, user_score=new_score, version=cached.version + 1))
+
+    logger.info(f"Cached user {cached.user_id} was stale (version {cached.version}); reapplying update")
+    user_cache.invalidate(cached.user_id)
+    user = User.query.filter_by(user_id=cached.user_id).with_for_update().populate_existing().first()
+    if user is None:
+        # The row was deleted after it was cached; recreate it so the turn can still be saved
+        logger.warning(f"Cached user {cached.user_id} no longer exists; recreating it")
+        user = User(user_id=cached.user_id, user_notes=user_notes, user_score=clamp_user_score(score_change), version=1)
+        db.session.add(user)
+        db.session.flush()
+        return snapshot_user(user)
+    user.user_notes = user_notes
+    user.user_score = clamp_user_score((user.user_score or 0) + score_change)
+    user.version = (user.version or 1) + 1
+    db.session.flush()
+    return snapshot_user(user)
+
+def clamp_user_score(score):
+    return max(0, min(score, 1000))  # Ensure score is between 0 and 1000
+
 # Helper functions for conversation operations
 def get_conversation(conversation_id):
     """
@@ -158,35 +384,313 @@ def add_message(conversation_id, content):
     db.session.commit()
     return message
 
-# Set up OpenAI client
-client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+# Blob store for uploaded file contents, built on first use so importing the app
+# doesn't create its directories
+blob_store = None
+blob_store_lock = threading.Lock()
+
+def get_blob_store():
+    """
+    The process's blob store, created on first use.
+    """
+    global blob_store
+    if blob_store is None:
+        with blob_store_lock:
+            if blob_store is None:
+                blob_store = build_blob_store(BLOB_STORE_BACKEND, BLOB_STORE_PATH)
+    return blob_store
+
+# Prometheus metrics for this process, served at /metrics
+metrics_registry = Registry()
+chat_phase_seconds = metrics_registry.histogram(
+    'chat_phase_seconds', 'Time spent in each phase of a chat turn', ['phase'])
+chat_turn_seconds = metrics_registry.histogram(
+    'chat_turn_seconds', 'End-to-end time of a chat turn by response status', ['status'])
+openai_retries = metrics_registry.counter(
+    'openai_retries_total', 'OpenAI calls retried after a transient failure', ['call'])
+openai_tokens = metrics_registry.counter(
+    'openai_tokens_total', 'Tokens used by OpenAI calls', ['call', 'kind'])
+assistant_parse_failures = metrics_registry.counter(
+    'assistant_parse_failures_total', 'Assistant replies that were not valid JSON')
+upload_size_bytes = metrics_registry.histogram(
+    'upload_size_bytes', 'Size of uploaded files', buckets=SIZE_BUCKETS)
+file_score_seconds = metrics_registry.histogram(
+    'file_score_seconds', 'Time to score an uploaded file by outcome', ['outcome'])
+
+def record_token_usage(call, usage):
+    """
+    Count the tokens reported in an OpenAI response's usage, if any.
+    """
+    if not usage:
+        return
+    for kind in ('prompt_tokens', 'completion_tokens'):
+        tokens = getattr(usage, kind, None)
+        if isinstance(tokens, int):
+            openai_tokens.inc(tokens, call=call, kind=kind.split('_')[0])
+
+# OpenAI client on the shared keep-alive transport, built on first use by get_client so that
+# each forked worker opens its own connections. Retries are done by call_openai instead of
+# the SDK, so they back off with jitter and respect the breaker.
+client = None
+client_lock = threading.Lock()
+
+def get_client():
+    """
+    The process's OpenAI client, created on first use.
+    """
+    global client
+    if client is None:
+        with client_lock:
+            if client is None:
+                client = build_openai_client(os.environ.get('OPENAI_API_KEY'), max_retries=0)
+    return client
+
+openai_retry = RetryPolicy(OPENAI_RETRY_ATTEMPTS, OPENAI_RETRY_BASE_DELAY, OPENAI_RETRY_MAX_DELAY)
+openai_breaker = CircuitBreaker('openai', OPENAI_BREAKER_FAILURES, OPENAI_BREAKER_RESET)
+
+def call_openai(fn, *args, retry_on=is_transient, retry_busy=None, **kwargs):
+    """
+    Call an OpenAI client method with backoff, jitter and Retry-After handling.
+
+    Raises CircuitOpen without calling OpenAI while it is failing, and the
+    method's own error once retries or the current deadline run out.
+    """
+    def on_retry(error, attempt, delay):
+        openai_retries.inc(call=getattr(fn, '__qualname__', 'openai'))
+        logger.warning(f"OpenAI call {getattr(fn, '__qualname__', fn)} failed ({error}); retry {attempt + 1} in {delay:.1f}s")
+    return call_with_retry(lambda: fn(*args, **kwargs), openai_retry, openai_breaker,
+        retry_on=retry_on, retry_busy=retry_busy, on_retry=on_retry)
+
+@bp.app_errorhandler(CircuitOpen)
+def circuit_open(error):
+    payload, status = service_unavailable(error)
+    return jsonify(payload), status, {'Retry-After': str(payload['retry_after'])}
+
+# Assistant used for chat turns
+ASSISTANT_ID = "asst_C1QfXGVcUf2Vb36DZjqU1Ayb"  # Replace with your actual assistant ID
+# Replay only the recent window from the thread; older turns reach the assistant through the summary
+ASSISTANT_TRUNCATION = {"type": "last_messages", "last_messages": CONTEXT_RECENT_MESSAGES}
+ASSISTANT_INSTRUCTIONS = """You are the Dark Lord Cthulhu. Consider the user's important notes, preferences, and previous conversation when responding. Find out what their desires are, and how they can serve the dark mission.
+
+                Provide your response in the following JSON format:
+                {
+                    "reply": "Your message to the user",
+                    "updated_notes": "New and interesting information about the user, focusing on their capabilities and desires",
+                    "score_change": "An integer between -100 and 100 representing how useful the interaction was"
+                }"""
 
 # Define the route for the 'getwork' endpoint
-@app.route('/getwork', methods=['GET'])
+@bp.route('/getwork', methods=['GET'])
 def get_work():
     """
-    Endpoint to generate and return a task for processing.
+    Endpoint to lease tasks for processing.
+
+    Pass ?batch=N to lease up to N tasks at once (at most TASK_LEASE_MAX_BATCH). A
+    leased task is hidden from other workers for TASK_VISIBILITY_TIMEOUT seconds and
+    handed out again if its result has not arrived by then. When the queue is
+    empty, placeholder tasks are generated unless TASK_GENERATE_WHEN_EMPTY is off.
 
     Returns:
-        JSON: Task details and code blob
+        JSON: The task details and code blob, or {"tasks": [...]} with ?batch; 204 if there is no work
     """
     try:
-        # Task generation logic
-        task_id = generate_unique_id()
-        task_description = generate_task_description()
-        code_blob = generate_code_blob()
-
-        # Prepare response
-        response = {
-            'task_id': task_id,
-            'description': task_description,
-            'code_blob': code_blob
-        }
-
-        return jsonify(response), 200
+        batch = request.args.get('batch', type=int)
+        count = max(1, min(batch or 1, TASK_LEASE_MAX_BATCH))
+
+        tasks = lease_tasks(count)
+        if not tasks and TASK_GENERATE_WHEN_EMPTY:
+            tasks = generate_placeholder_tasks(count)
+
+        if batch is not None:
+            return jsonify({'tasks': [task_payload(task) for task in tasks]}), 200
+        if not tasks:
+            return '', 204
+        return jsonify(task_payload(tasks[0])), 200
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+# Define the route for adding tasks to the queue
+@bp.route('/api/tasks', methods=['POST'])
+def create_tasks():
+    """
+    Endpoint to add tasks to the queue behind /getwork.
+
+    Accepts one task or {"tasks": [...]} (at most TASK_ENQUEUE_MAX_BATCH), each with a
+    description and code_blob and optionally its own task_id. The tasks are inserted
+    in one transaction.
+
+    Returns:
+        JSON: The ids of the queued tasks, with status 201
+    """
+    data = request.get_json(silent=True)
+    items = data.get('tasks') if isinstance(data, dict) and 'tasks' in data else [data]
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Provide a task object or {"tasks": [...]}'}), 400
+    if len(items) > TASK_ENQUEUE_MAX_BATCH:
+        return jsonify({'error': f'At most {TASK_ENQUEUE_MAX_BATCH} tasks per request'}), 400
+
+    for index, item in enumerate(items):
+        error = validate_task(item)
+        if error:
+            return jsonify({'error': f'Task {index}: {error}'}), 400
+
+    try:
+        task_ids = enqueue_tasks(items)
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'A task with one of these task_ids already exists'}), 409
+
+    return jsonify({'task_ids': task_ids, 'status': 'queued'}), 201
+
+# Define the route for checking on a task
+@bp.route('/api/tasks/<task_id>', methods=['GET'])
+def get_task(task_id):
+    """
+    Endpoint to report a task's status.
+
+    Returns:
+        JSON: The task's status, attempts and current lease expiry
+    """
+    task = Task.query.filter_by(task_id=task_id).first()
+    if not task:
+        return jsonify({'error': 'Task not found'}), 404
+    return jsonify({
+        'task_id': task.task_id,
+        'status': task.status,
+        'attempts': task.attempts,
+        'lease_expires_at': task.lease_expires_at.isoformat() if task.lease_expires_at else None
+    }), 200
+
+@bp.cli.command('fail-expired-tasks')
+def fail_expired_tasks_command():
+    """
+    Mark tasks whose last lease expired after TASK_MAX_ATTEMPTS leases as failed.
+    """
+    click.echo(f"Marked {fail_expired_tasks()} tasks as failed")
+
+# A task as handed to a worker by /getwork
+LeasedTask = namedtuple('LeasedTask', ['task_id', 'description', 'code_blob', 'lease_expires_at'])
+
+def task_payload(task):
+    return {
+        'task_id': task.task_id,
+        'description': task.description,
+        'code_blob': task.code_blob,
+        'lease_expires_at': task.lease_expires_at.isoformat()
+    }
+
+def validate_task(item):
+    """
+    Check one task of an enqueue request.
+
+    Returns:
+        str: What is wrong with the task, or None if it is valid
+    """
+    if not isinstance(item, dict):
+        return 'must be an object'
+    for field in ('description', 'code_blob'):
+        if not item.get(field) or not isinstance(item[field], str):
+            return f'{field} must be a non-empty string'
+    if 'task_id' in item and (not item['task_id'] or not isinstance(item['task_id'], str)):
+        return 'task_id must be a non-empty string'
+    return None
+
+def enqueue_tasks(items):
+    """
+    Insert validated tasks as queued, in one transaction.
+
+    Returns:
+        list: The task ids, in request order
+    """
+    now = datetime.utcnow()
+    rows = [{
+        'task_id': item.get('task_id') or generate_unique_id(),
+        'description': item['description'],
+        'code_blob': item['code_blob'],
+        'status': 'queued',
+        'attempts': 0,
+        'created_at': now
+    } for item in items]
+    db.session.execute(db.insert(Task), rows)
+    db.session.commit()
+    return [row['task_id'] for row in rows]
+
+def lease_tasks(count, visibility_timeout=TASK_VISIBILITY_TIMEOUT):
+    """
+    Atomically lease up to count tasks, oldest first.
+
+    Queued tasks and tasks whose lease expired with attempts left are both
+    eligible, so an expired lease is re-queued by the next lease that finds it.
+    On Postgres the candidates are locked with FOR UPDATE SKIP LOCKED, so
+    concurrent workers lease disjoint tasks without waiting on each other.
+    SQLite runs one writer at a time, so there the single UPDATE is already atomic.
+
+    Returns:
+        list: LeasedTask tuples, oldest first
+    """
+    now = datetime.utcnow()
+    holder = generate_unique_id()
+    expires_at = now + timedelta(seconds=visibility_timeout)
+
+    candidates = db.select(Task.id).where(db.or_(
+        Task.status == 'queued',
+        db.and_(Task.status == 'leased', Task.lease_expires_at < now, Task.attempts < TASK_MAX_ATTEMPTS)
+    )).order_by(Task.id).limit(count)
+    if db.engine.dialect.name == 'postgresql':
+        candidates = candidates.with_for_update(skip_locked=True)
+
+    lease = db.update(Task).where(Task.id.in_(candidates.scalar_subquery())).values(
+        status='leased', lease_holder=holder, lease_expires_at=expires_at, attempts=Task.attempts + 1
+    ).execution_options(synchronize_session=False)
+    columns = (Task.id, Task.task_id, Task.description, Task.code_blob, Task.lease_expires_at)
+
+    if getattr(db.engine.dialect, 'update_returning', False):
+        rows = db.session.execute(lease.returning(*columns)).all()
+    else:
+        # Older SQLite without RETURNING: read the leased rows back by their lease token
+        db.session.execute(lease)
+        rows = db.session.execute(db.select(*columns).where(Task.lease_holder == holder)).all()
+    db.session.commit()
+
+    return [LeasedTask(*row[1:]) for row in sorted(rows, key=lambda row: row[0])]
+
+def generate_placeholder_tasks(count, visibility_timeout=TASK_VISIBILITY_TIMEOUT):
+    """
+    Create count placeholder tasks, already leased to the caller, for when the queue is empty.
+
+    Returns:
+        list: LeasedTask tuples
+    """
+    holder = generate_unique_id()
+    expires_at = datetime.utcnow() + timedelta(seconds=visibility_timeout)
+    tasks = [LeasedTask(generate_unique_id(), generate_task_description(), generate_code_blob(), expires_at)
+             for _ in range(count)]
+    db.session.execute(db.insert(Task), [dict(
+        task._asdict(),
+        status='leased',
+        attempts=1,
+        lease_holder=holder,
+        created_at=datetime.utcnow()
+    ) for task in tasks])
+    db.session.commit()
+    return tasks
+
+def fail_expired_tasks():
+    """
+    Mark tasks out of attempts whose last lease has expired as failed.
+
+    Returns:
+        int: The number of tasks marked failed
+    """
+    failed = Task.query.filter(
+        Task.status == 'leased',
+        Task.lease_expires_at < datetime.utcnow(),
+        Task.attempts >= TASK_MAX_ATTEMPTS
+    ).update({'status': 'failed', 'lease_holder': None}, synchronize_session=False)
+    db.session.commit()
+    return failed
+
 def generate_unique_id():
     return str(uuid.uuid4())
 
@@ -199,286 +703,1226 @@ def generate_code_blob():
     return "def example_function():\n    # TODO: Implement this function\n    pass"
 
 # Define the route for the 'submit' endpoint
-@app.route('/submit', methods=['POST'])
+@bp.route('/submit', methods=['POST'])
 def submit_work():
     """
     Endpoint to handle work submissions from clients.
 
-    Receives submitted work, validates the data, processes the results,
-    and returns an appropriate response to the client.
+    Receives submitted work, validates the data and stores the result. Submitting
+    a result again for the same task_id succeeds without storing it twice; a
+    task_id that was never issued is refused with 404.
 
     Returns:
         JSON: A response indicating the status of the submission
     """
     try:
         # Get the submitted data from the request
-        data = request.json
+        data = request.get_json(silent=True)
         if not data:
             return jsonify({'error': 'No data provided'}), 400
 
         # Validate the submitted data
-        required_fields = ['task_id', 'result']
-        if not all(field in data for field in required_fields):
-            return jsonify({'error': 'Missing required fields'}), 400
+        error = validate_submission(data)
+        if error:
+            return jsonify({'error': error}), 400
 
-        task_id = data['task_id']
-        result = data['result']
-
-        # TODO: Add more specific validation based on the expected format of 'result'
-
-        # Process the submitted work
-        # This is a placeholder for actual processing logic
-        processed_result = f"Processed result for task {task_id}: {result}"
-
-        # Store the result
-        # TODO: Implement actual storage logic (e.g., database insertion)
-        # For now, we'll just print it
-        print(f"Storing result: {processed_result}")
+        [status] = store_task_results([data])
+        if status == 'unknown':
+            return jsonify({'error': 'Unknown task_id', 'task_id': data['task_id']}), 404
 
         # Return a success response
         return jsonify({
             'status': 'success',
-            'message': 'Work submitted successfully',
-            'task_id': task_id
+            'message': 'Work submitted successfully' if status == 'stored' else 'Work was already submitted',
+            'task_id': data['task_id']
         }), 200
 
     except Exception as e:
-        # Log the error for debugging
-        print(f"Error in submit_work: {str(e)}")
+        db.session.rollback()
+        logger.exception(f"Error in submit_work: {str(e)}")
         return jsonify({'error': 'An error occurred while processing the submission'}), 500
 
-# Define the route for the chat endpoint
-@app.route('/api/chat', methods=['POST'])
-def chat():
+# Define the route for submitting many results at once
+@bp.route('/submit/bulk', methods=['POST'])
+def submit_work_bulk():
     """
-    Endpoint to handle chat messages using the OpenAI API.
+    Endpoint to submit many results in one request.
+
+    Takes a JSON array of {"task_id", "result"} objects, or one object per line
+    with Content-Type application/x-ndjson, up to SUBMIT_MAX_BATCH results. Valid
+    results are stored in a single transaction; results for a task_id that
+    already has one (including earlier in the same request) are skipped, as are
+    results for a task_id that was never issued.
 
     Returns:
-        JSON: The response from the OpenAI API including updated user information
+        JSON: A status per result ('stored', 'duplicate', 'unknown' or 'invalid' with an error),
+        plus totals and the unknown task_ids
     """
+    items, error = parse_bulk_submission(request)
+    if error:
+        return jsonify({'error': error}), 400
+    if len(items) > SUBMIT_MAX_BATCH:
+        return jsonify({'error': f'At most {SUBMIT_MAX_BATCH} results per request'}), 400
+
+    results = [{'index': index} for index in range(len(items))]
+    valid = []
+    for entry, item in zip(results, items):
+        if isinstance(item, dict) and 'task_id' in item:
+            entry['task_id'] = item['task_id']
+        item_error = item if isinstance(item, ParseError) else validate_submission(item)
+        if item_error:
+            entry.update(status='invalid', error=str(item_error))
+        else:
+            valid.append((entry, item))
+
     try:
-        # Get the message, user_id, conversation_id, user_notes, and user_score from the request
-        data = request.json
-        if not isinstance(data, dict):
-            return jsonify({'message': 'Invalid request format. Please provide a valid JSON object.'}), 400
+        statuses = store_task_results([item for _, item in valid])
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f"Error in submit_work_bulk: {str(e)}")
+        return jsonify({'error': 'An error occurred while processing the submission'}), 500
+    for (entry, _), status in zip(valid, statuses):
+        entry['status'] = status
+        if status == 'unknown':
+            entry['error'] = 'Unknown task_id'
 
-        message = data.get('message')
-        user_id = data.get('user_id')
-        conversation_id = data.get('conversation_id')
+    totals = {status: sum(1 for entry in results if entry['status'] == status)
+              for status in ('stored', 'duplicate', 'unknown', 'invalid')}
+    unknown_task_ids = list(dict.fromkeys(entry['task_id'] for entry in results if entry['status'] == 'unknown'))
+    return jsonify(dict(totals, results=results, unknown_task_ids=unknown_task_ids)), 200
 
-        if not message or not isinstance(message, str):
-            return jsonify({'message': 'Invalid or missing message. Please provide a non-empty string.'}), 400
-        if not user_id or not isinstance(user_id, str):
-            return jsonify({'message': 'Invalid or missing user_id. Please provide a non-empty string.'}), 400
-        if conversation_id and not isinstance(conversation_id, str):
-            return jsonify({'message': 'Invalid conversation_id. Please provide a string or omit it.'}), 400
+# Content types read as one JSON document per line by /submit/bulk
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
 
-        # Get or create user data
-        user = get_user(user_id)
-        if not user:
-            user = create_user(user_id, "New user.")
-            if not user:
-                return jsonify({'message': 'Failed to create user. Please try again later.'}), 500
+class ParseError(ValueError):
+    """
+    Stands in for a line of an NDJSON body that is not valid JSON.
+    """
 
-        db.session.commit()
+def parse_bulk_submission(req):
+    """
+    Read the results of a /submit/bulk request.
 
-        # Prepare user context
-        user_context = prepare_user_context(user)
+    Returns:
+        tuple: (items, error) where an unparseable NDJSON line becomes a ParseError item,
+        and error is None unless the body as a whole is unusable
+    """
+    if req.mimetype in NDJSON_MIMETYPES:
+        items = []
+        for number, line in enumerate(req.get_data(as_text=True).splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(ParseError(f'Line {number} is not valid JSON'))
+        return items, None
+
+    data = req.get_json(silent=True)
+    if not isinstance(data, list):
+        return None, 'Provide a JSON array of results, or NDJSON with Content-Type application/x-ndjson'
+    return data, None
+
+def validate_submission(item):
+    """
+    Check one submitted result.
 
-        # Retrieve previous conversation context if conversation_id is provided
-        conversation_context = get_conversation_context(conversation_id) if conversation_id else ""
+    Returns:
+        str: What is wrong with the result, or None if it is valid
+    """
+    if not isinstance(item, dict) or not all(field in item for field in ('task_id', 'result')):
+        return 'Missing required fields'
+    if not item['task_id'] or not isinstance(item['task_id'], str):
+        return 'task_id must be a non-empty string'
+    return None
 
-        # Create or retrieve OpenAI thread
-        thread = create_or_retrieve_thread(conversation_id)
-        if not thread:
-            return jsonify({'message': 'Failed to create or retrieve thread. Please try again later.'}), 500
+def store_task_results(items):
+    """
+    Store validated results in one transaction, keeping the first result for each task_id.
 
-        # Add message to OpenAI thread
-        if not add_message_to_thread(thread.id, user_context, conversation_context, message):
-            return jsonify({'message': 'Failed to add message to thread. Please try again later.'}), 500
+    Results for a task_id with no Task row are not stored. Rows go in with multi-row INSERT ... ON CONFLICT (task_id) DO NOTHING RETURNING
+    task_id, SUBMIT_INSERT_CHUNK rows per statement, so a retried submission is
+    skipped by the database without a lookup first. The results' tasks are marked
+    completed in the same transaction.
 
-        # Run the assistant and get reply
-        ai_reply, updated_notes, updated_score = run_assistant(thread.id, user)
-        if ai_reply is None:
-            return jsonify({'message': 'No response from assistant. Please try again later.'}), 500
+    Returns:
+        list: 'stored', 'duplicate' or 'unknown' for each item, in order
+    """
+    first_seen = {}
+    for index, item in enumerate(items):
+        first_seen.setdefault(item['task_id'], index)
+    if not first_seen:
+        return []
+
+    task_ids = list(first_seen)
+    known = set()
+    for start in range(0, len(task_ids), SUBMIT_INSERT_CHUNK):
+        known.update(db.session.execute(
+            db.select(Task.task_id).where(Task.task_id.in_(task_ids[start:start + SUBMIT_INSERT_CHUNK]))
+        ).scalars())
+    statuses = ['duplicate' if item['task_id'] in known else 'unknown' for item in items]
+
+    now = datetime.utcnow()
+    rows = [{'task_id': task_id, 'result': json.dumps(items[index]['result']), 'submitted_at': now}
+            for task_id, index in first_seen.items() if task_id in known]
+
+    stored = set()
+    for start in range(0, len(rows), SUBMIT_INSERT_CHUNK):
+        stored.update(insert_new_task_results(rows[start:start + SUBMIT_INSERT_CHUNK]))
+
+    for start in range(0, len(rows), SUBMIT_INSERT_CHUNK):
+        chunk = [row['task_id'] for row in rows[start:start + SUBMIT_INSERT_CHUNK] if row['task_id'] in stored]
+        if chunk:
+            Task.query.filter(Task.task_id.in_(chunk), Task.status != 'completed').update(
+                {'status': 'completed', 'lease_holder': None}, synchronize_session=False
+            )
+    db.session.commit()
 
-        # Update user information
-        user.user_notes = updated_notes  # Update user_notes with the new information
+    for task_id in stored:
+        statuses[first_seen[task_id]] = 'stored'
+    return statuses
 
-        # Ensure updated_score is an integer and apply the change
-        try:
-            score_change = int(updated_score)
-            old_score = user.user_score
-            user.user_score = max(0, min(old_score + score_change, 1000))  # Ensure score is between 0 and 1000
-            app.logger.info(f"User score updated: {old_score} -> {user.user_score} (change: {score_change})")
-        except ValueError:
-            app.logger.error(f"Invalid score_change value: {updated_score}")
-            score_change = 0
+def insert_new_task_results(rows):
+    """
+    Insert result rows whose task_id has no result yet, in the current transaction.
 
-        db.session.commit()
+    Returns:
+        list: The task_ids inserted
+    """
+    dialect = db.engine.dialect
+    upsert = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}.get(dialect.name)
+    if upsert and getattr(dialect, 'insert_returning', False):
+        statement = upsert(TaskResult).values(rows).on_conflict_do_nothing(index_elements=['task_id']) \
+            .returning(TaskResult.task_id)
+        return db.session.execute(statement).scalars().all()
+
+    # Without ON CONFLICT ... RETURNING, look up the existing results first
+    existing = set(db.session.execute(
+        db.select(TaskResult.task_id).where(TaskResult.task_id.in_([row['task_id'] for row in rows]))
+    ).scalars())
+    new_rows = [row for row in rows if row['task_id'] not in existing]
+    if new_rows:
+        db.session.execute(db.insert(TaskResult), new_rows)
+    return [row['task_id'] for row in new_rows]
 
-        # Save or update the conversation and messages in the database
-        new_conversation_id = save_conversation_and_messages(user_id, conversation_id, message, ai_reply, thread.id)
-        if not new_conversation_id:
-            return jsonify({'message': 'Failed to save conversation. Please try again later.'}), 500
+# Define the route for the chat endpoint
+@bp.route('/api/chat', methods=['POST'])
+def chat():
+    """
+    Endpoint to handle chat messages using the OpenAI API.
 
-        return jsonify({
-            'message': ai_reply,
-            'conversation_id': new_conversation_id,
-            'updated_score': user.user_score,
-            'score_change': score_change,
-            'user_notes': user.user_notes
-        })
+    Returns:
+        JSON: The response from the OpenAI API including updated user information
+    """
+    try:
+        # Get the message, user_id, conversation_id, user_notes, and user_score from the request
+        data = request.json
+        message, user_id, conversation_id, error = parse_chat_request(data)
+        if error:
+            return jsonify({'message': error}), 400
+
+        # In job mode, queue the turn for the worker pool and return the job id at once
+        if data.get('async'):
+            payload, status = enqueue_chat_job(user_id, conversation_id, message)
+            return jsonify(payload), status
+
+        # Turns on an existing conversation are serialized and may be answered together
+        if conversation_id:
+            payload, status = run_serialized_turn(user_id, conversation_id, message)
+        else:
+            payload, status = process_chat_turn(user_id, conversation_id, message)
+        if status == 503 and 'retry_after' in payload:
+            return jsonify(payload), status, {'Retry-After': str(payload['retry_after'])}
+        return jsonify(payload), status
 
     except Exception as e:
         import traceback
         error_message = f"An error occurred: {str(e)}\n\nTraceback:\n{traceback.format_exc()}"
-        app.logger.error(error_message)
+        logger.error(error_message)
         return jsonify({'message': f"I apologize, but an error occurred while processing your request. Here are the details:\n\n{error_message}"}), 500
 
-def get_user(user_id):
-    return User.query.filter_by(user_id=user_id).first()
+# Define the route for polling queued chat jobs
+@bp.route('/api/chat/jobs/<job_id>', methods=['GET'])
+def get_chat_job(job_id):
+    """
+    Endpoint to fetch the result of a chat turn queued with {"async": true}.
 
-def prepare_user_context(user):
-    return f"User's name: {user.user_id}\nUser score: {user.user_score}\nUser notes: {user.user_notes}"
+    Pass ?wait=<seconds> to long-poll until the job finishes or the wait elapses.
 
-def get_conversation_context(conversation_id):
-    previous_messages = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.timestamp).all()
-    return "\n".join([f"{'User' if i%2==0 else 'AI'}: {msg.content}" for i, msg in enumerate(previous_messages)])
+    Returns:
+        JSON: The /api/chat response once the job has finished, otherwise the job status
+    """
+    wait = max(0.0, min(request.args.get('wait', 0, type=float), CHAT_JOB_MAX_WAIT))
 
-def create_or_retrieve_thread(conversation_id):
-    return client.beta.threads.create() if not conversation_id else client.beta.threads.retrieve(conversation_id)
+    job = long_poll(lambda: get_chat_job_row(job_id), chat_job_settled, wait, event=chat_job_events.get(job_id))
+    payload, status = chat_job_outcome(job)
+    return jsonify(payload), status
 
-def add_message_to_thread(thread_id, user_context, conversation_context, message):
-    max_retries = 3
-    retry_delay = 2  # seconds
-    for attempt in range(max_retries):
-        try:
-            client.beta.threads.messages.create(
-                thread_id=thread_id,
-                role="user",
-                content=f"{user_context}\n\nPrevious conversation:\n{conversation_context}\n\nUser message: {message}"
-            )
-            return True
-        except Exception as e:
-            if "Can't add messages to thread" in str(e) and "while a run is active" in str(e):
-                if attempt < max_retries - 1:
-                    print(f"Run is active. Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                    continue
-            print(f"Error adding message to thread (attempt {attempt + 1}/{max_retries}): {str(e)}")
-    return False
+# Define the route for the streaming chat endpoint
+@bp.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Endpoint to handle chat messages as a server-sent event stream.
 
-def run_assistant(thread_id, user):
-    max_retries = 3
-    retry_delay = 2
+    Emits a 'token' event for each chunk of assistant text as it arrives, then a
+    closing 'done' event carrying the same JSON payload as /api/chat. Failures
+    after the stream has started are reported as an 'error' event.
 
-    for attempt in range(max_retries):
-        try:
-            app.logger.info(f"Attempt {attempt + 1}/{max_retries} to run assistant")
-            run = client.beta.threads.runs.create(
-                thread_id=thread_id,
-                assistant_id="asst_C1QfXGVcUf2Vb36DZjqU1Ayb",  # Replace with your actual assistant ID
-                instructions="""You are the Dark Lord Cthulhu. Consider the user's important notes, preferences, and previous conversation when responding. Find out what their desires are, and how they can serve the dark mission.
+    Returns:
+        Response: A text/event-stream response
+    """
+    message, user_id, conversation_id, error = parse_chat_request(request.json)
+    if error:
+        return jsonify({'message': error}), 400
 
-                Provide your response in the following JSON format:
-                {
-                    "reply": "Your message to the user",
-                    "updated_notes": "New and interesting information about the user, focusing on their capabilities and desires",
-                    "score_change": "An integer between -100 and 100 representing how useful the interaction was"
-                }"""
-            )
+    def generate():
+        started = time.perf_counter()
+        status = 500
+        try:
+            with deadline(CHAT_TURN_DEADLINE):
+                if conversation_id:
+                    events = stream_serialized_turn(user_id, conversation_id, message)
+                else:
+                    events = stream_chat_turn(user_id, conversation_id, message)
+                # If the client disconnects, closing the events lets the turn record its jobs and release its lease
+                with closing(events):
+                    for kind, value in events:
+                        if kind == 'token':
+                            yield sse_event('token', {'text': value})
+                        else:
+                            payload, status = value
+            if status == 200:
+                yield sse_event('done', payload)
+            else:
+                yield sse_event('error', dict(payload, status=status))
+        except CircuitOpen as e:
+            payload, status = service_unavailable(e)
+            yield sse_event('error', dict(payload, status=status))
+        except Exception as e:
+            if is_deadline_expired(e):
+                logger.warning(f"Chat stream ran out of its {CHAT_TURN_DEADLINE}s deadline: {str(e)}")
+                payload, status = turn_timed_out()
+                yield sse_event('error', dict(payload, status=status))
+                return
+            logger.exception(f"Error in chat stream: {str(e)}")
+            yield sse_event('error', {'message': f"An error occurred: {str(e)}"})
+        finally:
+            chat_turn_seconds.observe(time.perf_counter() - started, status=str(status))
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def stream_chat_turn(user_id, conversation_id, message):
+    """
+    Run one chat turn, yielding ('token', text) for each chunk of the reply and
+    finally ('result', (payload, status_code)), as from process_chat_turn.
+    """
+    turn, error, status = start_chat_turn(user_id, conversation_id, message)
+    if error:
+        yield 'result', ({'message': error}, status)
+        return
+
+    result = None
+    for kind, value in stream_assistant(turn.thread_id):
+        if kind == 'token':
+            yield kind, value
+        else:
+            result = value
 
-            app.logger.info(f"Run created with ID: {run.id}")
+    ai_reply, updated_notes, updated_score = result
+    payload = finish_chat_turn(turn, message, ai_reply, updated_notes, updated_score)
+    if not payload:
+        yield 'result', ({'message': 'Failed to save conversation. Please try again later.'}, 500)
+        return
+    yield 'result', (payload, 200)
 
-            while run.status not in ["completed", "failed"]:
-                time.sleep(1)  # Short delay to avoid excessive API calls
-                run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
-                app.logger.debug(f"Run status: {run.status}")
+def stream_serialized_turn(user_id, conversation_id, message):
+    """
+    Stream a turn on an existing conversation under its lease (see chat_flow.stream_serialized_turn).
 
-            if run.status == "failed":
-                raise Exception(f"Run failed: {run.last_error}")
+    Yields the same events as stream_chat_turn; only the result if another turn holds the lease.
+    """
+    return stream_flow(chat_flow.stream_serialized_turn(chat_steps(), user_id, conversation_id, message))
 
-            messages = client.beta.threads.messages.list(thread_id=thread_id)
-            latest_message = next((msg.content[0].text.value for msg in messages if msg.role == "assistant"), None)
+def parse_chat_request(data):
+    """
+    Validate a chat request body.
 
-            app.logger.info(f"Raw API response: {latest_message}")
+    Returns:
+        tuple: (message, user_id, conversation_id, error) where error is None if the request is valid
+    """
+    if not isinstance(data, dict):
+        return None, None, None, 'Invalid request format. Please provide a valid JSON object.'
 
-            if latest_message:
-                try:
-                    parsed_response = json.loads(latest_message)
-                    app.logger.info(f"Parsed response: {parsed_response}")
+    message = data.get('message')
+    user_id = data.get('user_id')
+    conversation_id = data.get('conversation_id')
 
-                    reply = parsed_response.get("reply", "")
-                    updated_notes = parsed_response.get("updated_notes", "")
-                    score_change = parsed_response.get("score_change", 0)
+    if not message or not isinstance(message, str):
+        return None, None, None, 'Invalid or missing message. Please provide a non-empty string.'
+    if not user_id or not isinstance(user_id, str):
+        return None, None, None, 'Invalid or missing user_id. Please provide a non-empty string.'
+    if conversation_id and not isinstance(conversation_id, str):
+        return None, None, None, 'Invalid conversation_id. Please provide a string or omit it.'
 
-                    app.logger.info(f"Extracted reply: {reply[:50]}...")
-                    app.logger.info(f"Extracted updated_notes: {updated_notes[:50]}...")
-                    app.logger.info(f"Extracted score_change: {score_change}")
+    return message, user_id, conversation_id, None
 
-                    # Ensure score_change is an integer
-                    try:
-                        score_change = int(score_change)
-                        app.logger.info(f"Converted score_change to int: {score_change}")
-                    except ValueError:
-                        app.logger.warning(f"Invalid score_change value: {score_change}. Setting to 0.")
-                        score_change = 0
+def process_chat_turn(user_id, conversation_id, message):
+    """
+    Run one chat turn end to end: post the message, run the assistant and save the result.
 
-                    # Clamp score_change between -100 and 100
-                    original_score_change = score_change
-                    score_change = max(-100, min(100, score_change))
-                    if score_change != original_score_change:
-                        app.logger.info(f"Clamped score_change from {original_score_change} to {score_change}")
+    All OpenAI calls made by the turn share one CHAT_TURN_DEADLINE budget, and
+    the turn is refused with 503 while the OpenAI circuit breaker is open.
 
-                    return reply, updated_notes, score_change
-                except json.JSONDecodeError:
-                    app.logger.error(f"Failed to parse JSON: {latest_message}")
-                    app.logger.error(f"JSON parse error. Raw message: {latest_message}")
-                    return f"Error: Unable to parse response. Raw message: {latest_message}", "", 0
+    Returns:
+        tuple: (payload, status_code) for the /api/chat response
+    """
+    started = time.perf_counter()
+    try:
+        with deadline(CHAT_TURN_DEADLINE):
+            payload, status = _process_chat_turn(user_id, conversation_id, message)
+    except CircuitOpen as e:
+        payload, status = service_unavailable(e)
+    except Exception as e:
+        if not is_deadline_expired(e):
+            raise
+        logger.warning(f"Chat turn ran out of its {CHAT_TURN_DEADLINE}s deadline: {str(e)}")
+        payload, status = turn_timed_out()
+    chat_turn_seconds.observe(time.perf_counter() - started, status=str(status))
+    return payload, status
+
+def _process_chat_turn(user_id, conversation_id, message):
+    # Get or create the user and post the message to the OpenAI thread
+    turn, error, status = start_chat_turn(user_id, conversation_id, message)
+    if error:
+        return {'message': error}, status
+
+    # Run the assistant and get reply; no database connection is held meanwhile
+    ai_reply, updated_notes, updated_score = run_assistant(turn.thread_id, turn.user)
+    if ai_reply is None:
+        return {'message': 'No response from assistant. Please try again later.'}, 500
+
+    # Update the user and save the conversation
+    result = finish_chat_turn(turn, message, ai_reply, updated_notes, updated_score)
+    if not result:
+        return {'message': 'Failed to save conversation. Please try again later.'}, 500
+
+    return result, 200
+
+# Background worker pool for chat turns queued in job mode
+chat_executor = BoundedExecutor(CHAT_WORKERS, CHAT_MAX_PENDING, thread_name_prefix='chat')
+
+# Completion events for jobs running in this process, so local long-polls wake immediately
+chat_job_events = {}
+chat_job_events_lock = threading.Lock()
+
+def enqueue_chat_job(user_id, conversation_id, message):
+    """
+    Record a chat turn as a job and hand it to the worker pool.
 
-            app.logger.warning("No response from assistant")
-            return "Error: No response from assistant", "", 0
+    Returns:
+        tuple: (payload, status_code) with the job id, or 503 if the pool is full
+    """
+    job_id = queue_chat_message(user_id, conversation_id, message)
 
-        except Exception as e:
-            app.logger.error(f"Error in run_assistant (attempt {attempt + 1}/{max_retries}): {str(e)}")
-            app.logger.exception("Full traceback:")
-            if attempt < max_retries - 1:
-                time.sleep(retry_delay)
-            else:
-                app.logger.error("Max retries reached. Failing.")
-                return f"Error: Max retries reached. Last error: {str(e)}", "", 0
+    with chat_job_events_lock:
+        chat_job_events[job_id] = threading.Event()
 
-def save_conversation_and_messages(user_id, conversation_id, user_message, ai_reply, thread_id):
-    if not conversation_id:
-        new_conversation = Conversation(conversation_id=str(thread_id), user_id=user_id)
-        db.session.add(new_conversation)
-        db.session.flush()  # Flush to get the new conversation ID
-        conversation_id = new_conversation.conversation_id
+    try:
+        chat_executor.submit(run_chat_job, current_app._get_current_object(), job_id)
+    except QueueFull:
+        with chat_job_events_lock:
+            chat_job_events.pop(job_id, None)
+        payload = {'message': 'Too many chat messages in progress. Please try again shortly.'}
+        # A turn already running on the conversation may have picked the message up meanwhile
+        failed = ChatJob.query.filter_by(job_id=job_id, status='queued').update({
+            'status': 'failed',
+            'status_code': 503,
+            'result': json.dumps(payload)
+        })
+        db.session.commit()
+        if failed:
+            return payload, 503
 
-    new_message = Message(conversation_id=conversation_id, content=user_message)
-    db.session.add(new_message)
+    return {'job_id': job_id, 'status': 'queued'}, 202
 
-    ai_message = Message(conversation_id=conversation_id, content=ai_reply)
-    db.session.add(ai_message)
+def queue_chat_message(user_id, conversation_id, message):
+    """
+    Record a chat message as a queued job.
 
+    Returns:
+        str: The job id
+    """
+    job = ChatJob(
+        job_id=generate_unique_id(),
+        user_id=user_id,
+        conversation_id=conversation_id,
+        message=message,
+        status='queued'
+    )
+    db.session.add(job)
     db.session.commit()
-    return conversation_id
+    return job.job_id
 
-# Serve React App
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
-def serve(path):
-    if path != "" and os.path.exists(app.static_folder + '/' + path):
-        return send_from_directory(app.static_folder, path)
-    else:
-        return send_from_directory(app.static_folder, 'index.html')
+def run_chat_job(app, job_id):
+    """
+    Worker entry point: run a queued chat turn and store its outcome on the job.
 
-# Create Tsathoth user route
-@app.route('/create_tsathoth', methods=['POST'])
-def create_tsathoth():
-    try:
-        user = get_user('Tsathoth')
+    A job on an existing conversation is run by draining the conversation, so it
+    may be answered together with other queued messages, or by another worker.
+    """
+    with app.app_context():
+        try:
+            job = ChatJob.query.filter_by(job_id=job_id).first()
+            if job.conversation_id:
+                drain_conversation(job.conversation_id)
+                return
+
+            job.status = 'running'
+            queued = [QueuedMessage(job.job_id, job.user_id, job.message)]
+            db.session.commit()
+            run_coalesced_turn(None, queued)
+        except Exception as e:
+            logger.exception(f"Error running chat job {job_id}: {str(e)}")
+            notify_chat_jobs([job_id])
+        finally:
+            db.session.remove()
+
+def run_coalesced_turn(conversation_id, queued):
+    """
+    Answer one or more queued messages with a single chat turn and record the result on each job.
+    """
+    run_flow(chat_flow.run_coalesced_turn(chat_steps(), conversation_id, queued))
+
+def record_chat_job_results(job_ids, payload, status):
+    """
+    Store the outcome of a turn on its jobs and wake their local long-polls.
+    """
+    try:
+        # Record the outcome with a fresh statement, whatever state the turn left the session in
+        db.session.rollback()
+        ChatJob.query.filter(ChatJob.job_id.in_(job_ids)).update({
+            'status': 'completed' if status == 200 else 'failed',
+            'status_code': status,
+            'result': json.dumps(payload)
+        }, synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f"Error recording chat jobs {job_ids}: {str(e)}")
+    finally:
+        notify_chat_jobs(job_ids)
+
+def notify_chat_jobs(job_ids):
+    for job_id in job_ids:
+        with chat_job_events_lock:
+            event = chat_job_events.pop(job_id, None)
+        if event:
+            event.set()
+
+def wait_for_chat_job(job_id, conversation_id, timeout):
+    """
+    Wait for a queued message to be answered by whichever turn holds its conversation's lease.
+
+    If that turn's worker dies, the lease lapses and the waiter drains the conversation itself.
+
+    Returns:
+        tuple: (payload, status_code); 202 with the job id if the wait elapsed first
+    """
+    with chat_job_events_lock:
+        event = chat_job_events.setdefault(job_id, threading.Event())
+
+    steps = chat_steps()
+    try:
+        job = long_poll(
+            lambda: run_flow(chat_flow.fetch_chat_job(steps, job_id, conversation_id)),
+            chat_job_settled,
+            timeout,
+            event=event
+        )
+    finally:
+        with chat_job_events_lock:
+            chat_job_events.pop(job_id, None)
+    return chat_job_outcome(job)
+
+def get_chat_job_row(job_id):
+    db.session.rollback()  # End the previous read so every poll sees fresh rows
+    return ChatJob.query.filter_by(job_id=job_id).first()
+
+# Turns on an existing conversation run one at a time across all workers: every message is
+# recorded as a ChatJob, and only the holder of the conversation's lease starts assistant runs.
+# The lease is a row rather than an advisory lock, so no connection is held during the run.
+QueuedMessage = namedtuple('QueuedMessage', ['job_id', 'user_id', 'message'])
+
+def chat_steps():
+    """
+    The steps chat_flow's lease and drain loop runs with, as plain calls in the current app context.
+
+    Built per call, so the flows use whatever the module's functions are at the time.
+    """
+    return ChatSteps(
+        queue_message=queue_chat_message,
+        acquire_lease=acquire_conversation_lease,
+        renew_lease=renew_conversation_lease,
+        release_lease=release_conversation_lease,
+        is_leased=conversation_is_leased,
+        claim_queued=claim_queued_messages,
+        has_queued=has_queued_messages,
+        get_job=get_chat_job_row,
+        record_results=record_chat_job_results,
+        process_turn=process_chat_turn,
+        stream_turn=stream_chat_turn,
+        next_event=lambda events: next(events, None),
+        close_stream=lambda events: events.close(),
+        wait_for_job=wait_for_chat_job,
+        schedule_drain=schedule_conversation_drain
+    )
+
+def run_serialized_turn(user_id, conversation_id, message):
+    """
+    Run a chat turn on an existing conversation, one run at a time per conversation.
+
+    Returns:
+        tuple: (payload, status_code) for the /api/chat response
+    """
+    return run_flow(chat_flow.run_serialized_turn(chat_steps(), user_id, conversation_id, message))
+
+def drain_conversation(conversation_id):
+    """
+    Run a conversation's queued messages, up to CHAT_COALESCE_MAX per run, until none are left.
+
+    Returns at once if another turn holds the conversation's lease; that turn
+    drains the messages instead.
+    """
+    run_flow(chat_flow.drain_conversation(chat_steps(), conversation_id))
+
+def run_conversation_drain(app, conversation_id):
+    """
+    Worker entry point: drain a conversation's queued messages.
+    """
+    with app.app_context():
+        try:
+            drain_conversation(conversation_id)
+        except Exception as e:
+            logger.exception(f"Error draining conversation {conversation_id}: {str(e)}")
+        finally:
+            db.session.remove()
+
+def schedule_conversation_drain(conversation_id):
+    try:
+        chat_executor.submit(run_conversation_drain, current_app._get_current_object(), conversation_id)
+    except QueueFull:
+        # Waiting requests drain the conversation themselves
+        logger.warning(f"Chat pool full; not draining conversation {conversation_id} in the background")
+
+def acquire_conversation_lease(conversation_id):
+    """
+    Take a conversation's lease if it is free or has expired.
+
+    Returns:
+        str: A holder token for renewing and releasing the lease, or None if another turn holds it
+    """
+    holder = generate_unique_id()
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=CONVERSATION_LEASE_TTL)
+    try:
+        db.session.add(ConversationLease(conversation_id=conversation_id, holder=holder, expires_at=expires_at))
+        db.session.commit()
+        return holder
+    except IntegrityError:
+        db.session.rollback()
+
+    # Take over a lease left behind by a worker that died mid-turn
+    taken = ConversationLease.query.filter(
+        ConversationLease.conversation_id == conversation_id,
+        ConversationLease.expires_at < now
+    ).update({'holder': holder, 'expires_at': expires_at}, synchronize_session=False)
+    db.session.commit()
+    return holder if taken else None
+
+def renew_conversation_lease(conversation_id, holder):
+    """
+    Extend a held lease by CONVERSATION_LEASE_TTL, before starting another run or while a turn streams.
+
+    Returns:
+        bool: False if the lease expired and was taken over
+    """
+    renewed = ConversationLease.query.filter_by(conversation_id=conversation_id, holder=holder).update(
+        {'expires_at': datetime.utcnow() + timedelta(seconds=CONVERSATION_LEASE_TTL)},
+        synchronize_session=False
+    )
+    db.session.commit()
+    return bool(renewed)
+
+def release_conversation_lease(conversation_id, holder):
+    db.session.rollback()  # Drop whatever the turn left in the session
+    ConversationLease.query.filter_by(conversation_id=conversation_id, holder=holder).delete(synchronize_session=False)
+    db.session.commit()
+
+def conversation_is_leased(conversation_id):
+    return db.session.query(ConversationLease.query.filter(
+        ConversationLease.conversation_id == conversation_id,
+        ConversationLease.expires_at >= datetime.utcnow()
+    ).exists()).scalar()
+
+def has_queued_messages(conversation_id):
+    return db.session.query(
+        ChatJob.query.filter_by(conversation_id=conversation_id, status='queued').exists()
+    ).scalar()
+
+def claim_queued_messages(conversation_id):
+    """
+    Mark up to CHAT_COALESCE_MAX of a conversation's queued messages as running.
+
+    Only the lease holder calls this, so no two turns claim the same message.
+
+    Returns:
+        list: QueuedMessage tuples, oldest first
+    """
+    jobs = ChatJob.query.filter_by(conversation_id=conversation_id, status='queued') \
+        .order_by(ChatJob.id).limit(CHAT_COALESCE_MAX).all()
+    queued = [QueuedMessage(job.job_id, job.user_id, job.message) for job in jobs]
+    if queued:
+        ChatJob.query.filter(ChatJob.id.in_([job.id for job in jobs])).update(
+            {'status': 'running'}, synchronize_session=False
+        )
+    db.session.commit()
+    return queued
+
+# State carried from the read phase of a chat turn to its write phase
+ChatTurn = namedtuple('ChatTurn', ['user', 'conversation_id', 'context_summary', 'recent_messages', 'thread_id'])
+
+def read_chat_turn(user_id, conversation_id):
+    """
+    Read phase of a chat turn: get or create the user and load the conversation's stored context.
+
+    The database session is closed before returning, so no connection is held
+    while the turn waits on OpenAI.
+
+    Returns:
+        tuple: (user, state, error) where state is as from load_conversation_state, and
+        error is None on success or a message to return with a 500
+    """
+    with chat_phase_seconds.time(phase='read'):
+        user = get_cached_user(user_id)
+        if not user:
+            user = create_user(user_id, "New user.")
+            if not user:
+                return None, None, 'Failed to create user. Please try again later.'
+            user = get_cached_user(user_id)
+
+        state = load_conversation_state(conversation_id) if conversation_id else None
+
+        # Return the connection to the pool before talking to OpenAI
+        db.session.close()
+    return user, state, None
+
+def start_chat_turn(user_id, conversation_id, message):
+    """
+    Read what a chat turn needs from the database, then post the message to the OpenAI thread.
+
+    Returns:
+        tuple: (turn, error, status) where turn is a ChatTurn, and error is None on
+        success or a message to return with the HTTP status
+    """
+    user, state, error = read_chat_turn(user_id, conversation_id)
+    if error:
+        return None, error, 500
+    context_summary, recent_messages = state if state else (None, [])
+
+    # The prepared user context is cached with the user
+    user_context = user.context
+    conversation_context = build_context(context_summary, CONTEXT_TOKEN_BUDGET)
+
+    try:
+        # Create or retrieve OpenAI thread
+        with chat_phase_seconds.time(phase='thread'):
+            thread_id = create_or_retrieve_thread(conversation_id, conversation_stored=state is not None)
+        if not thread_id:
+            return None, 'Failed to create or retrieve thread. Please try again later.', 500
+
+        # Add message to OpenAI thread
+        with chat_phase_seconds.time(phase='add_message'):
+            added = add_message_to_thread(thread_id, user_context, conversation_context, message)
+        if not added:
+            return None, 'Failed to add message to thread. Please try again later.', 500
+    except Exception as e:
+        # openai.NotFoundError, told apart by status so that importing app does not import openai
+        if status_code_of(e) != 404:
+            raise
+        return (None,) + thread_missing(conversation_id)
+
+    return ChatTurn(user, conversation_id, context_summary, recent_messages, thread_id), None, None
+
+def thread_missing(conversation_id):
+    """
+    Stop treating a conversation's thread as valid after OpenAI reported it deleted.
+
+    Returns:
+        tuple: (error, status) for the chat response
+    """
+    known_threads.invalidate(conversation_id)
+    logger.warning(f"OpenAI thread for conversation {conversation_id} no longer exists")
+    return 'Conversation not found. Please start a new conversation.', 404
+
+def finish_chat_turn(turn, message, ai_reply, updated_notes, updated_score):
+    """
+    Apply the assistant's notes and score change to the user and save the exchange.
+
+    The user, the conversation and both messages are written in a single
+    transaction. Any summarizing of the conversation context happens before
+    that transaction opens.
+
+    Returns:
+        dict: The chat response payload, or None if the conversation could not be saved
+    """
+    # Ensure updated_score is an integer
+    try:
+        score_change = int(updated_score)
+    except ValueError:
+        logger.error(f"Invalid score_change value: {updated_score}")
+        score_change = 0
+
+    # Fold the turn into the conversation context; this may call the summarizer
+    with chat_phase_seconds.time(phase='summarize'):
+        context_summary, recent_messages = advance_conversation_context(turn, message, ai_reply)
+
+    # Write phase: one transaction for the user, the conversation and both messages
+    old_score = turn.user.user_score
+    try:
+        with chat_phase_seconds.time(phase='persist'):
+            user = update_user_profile(turn.user, updated_notes, score_change)
+            new_conversation_id = save_conversation_and_messages(
+                user.user_id, turn.conversation_id, message, ai_reply, turn.thread_id, context_summary, recent_messages
+            )
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        user_cache.invalidate(turn.user.user_id)
+        raise
+    finally:
+        db.session.close()
+
+    # Write the committed profile through to the user cache
+    user_cache.set(user.user_id, user)
+    logger.info(f"User score updated: {old_score} -> {user.user_score} (change: {score_change})")
+
+    if not new_conversation_id:
+        return None
+
+    return {
+        'message': ai_reply,
+        'conversation_id': new_conversation_id,
+        'updated_score': user.user_score,
+        'score_change': score_change,
+        'user_notes': user.user_notes
+    }
+
+def sse_event(event, data):
+    """
+    Format a server-sent event with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def prepare_user_context(user):
+    return f"User's name: {user.user_id}\nUser score: {user.user_score}\nUser notes: {user.user_notes}"
+
+def load_conversation_state(conversation_id):
+    """
+    Read a conversation's stored summary and recent-message window.
+
+    Returns:
+        tuple: (context_summary, recent_messages), or None if the conversation is not stored
+    """
+    row = db.session.query(Conversation.context_summary, Conversation.recent_messages) \
+        .filter_by(conversation_id=conversation_id).first()
+    if not row:
+        return None
+    return row.context_summary, load_recent(row.recent_messages)
+
+def advance_conversation_context(turn, user_message, ai_reply):
+    """
+    Add a turn to the conversation's recent window, folding older turns into its summary.
+
+    Returns:
+        tuple: (context_summary, recent_messages) to store on the conversation
+    """
+    return advance_window(
+        turn.context_summary,
+        turn.recent_messages,
+        [{'role': 'User', 'content': user_message}, {'role': 'AI', 'content': ai_reply}],
+        CONTEXT_RECENT_MESSAGES,
+        summarize_conversation
+    )
+
+def summarize_conversation(summary, messages):
+    """
+    Fold messages into a conversation summary, falling back to plain truncation if the API call fails.
+    """
+    try:
+        response = call_openai(
+            get_client().chat.completions.create,
+            model="gpt-3.5-turbo",
+            max_tokens=CONTEXT_TOKEN_BUDGET,
+            messages=[
+                {"role": "system", "content": "You maintain a running summary of a conversation between a user and the Dark Lord Cthulhu. Merge the new messages into the summary, keeping what is learned about the user's desires, capabilities and commitments. Respond with only the updated summary."},
+                {"role": "user", "content": f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n{format_messages(messages)}"}
+            ]
+        )
+        record_token_usage('summarize', getattr(response, 'usage', None))
+        return truncate_to_tokens(response.choices[0].message.content.strip(), CONTEXT_TOKEN_BUDGET)
+    except Exception as e:
+        logger.error(f"Error summarizing conversation: {str(e)}")
+        return extractive_summary(summary, messages, CONTEXT_TOKEN_BUDGET)
+
+# OpenAI thread ids known to exist. A conversation's id is its thread's id, so stored
+# conversations resolve locally; entries are dropped when OpenAI reports a thread missing.
+known_threads = TTLCache(THREAD_CACHE_SIZE, THREAD_CACHE_TTL)
+
+def create_or_retrieve_thread(conversation_id, conversation_stored=False):
+    """
+    Resolve the OpenAI thread id for a conversation, creating a thread for a new conversation.
+
+    Only a conversation_id that is neither stored locally nor already known is
+    looked up on OpenAI; a thread deleted remotely surfaces as a 404 error
+    from the next call that uses it.
+    """
+    thread_id = known_thread_id(conversation_id, conversation_stored, known_threads)
+    if thread_id:
+        return thread_id
+
+    if conversation_id:
+        thread = call_openai(get_client().beta.threads.retrieve, conversation_id)
+    else:
+        thread = call_openai(get_client().beta.threads.create)
+    known_threads.set(thread.id, True)
+    return thread.id
+
+def add_message_to_thread(thread_id, user_context, conversation_context, message):
+    try:
+        call_openai(
+            get_client().beta.threads.messages.create,
+            thread_id=thread_id,
+            role="user",
+            content=format_thread_message(user_context, conversation_context, message),
+            retry_busy=is_run_active_error
+        )
+        return True
+    except CircuitOpen:
+        raise
+    except Exception as e:
+        if status_code_of(e) == 404:
+            raise
+        logger.error(f"Error adding message to thread {thread_id}: {str(e)}")
+        return False
+
+def format_thread_message(user_context, conversation_context, message):
+    if conversation_context:
+        return f"{user_context}\n\nSummary of earlier conversation:\n{conversation_context}\n\nUser message: {message}"
+    return f"{user_context}\n\nUser message: {message}"
+
+def cancel_run(thread_id, run_id):
+    """
+    Cancel a run that is waiting on tool output, so it stops blocking the thread.
+    """
+    try:
+        call_openai(get_client().beta.threads.runs.cancel, thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        logger.warning(f"Could not cancel run {run_id}: {str(e)}")
+
+def run_assistant(thread_id, user):
+    """
+    Run the assistant on a thread and wait for its reply.
+
+    API calls are retried by call_openai; a run that itself ends unsuccessfully is
+    started again after a jittered backoff, up to OPENAI_RETRY_ATTEMPTS runs and
+    within the turn's deadline.
+    """
+    max_runs = openai_retry.max_attempts
+
+    for attempt in range(max_runs):
+        try:
+            logger.info(f"Attempt {attempt + 1}/{max_runs} to run assistant")
+            with chat_phase_seconds.time(phase='assistant_run'):
+                run = call_openai(
+                    get_client().beta.threads.runs.create,
+                    thread_id=thread_id,
+                    assistant_id=ASSISTANT_ID,
+                    instructions=ASSISTANT_INSTRUCTIONS,
+                    truncation_strategy=ASSISTANT_TRUNCATION
+                )
+
+                logger.info(f"Run created with ID: {run.id}")
+
+                while run.status not in RUN_TERMINAL_STATUSES:
+                    time.sleep(1)  # Short delay to avoid excessive API calls
+                    run = call_openai(get_client().beta.threads.runs.retrieve, thread_id=thread_id, run_id=run.id)
+                    payload_logger.debug(f"Run status: {run.status}")
+
+                record_token_usage('assistant_run', getattr(run, 'usage', None))
+                if run.status == "requires_action":
+                    cancel_run(thread_id, run.id)
+                failure = run_failure(run)
+                if failure:
+                    raise failure
+
+                latest_message = get_run_reply(thread_id, run.id)
+
+            with chat_phase_seconds.time(phase='parse'):
+                return parse_assistant_response(latest_message)
+
+        except CircuitOpen:
+            raise
+        except Exception as e:
+            logger.exception(f"Error in run_assistant (attempt {attempt + 1}/{max_runs}): {str(e)}")
+            # Raises DeadlineExceeded rather than sleeping past the turn's deadline
+            delay = rerun_delay(e, attempt, openai_retry)
+            if delay is None:
+                logger.error("Max retries reached. Failing.")
+                return None, "", 0
+            time.sleep(delay)
+
+def stream_assistant(thread_id):
+    """
+    Run the assistant on a thread and stream its output.
+
+    Yields ('token', text) for each chunk of the reply field as it arrives, then a
+    single ('result', (reply, updated_notes, score_change)) once the run completes.
+    """
+    # Only starting the run is retried; once tokens have been sent a failure ends the stream
+    stream = call_openai(
+        get_client().beta.threads.runs.create,
+        thread_id=thread_id,
+        assistant_id=ASSISTANT_ID,
+        instructions=ASSISTANT_INSTRUCTIONS,
+        truncation_strategy=ASSISTANT_TRUNCATION,
+        stream=True
+    )
+
+    run = RunEvents()
+    started = time.perf_counter()
+    for event in stream:
+        text = run.feed(event)
+        if text:
+            yield 'token', text
+        if run.failure:
+            if run.cancel_run_id:
+                cancel_run(thread_id, run.cancel_run_id)
+            raise run.failure
+    record_token_usage('assistant_run', run.usage)
+
+    # Fall back to fetching this run's reply if the completed message was not streamed
+    latest_message = run.latest_message
+    if latest_message is None and run.run_id:
+        latest_message = get_run_reply(thread_id, run.run_id)
+    # Includes the time the client took to receive the streamed tokens
+    chat_phase_seconds.observe(time.perf_counter() - started, phase='assistant_run')
+
+    with chat_phase_seconds.time(phase='parse'):
+        result = parse_assistant_response(latest_message)
+    yield 'result', result
+
+def get_run_reply(thread_id, run_id):
+    """
+    Fetch the text of the assistant message produced by a single run.
+    """
+    messages = call_openai(get_client().beta.threads.messages.list, thread_id=thread_id, run_id=run_id, order="desc", limit=1)
+    return assistant_reply(messages)
+
+def parse_assistant_response(latest_message):
+    """
+    Parse the assistant's JSON reply into (reply, updated_notes, score_change).
+    """
+    payload_logger.debug(f"Raw API response: {latest_message}")
+
+    if latest_message:
+        try:
+            parsed_response = json.loads(latest_message)
+            payload_logger.debug(f"Parsed response: {parsed_response}")
+
+            reply = parsed_response.get("reply", "")
+            updated_notes = parsed_response.get("updated_notes", "")
+            score_change = parsed_response.get("score_change", 0)
+
+            payload_logger.debug(f"Extracted reply: {reply[:50]}...")
+            payload_logger.debug(f"Extracted updated_notes: {updated_notes[:50]}...")
+            payload_logger.debug(f"Extracted score_change: {score_change}")
+
+            # Ensure score_change is an integer
+            try:
+                score_change = int(score_change)
+                payload_logger.debug(f"Converted score_change to int: {score_change}")
+            except ValueError:
+                logger.warning(f"Invalid score_change value: {score_change}. Setting to 0.")
+                score_change = 0
+
+            # Clamp score_change between -100 and 100
+            original_score_change = score_change
+            score_change = max(-100, min(100, score_change))
+            if score_change != original_score_change:
+                logger.info(f"Clamped score_change from {original_score_change} to {score_change}")
+
+            return reply, updated_notes, score_change
+        except json.JSONDecodeError:
+            assistant_parse_failures.inc()
+            logger.error(f"Failed to parse JSON: {latest_message}")
+            logger.error(f"JSON parse error. Raw message: {latest_message}")
+            return f"Error: Unable to parse response. Raw message: {latest_message}", "", 0
+
+    logger.warning("No response from assistant")
+    return "Error: No response from assistant", "", 0
+
+def save_conversation_and_messages(user_id, conversation_id, user_message, ai_reply, thread_id, context_summary, recent_messages):
+    """
+    Stage the conversation and both messages of a turn in the current transaction; the caller commits.
+    """
+    conversation = Conversation.query.filter_by(conversation_id=conversation_id).first() if conversation_id else None
+    if not conversation:
+        conversation = Conversation(conversation_id=conversation_id or str(thread_id), user_id=user_id)
+        db.session.add(conversation)
+        db.session.flush()  # Flush to get the new conversation ID
+        conversation_id = conversation.conversation_id
+
+    conversation.context_summary = context_summary
+    conversation.recent_messages = dump_recent(recent_messages)
+
+    new_message = Message(conversation_id=conversation_id, content=user_message)
+    db.session.add(new_message)
+
+    ai_message = Message(conversation_id=conversation_id, content=ai_reply)
+    db.session.add(ai_message)
+
+    db.session.flush()
+    return conversation_id
+
+# Route to report connection pool statistics
+@bp.route('/api/pool_stats', methods=['GET'])
+def get_pool_stats():
+    """
+    Endpoint to report this process's database connection pool usage.
+
+    Returns:
+        JSON: Checkout count, wait times and timeouts, plus live pool counts when pooling is on
+    """
+    stats = pool_stats.snapshot(db.engine.pool)
+    stats['pool_class'] = type(db.engine.pool).__name__
+    return jsonify(stats), 200
+
+# Route to report outbound HTTP latency
+@bp.route('/api/transport_stats', methods=['GET'])
+def get_transport_stats():
+    """
+    Endpoint to report this process's outbound HTTP calls per endpoint.
+
+    Returns:
+        JSON: Request and error counts and total/max latency, keyed by "METHOD host/path"
+    """
+    return jsonify(transport_stats.snapshot()), 200
+
+def collect_component_stats():
+    """
+    Report the pool, cache, transport and circuit breaker stats as Prometheus samples.
+    """
+    pool = pool_stats.snapshot(db.engine.pool)
+    yield 'db_pool_checkouts_total', 'counter', 'Database connection checkouts', [({}, pool['checkouts'])]
+    yield 'db_pool_timeouts_total', 'counter', 'Database connection checkouts that timed out', [({}, pool['timeouts'])]
+    yield 'db_pool_wait_seconds_total', 'counter', 'Time spent waiting for database connections', [({}, pool['wait_seconds_total'])]
+    if 'checked_out' in pool:
+        yield 'db_pool_checked_out', 'gauge', 'Database connections in use', [({}, pool['checked_out'])]
+
+    caches = {'user': user_cache.stats(), 'thread': known_threads.stats()}
+    for field, metric_type in (('hits', 'counter'), ('misses', 'counter'), ('evictions', 'counter'), ('size', 'gauge')):
+        name = f"cache_{field}_total" if metric_type == 'counter' else f"cache_{field}"
+        yield name, metric_type, f"Per-process cache {field}", [({'cache': cache}, stats[field]) for cache, stats in caches.items()]
+
+    endpoints = transport_stats.snapshot()
+    yield 'http_client_requests_total', 'counter', 'Outbound HTTP requests by endpoint', \
+        [({'endpoint': endpoint}, stats['requests']) for endpoint, stats in endpoints.items()]
+    yield 'http_client_errors_total', 'counter', 'Outbound HTTP requests that failed or returned 5xx', \
+        [({'endpoint': endpoint}, stats['errors']) for endpoint, stats in endpoints.items()]
+    yield 'http_client_seconds_total', 'counter', 'Time spent waiting on outbound HTTP requests', \
+        [({'endpoint': endpoint}, stats['seconds_total']) for endpoint, stats in endpoints.items()]
+
+    breaker = openai_breaker.snapshot()
+    yield 'openai_circuit_open', 'gauge', '1 while the OpenAI circuit breaker rejects calls', \
+        [({}, 1 if breaker['state'] == 'open' else 0)]
+    yield 'openai_circuit_rejections_total', 'counter', 'OpenAI calls rejected by the circuit breaker', [({}, breaker['rejected'])]
+
+metrics_registry.add_collector(collect_component_stats)
+
+# Route to expose Prometheus metrics
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Endpoint to expose this process's metrics in the Prometheus text format.
+
+    Each gunicorn worker keeps its own metrics, so scrape every worker or run one per instance.
+
+    Returns:
+        Response: text/plain Prometheus exposition
+    """
+    return Response(metrics_registry.render(), mimetype=None, content_type=METRICS_CONTENT_TYPE)
+
+asset_index_lock = threading.Lock()
+
+def get_asset_index():
+    """
+    The current app's index of the React build, read, hashed and compressed on the first static request.
+    """
+    extensions = current_app.extensions
+    if 'asset_index' not in extensions:
+        with asset_index_lock:
+            if 'asset_index' not in extensions:
+                extensions['asset_index'] = AssetIndex(current_app.static_folder)
+    return extensions['asset_index']
+
+# Serve React App
+@bp.route('/', defaults={'path': ''})
+@bp.route('/<path:path>')
+def serve(path):
+    """
+    Serve a file of the React build from the asset index, or index.html for client-side routes.
+
+    Hashed bundle files are cached as immutable; everything else is revalidated
+    by ETag. Gzip or brotli variants are chosen by Accept-Encoding.
+    """
+    asset_index = get_asset_index()
+    asset = asset_index.get(path) or asset_index.get('index.html')
+    if asset is None:
+        return jsonify({'error': 'Not found'}), 404
+
+    encoding = asset.choose_encoding({name: request.accept_encodings[name] for name in STATIC_ENCODINGS})
+    etag = asset.etag(encoding)
+    headers = {'Cache-Control': asset.cache_control, 'Vary': 'Accept-Encoding'}
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+    elif asset.bodies[encoding] is None:
+        # Too large to keep in memory; let the server stream it from disk
+        response = send_file(asset.path, mimetype=asset.content_type, conditional=False, etag=False)
+        response.headers.update(headers)
+    else:
+        response = Response(asset.bodies[encoding], mimetype=asset.content_type, headers=headers)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    return response
+
+@bp.cli.command('compress-assets')
+def compress_assets():
+    """
+    Write gzip/brotli variants next to the web build's files for a front proxy to serve directly.
+    """
+    click.echo(f"Wrote {get_asset_index().write_precompressed()} precompressed files")
+
+# Create Tsathoth user route
+@bp.route('/create_tsathoth', methods=['POST'])
+def create_tsathoth():
+    try:
+        user = get_user('Tsathoth')
         if not user:
             user = create_user('Tsathoth', "The Great Old One, Tsathoth.")
             if not user:
@@ -488,7 +1932,7 @@ def create_tsathoth():
         return jsonify({'error': str(e)}), 500
 
 # Create Hasturogtha user route
-@app.route('/create_hasturogtha', methods=['POST'])
+@bp.route('/create_hasturogtha', methods=['POST'])
 def create_hasturogtha():
     try:
         user = get_user('Hasturogtha')
@@ -500,14 +1944,23 @@ def create_hasturogtha():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# Run the Flask application if this script is executed directly
-if __name__ == '__main__':
-    # Start the Flask development server with debug mode enabled
-    app.run(debug=True)
-
 # File upload route
-@app.route('/upload', methods=['POST'])
+@bp.route('/upload', methods=['POST'])
 def upload_file():
+    """
+    Endpoint to upload a file for scoring.
+
+    The file is persisted and the response returned straight away; the OpenAI
+    upload and scoring run on a background worker unless the same content was
+    processed before. Poll /get_file_score/<file_id> for the result.
+
+    Returns:
+        JSON: The new file's id and score status
+    """
+    # Only this route takes large bodies; oversized ones are refused with 413 before they are read.
+    # The file part is spooled straight into the blob store's temp space, then moved into place
+    request.max_content_length = UPLOAD_MAX_BYTES
+    request.file_stream_factory = get_blob_store().spool
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     file = request.files['file']
@@ -520,90 +1973,428 @@ def upload_file():
         if not user_id:
             return jsonify({'error': 'User ID is required'}), 400
 
-        openai_file = None
         try:
-            file_content = file.read()
             mime_type = file.content_type
-            file_size = len(file_content)
-
-            # Upload file to OpenAI API
-            openai_file = client.files.create(
-                file=io.BytesIO(file_content),
-                purpose='assistants'
-            )
 
-            # Calculate file score using OpenAI API
-            score = calculate_file_score(file_content)
+            # The spool was hashed and sized as the request was parsed
+            content_hash, file_size = get_blob_store().put_spooled(file.stream)
+            upload_size_bytes.observe(file_size)
 
-            # Save file metadata and content to database
+            # Save file metadata to database
             new_file = File(
                 user_id=user_id,
                 filename=filename,
-                file_content=file_content,
+                content_hash=content_hash,
                 mime_type=mime_type,
                 file_size=file_size,
-                score=score,
-                openai_file_id=openai_file.id
+                score_status='pending'
             )
             db.session.add(new_file)
+
+            # Reuse the OpenAI file and score of content we have already seen
+            known = get_known_upload(content_hash)
+            if known:
+                logger.info(f"Reusing OpenAI file {known.openai_file_id} for duplicate content {content_hash}")
+                known.last_used_at = datetime.utcnow()
+                new_file.openai_file_id = known.openai_file_id
+                new_file.score = known.score
+                new_file.score_status = 'ready'
+
             db.session.commit()
 
+            if new_file.score_status == 'pending' and not queue_file_processing(new_file.id):
+                # Drop the row so the client's retry doesn't leave a duplicate; the stored blob is reused
+                db.session.delete(new_file)
+                db.session.commit()
+                return jsonify({'error': 'Too many uploads in progress. Please try again shortly.'}), 503
+
             return jsonify({
                 'message': 'File uploaded successfully',
                 'filename': filename,
-                'openai_file_id': openai_file.id,
-                'score': score
-            }), 200
+                'file_id': new_file.id,
+                'openai_file_id': new_file.openai_file_id,
+                'score': new_file.score,
+                'score_status': new_file.score_status
+            }), 202 if new_file.score_status == 'pending' else 200
         except Exception as e:
             db.session.rollback()
-            if openai_file:
-                try:
-                    client.files.delete(openai_file.id)
-                except Exception as delete_error:
-                    app.logger.error(f"Error deleting OpenAI file: {str(delete_error)}")
             return jsonify({'error': str(e)}), 500
 
+# Background worker pool for uploaded files awaiting their OpenAI upload and score
+upload_executor = BoundedExecutor(UPLOAD_WORKERS, UPLOAD_MAX_PENDING, thread_name_prefix='upload')
+
+# Score events for files processed in this process, so local long-polls wake immediately
+file_score_events = {}
+file_score_events_lock = threading.Lock()
+
+def queue_file_processing(file_id):
+    """
+    Hand a pending file to the upload worker pool.
+
+    Returns:
+        bool: False if the pool already has UPLOAD_MAX_PENDING files queued or running
+    """
+    with file_score_events_lock:
+        file_score_events[file_id] = threading.Event()
+    try:
+        upload_executor.submit(process_file_upload, current_app._get_current_object(), file_id)
+    except QueueFull:
+        with file_score_events_lock:
+            file_score_events.pop(file_id, None)
+        logger.warning(f"Upload queue full; refusing file {file_id}")
+        return False
+    return True
+
+@bp.cli.command('requeue-uploads')
+def requeue_uploads():
+    """
+    Process uploads left pending longer than UPLOAD_REQUEUE_AFTER, e.g. by a worker that exited mid-job.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=UPLOAD_REQUEUE_AFTER)
+    stale = [row.id for row in db.session.query(File.id).filter(
+        File.score_status == 'pending', File.upload_date < cutoff
+    ).order_by(File.id)]
+    app = current_app._get_current_object()
+    for file_id in stale:
+        process_file_upload(app, file_id)
+    click.echo(f"Reprocessed {len(stale)} stale uploads")
+
+def process_file_upload(app, file_id):
+    """
+    Worker entry point: upload a pending file to OpenAI, score it and record the result.
+
+    The OpenAI calls share one UPLOAD_PROCESS_DEADLINE budget.
+    """
+    with app.app_context(), deadline(UPLOAD_PROCESS_DEADLINE):
+        openai_file = None
+        try:
+            file = db.session.get(File, file_id)
+
+            known = get_known_upload(file.content_hash)
+            if known:
+                # An identical upload finished while this one was queued
+                known.last_used_at = datetime.utcnow()
+                file.openai_file_id, file.score = known.openai_file_id, known.score
+                file.score_status = 'ready'
+                db.session.commit()
+                return
+
+            # Upload file to OpenAI API, streamed from the stored blob
+            with get_blob_store().open(file.content_hash) as content:
+                # Rewind before each attempt so a retried upload resends the whole file
+                def create_openai_file():
+                    content.seek(0)
+                    return get_client().files.create(file=(file.filename, content), purpose='assistants')
+                openai_file = call_openai(create_openai_file)
+
+            # Calculate file score using OpenAI API
+            with get_blob_store().open(file.content_hash) as content:
+                score = calculate_file_score(content, size=file.file_size)
+
+            if score is None:
+                delete_openai_file(openai_file.id)
+                openai_file = None
+                file.score_status = 'failed'
+            else:
+                openai_file_id, score = record_known_upload(file.content_hash, openai_file.id, score)
+                if openai_file_id != openai_file.id:
+                    # Another upload of the same content won the race; keep its file and drop ours
+                    delete_openai_file(openai_file.id)
+                openai_file = None
+                file.openai_file_id, file.score = openai_file_id, score
+                file.score_status = 'ready'
+            db.session.commit()
+        except Exception as e:
+            logger.exception(f"Error processing uploaded file {file_id}: {str(e)}")
+            db.session.rollback()
+            if openai_file:
+                delete_openai_file(openai_file.id)
+            try:
+                File.query.filter_by(id=file_id).update({'score_status': 'failed'})
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+        finally:
+            with file_score_events_lock:
+                event = file_score_events.pop(file_id, None)
+            if event:
+                event.set()
+            db.session.remove()
+
+@bp.app_errorhandler(413)
+def upload_too_large(error=None):
+    return jsonify({'error': f'File too large. The maximum upload size is {UPLOAD_MAX_BYTES} bytes.'}), 413
+
+def get_known_upload(content_hash):
+    """
+    Look up previously uploaded content that is still within its idle TTL.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=OPENAI_FILE_IDLE_TTL)
+    known = db.session.get(UploadedContent, content_hash)
+    if known and known.last_used_at and known.last_used_at >= cutoff:
+        return known
+    return None
+
+def record_known_upload(content_hash, openai_file_id, score):
+    """
+    Remember the OpenAI file and score for a piece of content.
+
+    Returns:
+        tuple: (openai_file_id, score) as stored, which are the existing values if
+        a concurrent upload of the same content recorded them first
+    """
+    now = datetime.utcnow()
+    existing = db.session.get(UploadedContent, content_hash)
+    if existing:
+        # Expired entry: point it at the fresh upload
+        stale_file_id = existing.openai_file_id
+        existing.openai_file_id = openai_file_id
+        existing.score = score
+        existing.created_at = now
+        existing.last_used_at = now
+        if stale_file_id != openai_file_id:
+            delete_openai_file(stale_file_id)
+        return openai_file_id, score
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(UploadedContent(
+                content_hash=content_hash,
+                openai_file_id=openai_file_id,
+                score=score,
+                created_at=now,
+                last_used_at=now
+            ))
+    except IntegrityError:
+        existing = db.session.get(UploadedContent, content_hash)
+        return existing.openai_file_id, existing.score
+    return openai_file_id, score
+
+def delete_openai_file(openai_file_id):
+    try:
+        call_openai(get_client().files.delete, openai_file_id)
+    except Exception as delete_error:
+        logger.error(f"Error deleting OpenAI file: {str(delete_error)}")
+
+@bp.cli.command('evict-uploads')
+def evict_uploads():
+    """
+    Delete OpenAI files for uploaded content that has been idle longer than OPENAI_FILE_IDLE_TTL.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=OPENAI_FILE_IDLE_TTL)
+    expired = UploadedContent.query.filter(UploadedContent.last_used_at < cutoff).all()
+    for entry in expired:
+        delete_openai_file(entry.openai_file_id)
+        db.session.delete(entry)
+    db.session.commit()
+    click.echo(f"Evicted {len(expired)} idle uploads")
+
 import re  # Add this import at the top of the file
 
-def calculate_file_score(file_content):
+# Shared pool for scoring document chunks, bounding concurrent scoring calls per process
+scoring_executor = ThreadPoolExecutor(max_workers=SCORE_WORKERS, thread_name_prefix='score')
+
+def calculate_file_score(file_content, size=None):
+    """
+    Score a document's relevance from 0 to 100.
+
+    file_content is a binary file object. The document is split into chunks of
+    SCORE_CHUNK_TOKENS tokens that are scored concurrently and combined by a
+    length-weighted mean, so documents larger than the model's context still
+    get a real score. With SCORE_SAMPLE_CHUNKS set, very large documents (by
+    size in bytes) only have that many representative chunks scored.
+
+    Returns None if the document could not be scored.
+    """
+    started = time.perf_counter()
+    score = None
+    try:
+        score = score_document(
+            file_content,
+            bind_deadline(score_chunk),
+            scoring_executor,
+            SCORE_CHUNK_TOKENS,
+            max_in_flight=SCORE_WORKERS * 2,
+            size=size,
+            sample=SCORE_SAMPLE_CHUNKS
+        )
+        if score is None:
+            logger.warning("No chunk of the document could be scored")
+            return None
+        logger.info(f"Final file score: {score}")
+        return score
+    except Exception as e:
+        logger.error(f"Error calculating file score: {str(e)}")
+        return None
+    finally:
+        file_score_seconds.observe(time.perf_counter() - started, outcome='scored' if score is not None else 'failed')
+
+def score_chunk(text):
+    """
+    Score one chunk of a document from 0 to 100, or return None if it could not be scored.
+    """
     try:
         # Use OpenAI API to analyze file content
-        response = client.chat.completions.create(
+        response = call_openai(
+            get_client().chat.completions.create,
             model="gpt-3.5-turbo",
             messages=[
-                {"role": "system", "content": "You are an AI assistant tasked with evaluating the relevance of a document to a 'dark agenda'. Score the document from 0 to 100, where 100 is extremely relevant. Respond with only the numeric score."},
-                {"role": "user", "content": f"Evaluate this document:\n\n{file_content.decode('utf-8', errors='ignore')}"}
+                {"role": "system", "content": "You are an AI assistant tasked with evaluating the relevance of a document to a 'dark agenda'. You will be shown one excerpt of the document. Score the excerpt from 0 to 100, where 100 is extremely relevant. Respond with only the numeric score."},
+                {"role": "user", "content": f"Evaluate this document excerpt:\n\n{text}"}
             ]
         )
 
+        record_token_usage('score_chunk', getattr(response, 'usage', None))
+
         # Extract score from AI response using regex
         ai_response = response.choices[0].message.content
-        app.logger.info(f"AI response: {ai_response}")
+        payload_logger.debug(f"AI response: {ai_response}")
         match = re.search(r'\d+', ai_response)
         if match:
             score = int(match.group())
-            final_score = max(0, min(score, 100))  # Ensure score is between 0 and 100
-            app.logger.info(f"Extracted score: {score}, Final score: {final_score}")
-            return final_score
-        else:
-            app.logger.warning(f"No numeric score found in AI response: {ai_response}")
-            return 0  # Default score if no number is found
+            return max(0, min(score, 100))  # Ensure score is between 0 and 100
+        logger.warning(f"No numeric score found in AI response: {ai_response}")
+        return None
     except Exception as e:
-        app.logger.error(f"Error calculating file score: {str(e)}")
-        return 0  # Default score if calculation fails
+        logger.error(f"Error scoring document chunk: {str(e)}")
+        return None
 
 # New route to get file score
-@app.route('/get_file_score/<int:file_id>', methods=['GET'])
+@bp.route('/get_file_score/<int:file_id>', methods=['GET'])
 def get_file_score(file_id):
-    app.logger.info(f"Fetching score for file_id: {file_id}")
+    """
+    Endpoint to fetch a file's score and score status.
+
+    Pass ?wait=<seconds> to long-poll: the request waits until the score is no
+    longer pending or, if If-None-Match is sent, until the score's ETag
+    changes. An unchanged ETag at the end of the wait gives 304.
+
+    Returns:
+        JSON: The file id, score and score_status
+    """
+    logger.info(f"Fetching score for file_id: {file_id}")
     try:
-        file = File.query.get(file_id)
-        app.logger.debug(f"Retrieved file object: {file}")
-        if file is None:
-            app.logger.warning(f"File not found for file_id: {file_id}")
+        wait = max(0.0, min(request.args.get('wait', 0, type=float), FILE_SCORE_MAX_WAIT))
+
+        def fetch():
+            db.session.rollback()  # End the previous read so every poll sees fresh rows
+            return db.session.query(File.id, File.score, File.score_status).filter_by(id=file_id).first()
+
+        def settled(row):
+            if row is None:
+                return True
+            if request.if_none_match:
+                return not request.if_none_match.contains(file_score_etag(row))
+            return row.score_status != 'pending'
+
+        row = long_poll(fetch, settled, wait, event=file_score_events.get(file_id))
+        if row is None:
+            logger.warning(f"File not found for file_id: {file_id}")
             return jsonify({'error': 'File not found'}), 404
-        app.logger.info(f"Sending score {file.score} for file_id: {file_id}")
-        return jsonify({'file_id': file_id, 'score': file.score}), 200
+
+        etag = file_score_etag(row)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            logger.info(f"Sending score {row.score} ({row.score_status}) for file_id: {file_id}")
+            response = jsonify({'file_id': file_id, 'score': row.score, 'score_status': row.score_status})
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
-        app.logger.error(f"Error fetching file score for file_id {file_id}: {str(e)}")
+        logger.error(f"Error fetching file score for file_id {file_id}: {str(e)}")
         return jsonify({'error': 'An error occurred while fetching the file score'}), 500
+
+def file_score_etag(row):
+    return f"{row.id}-{row.score_status}-{row.score}"
+
+# Route to list file metadata
+@bp.route('/api/files', methods=['GET'])
+def list_files():
+    """
+    Endpoint to list uploaded files' metadata, newest first, without loading their contents.
+
+    Query parameters:
+        user_id: The user whose files to list (required)
+        limit: Page size, 1 to 200 (default 50)
+        before: The next_cursor value from the previous page
+
+    Returns:
+        JSON: A page of file metadata and the cursor for the next page, or null on the last page
+    """
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'User ID is required'}), 400
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    before = request.args.get('before', type=int)
+
+    query = db.session.query(
+        File.id, File.user_id, File.filename, File.file_size, File.mime_type,
+        File.score, File.score_status, File.upload_date
+    ).filter(File.user_id == user_id)
+    if before is not None:
+        query = query.filter(File.id < before)
+    # Fetch one extra row to learn whether there is another page
+    rows = query.order_by(File.id.desc()).limit(limit + 1).all()
+
+    page = rows[:limit]
+    return jsonify({
+        'files': [{
+            'file_id': row.id,
+            'user_id': row.user_id,
+            'filename': row.filename,
+            'file_size': row.file_size,
+            'mime_type': row.mime_type,
+            'score': row.score,
+            'score_status': row.score_status,
+            'upload_date': row.upload_date.isoformat() if row.upload_date else None
+        } for row in page],
+        'next_cursor': page[-1].id if len(rows) > limit else None
+    }), 200
+
+# Route to download a stored file
+@bp.route('/files/<int:file_id>/content', methods=['GET'])
+def get_file_content(file_id):
+    """
+    Endpoint to download an uploaded file's contents.
+
+    Blobs on the local filesystem are handed to send_file by path, so the server
+    can use sendfile instead of copying them through Python.
+
+    Query parameters:
+        user_id: The user who uploaded the file (required)
+
+    Returns:
+        Response: The file contents, or a JSON error
+    """
+    user_id = request.args.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'User ID is required'}), 400
+
+    # Another user's file is reported as missing rather than forbidden, so ids can't be probed
+    file = File.query.filter_by(id=file_id, user_id=user_id).first()
+    if file is None:
+        return jsonify({'error': 'File not found'}), 404
+
+    if file.content_hash:
+        store = get_blob_store()
+        path = store.path(file.content_hash)
+        source = path if path else store.open(file.content_hash)
+        etag = file.content_hash
+    else:
+        source = io.BytesIO(file.file_content)
+        etag = True
+
+    return send_file(
+        source,
+        mimetype=file.mime_type,
+        download_name=file.filename,
+        etag=etag,
+        conditional=True,
+        max_age=3600
+    )
+
+# Run the Flask application if this script is executed directly
+if __name__ == '__main__':
+    # Start the Flask development server with debug mode enabled
+    create_app().run(debug=True)
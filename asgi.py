@@ -0,0 +1,474 @@
+import asyncio
+import functools
+import os
+import time
+import traceback
+
+from a2wsgi import WSGIMiddleware
+from openai import NotFoundError
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import chat_flow
+from app import create_app, db, logger, ChatTurn, known_threads
+from app import ASSISTANT_ID, ASSISTANT_INSTRUCTIONS, ASSISTANT_TRUNCATION
+from app import openai_retry, openai_breaker, openai_retries, chat_phase_seconds, chat_turn_seconds
+from app import record_token_usage, sse_event, parse_chat_request, parse_assistant_response
+from app import format_thread_message, thread_missing, read_chat_turn, finish_chat_turn
+from app import enqueue_chat_job, queue_chat_message, claim_queued_messages, record_chat_job_results, get_chat_job_row
+from app import acquire_conversation_lease, renew_conversation_lease, release_conversation_lease
+from app import conversation_is_leased, has_queued_messages
+from chat_flow import ChatSteps, RunEvents, RUN_TERMINAL_STATUSES, assistant_reply, known_thread_id, run_failure
+from chat_flow import async_run_flow, async_stream_flow, chat_job_outcome, chat_job_settled, is_run_active_error
+from chat_flow import rerun_delay, service_unavailable, turn_timed_out
+from config import CHAT_TURN_DEADLINE, CHAT_QUEUE_MAX_WAIT, CONTEXT_TOKEN_BUDGET, ASGI_WSGI_THREADS
+from conversation_context import build_context
+from resilience import CircuitOpen, async_call_with_retry, is_deadline_expired, is_transient
+from transport import build_async_openai_client, deadline
+from workers import async_long_poll
+
+# AsyncOpenAI client, built on first use so that it belongs to the worker's event loop.
+# Retries are done by call_openai, sharing the sync path's policy and circuit breaker.
+async_client = None
+
+def get_async_client():
+    """
+    The process's AsyncOpenAI client, created on first use.
+    """
+    global async_client
+    if async_client is None:
+        async_client = build_async_openai_client(os.environ.get('OPENAI_API_KEY'), max_retries=0)
+    return async_client
+
+async def call_openai(fn, *args, retry_on=is_transient, retry_busy=None, **kwargs):
+    """
+    Await an AsyncOpenAI client method with backoff, jitter and Retry-After handling, as app.call_openai.
+    """
+    def on_retry(error, attempt, delay):
+        openai_retries.inc(call=getattr(fn, '__qualname__', 'openai'))
+        logger.warning(f"OpenAI call {getattr(fn, '__qualname__', fn)} failed ({error}); retry {attempt + 1} in {delay:.1f}s")
+    return await async_call_with_retry(lambda: fn(*args, **kwargs), openai_retry, openai_breaker,
+        retry_on=retry_on, retry_busy=retry_busy, on_retry=on_retry)
+
+async def run_db(app, fn, *args):
+    """
+    Run a sync database phase in a worker thread, in an app context with its own session.
+
+    The phases are short, and running them off the event loop keeps it free for
+    the OpenAI calls of other turns. The current deadline follows into the thread.
+    """
+    def run():
+        with app.app_context():
+            try:
+                return fn(*args)
+            finally:
+                db.session.remove()
+    return await asyncio.to_thread(run)
+
+# Drains started in the background, referenced until they finish so they are not garbage collected
+background_drains = set()
+
+def schedule_conversation_drain(app, conversation_id):
+    task = asyncio.get_running_loop().create_task(drain_conversation(app, conversation_id))
+    background_drains.add(task)
+    task.add_done_callback(background_drains.discard)
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+async def chat(request):
+    """
+    Async /api/chat: same request and response as the Flask route.
+
+    Returns:
+        JSONResponse: The chat response payload
+    """
+    try:
+        data = await read_json(request)
+        message, user_id, conversation_id, error = parse_chat_request(data)
+        if error:
+            return JSONResponse({'message': error}, status_code=400)
+        app = request.app.state.flask_app
+
+        # In job mode, queue the turn for the worker pool and return the job id at once
+        if data.get('async'):
+            payload, status = await run_db(app, enqueue_chat_job, user_id, conversation_id, message)
+            return JSONResponse(payload, status_code=status)
+
+        # Turns on an existing conversation are serialized and may be answered together
+        if conversation_id:
+            payload, status = await run_serialized_turn(app, user_id, conversation_id, message)
+        else:
+            payload, status = await process_chat_turn(app, user_id, conversation_id, message)
+        if status == 503 and 'retry_after' in payload:
+            return JSONResponse(payload, status_code=status, headers={'Retry-After': str(payload['retry_after'])})
+        return JSONResponse(payload, status_code=status)
+
+    except Exception as e:
+        error_message = f"An error occurred: {str(e)}\n\nTraceback:\n{traceback.format_exc()}"
+        logger.error(error_message)
+        return JSONResponse({'message': f"I apologize, but an error occurred while processing your request. Here are the details:\n\n{error_message}"}, status_code=500)
+
+async def chat_stream(request):
+    """
+    Async /api/chat/stream: the same server-sent events as the Flask route.
+
+    Returns:
+        StreamingResponse: A text/event-stream response
+    """
+    message, user_id, conversation_id, error = parse_chat_request(await read_json(request))
+    if error:
+        return JSONResponse({'message': error}, status_code=400)
+    app = request.app.state.flask_app
+
+    async def generate():
+        started = time.perf_counter()
+        status = 500
+        try:
+            with deadline(CHAT_TURN_DEADLINE):
+                if conversation_id:
+                    events = stream_serialized_turn(app, user_id, conversation_id, message)
+                else:
+                    events = stream_chat_turn(app, user_id, conversation_id, message)
+                async for kind, value in events:
+                    if kind == 'token':
+                        yield sse_event('token', {'text': value})
+                    else:
+                        payload, status = value
+            if status == 200:
+                yield sse_event('done', payload)
+            else:
+                yield sse_event('error', dict(payload, status=status))
+        except CircuitOpen as e:
+            payload, status = service_unavailable(e)
+            yield sse_event('error', dict(payload, status=status))
+        except Exception as e:
+            if is_deadline_expired(e):
+                logger.warning(f"Chat stream ran out of its {CHAT_TURN_DEADLINE}s deadline: {str(e)}")
+                payload, status = turn_timed_out()
+                yield sse_event('error', dict(payload, status=status))
+                return
+            logger.exception(f"Error in chat stream: {str(e)}")
+            yield sse_event('error', {'message': f"An error occurred: {str(e)}"})
+        finally:
+            chat_turn_seconds.observe(time.perf_counter() - started, status=str(status))
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+async def process_chat_turn(app, user_id, conversation_id, message):
+    """
+    Run one chat turn end to end, as app.process_chat_turn.
+
+    Returns:
+        tuple: (payload, status_code) for the /api/chat response
+    """
+    started = time.perf_counter()
+    try:
+        with deadline(CHAT_TURN_DEADLINE):
+            payload, status = await _process_chat_turn(app, user_id, conversation_id, message)
+    except CircuitOpen as e:
+        payload, status = service_unavailable(e)
+    except Exception as e:
+        if not is_deadline_expired(e):
+            raise
+        logger.warning(f"Chat turn ran out of its {CHAT_TURN_DEADLINE}s deadline: {str(e)}")
+        payload, status = turn_timed_out()
+    chat_turn_seconds.observe(time.perf_counter() - started, status=str(status))
+    return payload, status
+
+async def _process_chat_turn(app, user_id, conversation_id, message):
+    turn, error, status = await start_chat_turn(app, user_id, conversation_id, message)
+    if error:
+        return {'message': error}, status
+
+    ai_reply, updated_notes, updated_score = await run_assistant(turn.thread_id)
+    if ai_reply is None:
+        return {'message': 'No response from assistant. Please try again later.'}, 500
+
+    result = await run_db(app, finish_chat_turn, turn, message, ai_reply, updated_notes, updated_score)
+    if not result:
+        return {'message': 'Failed to save conversation. Please try again later.'}, 500
+
+    return result, 200
+
+async def stream_chat_turn(app, user_id, conversation_id, message):
+    """
+    Run one chat turn, yielding ('token', text) for each chunk of the reply and
+    finally ('result', (payload, status_code)).
+    """
+    turn, error, status = await start_chat_turn(app, user_id, conversation_id, message)
+    if error:
+        yield 'result', ({'message': error}, status)
+        return
+
+    result = None
+    async for kind, value in stream_assistant(turn.thread_id):
+        if kind == 'token':
+            yield kind, value
+        else:
+            result = value
+
+    ai_reply, updated_notes, updated_score = result
+    payload = await run_db(app, finish_chat_turn, turn, message, ai_reply, updated_notes, updated_score)
+    if not payload:
+        yield 'result', ({'message': 'Failed to save conversation. Please try again later.'}, 500)
+        return
+    yield 'result', (payload, 200)
+
+def chat_steps(app):
+    """
+    The steps chat_flow's lease and drain loop runs with, as awaitables; database steps run via run_db.
+    """
+    def db_step(fn):
+        return functools.partial(run_db, app, fn)
+    return ChatSteps(
+        queue_message=db_step(queue_chat_message),
+        acquire_lease=db_step(acquire_conversation_lease),
+        renew_lease=db_step(renew_conversation_lease),
+        release_lease=db_step(release_conversation_lease),
+        is_leased=db_step(conversation_is_leased),
+        claim_queued=db_step(claim_queued_messages),
+        has_queued=db_step(has_queued_messages),
+        get_job=db_step(get_chat_job_row),
+        record_results=db_step(record_chat_job_results),
+        process_turn=functools.partial(process_chat_turn, app),
+        stream_turn=functools.partial(stream_chat_turn, app),
+        next_event=next_event,
+        close_stream=lambda events: events.aclose(),
+        wait_for_job=functools.partial(wait_for_chat_job, app),
+        schedule_drain=functools.partial(schedule_conversation_drain, app)
+    )
+
+async def next_event(events):
+    try:
+        return await events.__anext__()
+    except StopAsyncIteration:
+        return None
+
+def stream_serialized_turn(app, user_id, conversation_id, message):
+    """
+    Stream a turn on an existing conversation under its lease, as app.stream_serialized_turn.
+    """
+    return async_stream_flow(chat_flow.stream_serialized_turn(chat_steps(app), user_id, conversation_id, message))
+
+async def run_serialized_turn(app, user_id, conversation_id, message):
+    """
+    Run a chat turn on an existing conversation, one run at a time per conversation, as app.run_serialized_turn.
+
+    Returns:
+        tuple: (payload, status_code) for the /api/chat response
+    """
+    return await async_run_flow(chat_flow.run_serialized_turn(chat_steps(app), user_id, conversation_id, message))
+
+async def drain_conversation(app, conversation_id):
+    """
+    Run a conversation's queued messages until none are left, unless another turn holds its lease.
+    """
+    await async_run_flow(chat_flow.drain_conversation(chat_steps(app), conversation_id))
+
+async def wait_for_chat_job(app, job_id, conversation_id, timeout):
+    """
+    Wait for a queued message to be answered by the turn holding its conversation's lease, as app.wait_for_chat_job.
+
+    Returns:
+        tuple: (payload, status_code); 202 with the job id if the wait elapsed first
+    """
+    steps = chat_steps(app)
+    job = await async_long_poll(
+        lambda: async_run_flow(chat_flow.fetch_chat_job(steps, job_id, conversation_id)),
+        chat_job_settled,
+        timeout
+    )
+    return chat_job_outcome(job)
+
+async def start_chat_turn(app, user_id, conversation_id, message):
+    """
+    Read what a chat turn needs from the database, then post the message to the OpenAI thread.
+
+    Returns:
+        tuple: (turn, error, status), as from app.start_chat_turn
+    """
+    user, state, error = await run_db(app, read_chat_turn, user_id, conversation_id)
+    if error:
+        return None, error, 500
+    context_summary, recent_messages = state if state else (None, [])
+    conversation_context = build_context(context_summary, CONTEXT_TOKEN_BUDGET)
+
+    try:
+        with chat_phase_seconds.time(phase='thread'):
+            thread_id = await create_or_retrieve_thread(conversation_id, conversation_stored=state is not None)
+        if not thread_id:
+            return None, 'Failed to create or retrieve thread. Please try again later.', 500
+
+        with chat_phase_seconds.time(phase='add_message'):
+            added = await add_message_to_thread(thread_id, user.context, conversation_context, message)
+        if not added:
+            return None, 'Failed to add message to thread. Please try again later.', 500
+    except NotFoundError:
+        return (None,) + thread_missing(conversation_id)
+
+    return ChatTurn(user, conversation_id, context_summary, recent_messages, thread_id), None, None
+
+async def create_or_retrieve_thread(conversation_id, conversation_stored=False):
+    """
+    Resolve the OpenAI thread id for a conversation, as app.create_or_retrieve_thread.
+    """
+    thread_id = known_thread_id(conversation_id, conversation_stored, known_threads)
+    if thread_id:
+        return thread_id
+
+    if conversation_id:
+        thread = await call_openai(get_async_client().beta.threads.retrieve, conversation_id)
+    else:
+        thread = await call_openai(get_async_client().beta.threads.create)
+    known_threads.set(thread.id, True)
+    return thread.id
+
+async def add_message_to_thread(thread_id, user_context, conversation_context, message):
+    try:
+        await call_openai(
+            get_async_client().beta.threads.messages.create,
+            thread_id=thread_id,
+            role="user",
+            content=format_thread_message(user_context, conversation_context, message),
+            retry_busy=is_run_active_error
+        )
+        return True
+    except (NotFoundError, CircuitOpen):
+        raise
+    except Exception as e:
+        logger.error(f"Error adding message to thread {thread_id}: {str(e)}")
+        return False
+
+async def run_assistant(thread_id):
+    """
+    Run the assistant on a thread and wait for its reply, as app.run_assistant.
+
+    The run is polled with asyncio.sleep, so a waiting turn costs no thread.
+    """
+    max_runs = openai_retry.max_attempts
+
+    for attempt in range(max_runs):
+        try:
+            logger.info(f"Attempt {attempt + 1}/{max_runs} to run assistant")
+            with chat_phase_seconds.time(phase='assistant_run'):
+                run = await call_openai(
+                    get_async_client().beta.threads.runs.create,
+                    thread_id=thread_id,
+                    assistant_id=ASSISTANT_ID,
+                    instructions=ASSISTANT_INSTRUCTIONS,
+                    truncation_strategy=ASSISTANT_TRUNCATION
+                )
+
+                logger.info(f"Run created with ID: {run.id}")
+
+                while run.status not in RUN_TERMINAL_STATUSES:
+                    await asyncio.sleep(1)  # Short delay to avoid excessive API calls
+                    run = await call_openai(get_async_client().beta.threads.runs.retrieve, thread_id=thread_id, run_id=run.id)
+
+                record_token_usage('assistant_run', getattr(run, 'usage', None))
+                if run.status == "requires_action":
+                    await cancel_run(thread_id, run.id)
+                failure = run_failure(run)
+                if failure:
+                    raise failure
+
+                latest_message = await get_run_reply(thread_id, run.id)
+
+            with chat_phase_seconds.time(phase='parse'):
+                return parse_assistant_response(latest_message)
+
+        except CircuitOpen:
+            raise
+        except Exception as e:
+            logger.exception(f"Error in run_assistant (attempt {attempt + 1}/{max_runs}): {str(e)}")
+            # Raises DeadlineExceeded rather than sleeping past the turn's deadline
+            delay = rerun_delay(e, attempt, openai_retry)
+            if delay is None:
+                logger.error("Max retries reached. Failing.")
+                return None, "", 0
+            await asyncio.sleep(delay)
+
+async def cancel_run(thread_id, run_id):
+    """
+    Cancel a run that is waiting on tool output, as app.cancel_run.
+    """
+    try:
+        await call_openai(get_async_client().beta.threads.runs.cancel, thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        logger.warning(f"Could not cancel run {run_id}: {str(e)}")
+
+async def stream_assistant(thread_id):
+    """
+    Run the assistant on a thread and stream its output, as app.stream_assistant.
+    """
+    # Only starting the run is retried; once tokens have been sent a failure ends the stream
+    stream = await call_openai(
+        get_async_client().beta.threads.runs.create,
+        thread_id=thread_id,
+        assistant_id=ASSISTANT_ID,
+        instructions=ASSISTANT_INSTRUCTIONS,
+        truncation_strategy=ASSISTANT_TRUNCATION,
+        stream=True
+    )
+
+    run = RunEvents()
+    started = time.perf_counter()
+    async for event in stream:
+        text = run.feed(event)
+        if text:
+            yield 'token', text
+        if run.failure:
+            if run.cancel_run_id:
+                await cancel_run(thread_id, run.cancel_run_id)
+            raise run.failure
+    record_token_usage('assistant_run', run.usage)
+
+    # Fall back to fetching this run's reply if the completed message was not streamed
+    latest_message = run.latest_message
+    if latest_message is None and run.run_id:
+        latest_message = await get_run_reply(thread_id, run.run_id)
+    # Includes the time the client took to receive the streamed tokens
+    chat_phase_seconds.observe(time.perf_counter() - started, phase='assistant_run')
+
+    with chat_phase_seconds.time(phase='parse'):
+        result = parse_assistant_response(latest_message)
+    yield 'result', result
+
+async def get_run_reply(thread_id, run_id):
+    """
+    Fetch the text of the assistant message produced by a single run.
+    """
+    page = await call_openai(get_async_client().beta.threads.messages.list, thread_id=thread_id, run_id=run_id, order="desc", limit=1)
+    return assistant_reply(page.data)
+
+def create_asgi_app(config=None):
+    """
+    Build the ASGI application, for uvicorn workers.
+
+    /api/chat and /api/chat/stream run on the event loop with AsyncOpenAI, so one
+    process can keep many assistant runs in flight; their database phases run in
+    worker threads. Every other route, uploads included, is the Flask app from
+    create_app, served through a WSGI bridge on ASGI_WSGI_THREADS threads.
+
+        gunicorn 'asgi:create_asgi_app()' --preload -k uvicorn.workers.UvicornWorker
+
+    Returns:
+        Starlette: The application
+    """
+    flask_app = create_app(config)
+    asgi_app = Starlette(routes=[
+        Route('/api/chat', chat, methods=['POST']),
+        Route('/api/chat/stream', chat_stream, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)),
+    ])
+    asgi_app.state.flask_app = flask_app
+    return asgi_app
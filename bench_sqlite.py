@@ -0,0 +1,97 @@
+"""
+Concurrent write-throughput benchmark for the SQLite performance profile.
+
+Runs the same chat-turn-shaped workload (update a user, insert two messages,
+commit) from several threads against a fresh database file, once with the
+default PRAGMAs and once with SQLITE_PERFORMANCE_PRAGMAS, and prints commits
+per second and lock errors for each.
+
+Usage:
+    python bench_sqlite.py [--threads 8] [--turns 200]
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+# config.py reads DATABASE_URL at import
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'bench_config.db'))
+
+from config import SQLITE_DEFAULT_PRAGMAS, SQLITE_PERFORMANCE_PRAGMAS, apply_sqlite_pragmas
+
+SCHEMA = """
+CREATE TABLE user (id INTEGER PRIMARY KEY, user_id TEXT UNIQUE NOT NULL, user_score INTEGER, user_notes TEXT);
+CREATE TABLE message (id INTEGER PRIMARY KEY, conversation_id TEXT NOT NULL, content TEXT NOT NULL, timestamp TEXT);
+CREATE INDEX ix_message_conversation_id_timestamp ON message (conversation_id, timestamp);
+"""
+
+
+def run_workload(path, performance, threads, turns):
+    setup = sqlite3.connect(path)
+    apply_sqlite_pragmas(setup, performance)
+    setup.executescript(SCHEMA)
+    setup.executemany(
+        "INSERT INTO user (user_id, user_score, user_notes) VALUES (?, 0, '')",
+        [(f"user{i}",) for i in range(threads)]
+    )
+    setup.commit()
+    setup.close()
+
+    errors = []
+    commits = []
+
+    def worker(index):
+        # Both runs keep pysqlite's default 5 second lock timeout, as the app does through SQLAlchemy
+        connection = sqlite3.connect(path, check_same_thread=False)
+        apply_sqlite_pragmas(connection, performance)
+        done = 0
+        for turn in range(turns):
+            try:
+                connection.execute(
+                    "UPDATE user SET user_score = user_score + 1, user_notes = ? WHERE user_id = ?",
+                    (f"turn {turn}", f"user{index}")
+                )
+                connection.executemany(
+                    "INSERT INTO message (conversation_id, content, timestamp) VALUES (?, ?, datetime('now'))",
+                    [(f"conv{index}", "User message " * 20), (f"conv{index}", "AI reply " * 40)]
+                )
+                connection.commit()
+                done += 1
+            except sqlite3.OperationalError as e:
+                connection.rollback()
+                errors.append(str(e))
+        connection.close()
+        commits.append(done)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return sum(commits), len(errors), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--turns', type=int, default=200, help='write transactions per thread')
+    args = parser.parse_args()
+
+    print(f"{args.threads} threads x {args.turns} turns")
+    for label, performance, pragmas in (
+        ('default', False, SQLITE_DEFAULT_PRAGMAS),
+        ('performance', True, SQLITE_DEFAULT_PRAGMAS + SQLITE_PERFORMANCE_PRAGMAS),
+    ):
+        with tempfile.TemporaryDirectory() as tmp:
+            committed, errors, elapsed = run_workload(os.path.join(tmp, 'bench.db'), performance, args.threads, args.turns)
+        print(f"{label:>12}: {committed / elapsed:8.0f} commits/s  "
+              f"({committed} committed, {errors} 'database is locked' errors, {elapsed:.2f}s)")
+        print(f"{'':>12}  {'; '.join(pragmas)}")
+
+
+if __name__ == '__main__':
+    main()
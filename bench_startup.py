@@ -0,0 +1,130 @@
+"""
+Startup-time benchmark for the application factory.
+
+Imports app and calls create_app() in fresh interpreters, the way a gunicorn
+master does with --preload, and prints the median time of each step and the
+modules that cost the most to import (python -X importtime). Startup must not
+touch the database, OpenAI, the blob store or the web build, so each run also
+checks that the openai package was not imported, that no OpenAI client, blob
+store or static asset index was built and that the SQLite file named by
+DATABASE_URL was not created.
+
+Exits non-zero when the median startup exceeds --budget, so it can run in CI.
+
+Usage:
+    python bench_startup.py [--runs 5] [--top 10] [--budget 1.5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Median import + create_app() time, in seconds, that startup should stay under. Most of
+# what is left is importing Flask, SQLAlchemy and Alembic (about 0.9s on a laptop)
+DEFAULT_BUDGET_SECONDS = 1.5
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+print(json.dumps({
+    'import_seconds': imported - start,
+    'create_app_seconds': created - imported,
+    'client_built': app.client is not None,
+    'blob_store_built': app.blob_store is not None,
+    'asset_index_built': 'asset_index' in flask_app.extensions,
+    'openai_imported': 'openai' in sys.modules,
+}))
+"""
+
+
+def probe_env(tmp):
+    env = dict(os.environ)
+    env['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmp, 'startup.db')
+    env['LOG_FILE'] = os.path.join(tmp, 'startup.log')
+    return env
+
+
+def measure_startup():
+    """
+    Import app and build it once in a fresh interpreter.
+
+    Returns:
+        dict: import_seconds, create_app_seconds, the *_built and openai_imported flags, and database_created
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        output = subprocess.run(
+            [sys.executable, '-c', PROBE], cwd=ROOT, env=probe_env(tmp),
+            capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result['database_created'] = os.path.exists(os.path.join(tmp, 'startup.db'))
+    return result
+
+
+def slowest_imports(top):
+    """
+    The top modules by cumulative import time, as (microseconds, module) pairs.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        stderr = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT, env=probe_env(tmp),
+            capture_output=True, text=True, check=True
+        ).stderr
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        # Only top-level imports; nested ones are already counted in their parent
+        if module.startswith(' ') and not module.startswith('  '):
+            timings.append((int(cumulative), module.strip()))
+    return sorted(timings, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='slowest imports to list')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET_SECONDS, help='seconds')
+    args = parser.parse_args()
+
+    results = [measure_startup() for _ in range(args.runs)]
+    import_seconds = statistics.median(r['import_seconds'] for r in results)
+    create_seconds = statistics.median(r['create_app_seconds'] for r in results)
+    print(f"{args.runs} runs, median")
+    print(f"{'import app':>14}: {import_seconds * 1000:8.1f} ms")
+    print(f"{'create_app()':>14}: {create_seconds * 1000:8.1f} ms")
+
+    print("\nSlowest top-level imports")
+    for microseconds, module in slowest_imports(args.top):
+        print(f"{microseconds / 1000:8.1f} ms  {module}")
+
+    failures = []
+    if any(r['client_built'] for r in results):
+        failures.append('an OpenAI client was built at startup')
+    if any(r['blob_store_built'] for r in results):
+        failures.append('the blob store was built at startup')
+    if any(r['asset_index_built'] for r in results):
+        failures.append('the web build was indexed at startup')
+    if any(r['openai_imported'] for r in results):
+        failures.append('the openai package was imported at startup')
+    if any(r['database_created'] for r in results):
+        failures.append('the database was opened at startup')
+    if import_seconds + create_seconds > args.budget:
+        failures.append(f"startup took {import_seconds + create_seconds:.2f}s, over the {args.budget:.2f}s budget")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+import hashlib
+import os
+import re
+import tempfile
+from abc import ABC, abstractmethod
+
+CHUNK_SIZE = 1024 * 1024  # Read and hash uploads one megabyte at a time
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobTooLarge(ValueError):
+    """
+    Raised when content being stored exceeds the caller's size limit.
+    """
+
+
+class SpooledBlob:
+    """
+    A temporary file that hashes and counts the bytes written to it.
+
+    An upload spooled into one (see BlobStore.spool) is stored with
+    put_spooled() without being read back. Closing it removes path, if the
+    store has not moved the file away already.
+    """
+
+    def __init__(self, file, path=None):
+        self.file = file
+        self.path = path
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+
+    @property
+    def digest(self):
+        return self._sha256.hexdigest()
+
+    def write(self, data):
+        self._sha256.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        if self.path:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+class BlobStore(ABC):
+    """
+    Content-addressed storage for file bytes, keyed by SHA-256 hex digest.
+
+    Identical content is stored once; rows in the database keep only the digest.
+    """
+
+    @abstractmethod
+    def put_file(self, fileobj, max_size=None):
+        """
+        Store the contents of a binary file object, reading it in chunks.
+
+        Raises:
+            BlobTooLarge: If max_size is given and the content is longer
+
+        Returns:
+            tuple: (sha256 hex digest, size in bytes)
+        """
+
+    @abstractmethod
+    def put_bytes(self, data):
+        """
+        Store an in-memory bytes object, returning (digest, size) as put_file does.
+        """
+
+    @abstractmethod
+    def exists(self, digest):
+        """
+        Whether a blob with this digest is stored.
+        """
+
+    @abstractmethod
+    def open(self, digest):
+        """
+        Open a stored blob for reading as a binary file object.
+        """
+
+    def spool(self):
+        """
+        A SpooledBlob to write incoming content to, written sequentially from the start.
+        """
+        return SpooledBlob(tempfile.TemporaryFile())
+
+    def put_spooled(self, spooled):
+        """
+        Store the complete contents of a SpooledBlob from spool().
+
+        Returns:
+            tuple: (sha256 hex digest, size in bytes)
+        """
+        spooled.seek(0)
+        return self.put_file(spooled.file)
+
+    def path(self, digest):
+        """
+        Local filesystem path of a blob, or None if the backend is not file-based.
+        """
+        return None
+
+    @abstractmethod
+    def delete(self, digest):
+        """
+        Remove a blob; removing one that is not stored is not an error.
+        """
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Blob store on the local filesystem, laid out as <root>/ab/cd/<digest>.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path(self, digest):
+        if not _DIGEST_RE.match(digest or ''):
+            raise ValueError(f"Invalid blob digest: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def put_file(self, fileobj, max_size=None):
+        sha256 = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise BlobTooLarge(f"Content exceeds {max_size} bytes")
+                    sha256.update(chunk)
+                    tmp.write(chunk)
+            digest = sha256.hexdigest()
+            self.adopt(tmp_path, digest)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest, size
+
+    def put_bytes(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        if not self.exists(digest):
+            fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(data)
+            self.adopt(tmp_path, digest)
+        return digest, len(data)
+
+    def spool(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        return SpooledBlob(os.fdopen(fd, 'w+b'), tmp_path)
+
+    def put_spooled(self, spooled):
+        # The spool is already hashed and in tmp_dir, so storing it is a rename rather than a copy
+        spooled.file.close()
+        self.adopt(spooled.path, spooled.digest)
+        return spooled.digest, spooled.size
+
+    def adopt(self, tmp_path, digest):
+        """
+        Move an already-hashed file into the store, or discard it if the blob is already present.
+
+        tmp_path must be on the same filesystem as the store so the move is an atomic rename.
+        """
+        final_path = self.path(digest)
+        if os.path.exists(final_path):
+            os.remove(tmp_path)
+            return final_path
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(tmp_path, final_path)
+        return final_path
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def open(self, digest):
+        return open(self.path(digest), 'rb')
+
+    def delete(self, digest):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+
+BLOB_STORE_BACKENDS = {
+    'local': LocalBlobStore,
+}
+
+
+def get_blob_store(backend, location):
+    """
+    Build the blob store for a configured backend name and location.
+    """
+    try:
+        return BLOB_STORE_BACKENDS[backend](location)
+    except KeyError:
+        raise ValueError(f"Unknown blob store backend: {backend}")
@@ -0,0 +1,450 @@
+import inspect
+import json
+import logging
+import time
+from collections import namedtuple
+
+from config import CHAT_QUEUE_MAX_WAIT, CONVERSATION_LEASE_TTL
+from reply_stream import ReplyStream
+from resilience import CircuitOpen, is_deadline_expired
+from transport import DeadlineExceeded, remaining_budget
+
+# Chat logic shared by the Flask app (app.py) and the ASGI app (asgi.py). Logs go through the app's handlers.
+logger = logging.getLogger('app')
+
+
+def service_unavailable(error):
+    """
+    Response payload for a turn refused because the OpenAI circuit is open.
+    """
+    return {'message': 'The assistant is temporarily unavailable. Please try again shortly.',
+            'retry_after': max(1, round(error.retry_after))}, 503
+
+
+def turn_timed_out():
+    """
+    Response payload for a turn that ran out of its CHAT_TURN_DEADLINE budget.
+    """
+    return {'message': 'The assistant took too long to answer. Please try again.'}, 504
+
+
+# Run statuses at which to stop waiting. The assistant has no tools, so a run
+# that requires action would only sit there until it expires.
+RUN_TERMINAL_STATUSES = ("completed", "failed", "cancelled", "expired", "incomplete", "requires_action")
+
+# Streamed run events that end the run without a reply
+RUN_FAILED_EVENTS = (
+    "thread.run.failed", "thread.run.cancelled", "thread.run.expired",
+    "thread.run.incomplete", "thread.run.requires_action"
+)
+
+
+def run_failure(run):
+    """
+    The error to raise for a polled run that ended without a reply, or None if it completed.
+    """
+    if run.status == "completed":
+        return None
+    return Exception(f"Run {run.status}: {run.last_error or run.incomplete_details}")
+
+
+class RunEvents:
+    """
+    Follow the events of a streamed assistant run.
+
+    feed() returns the reply text carried by each event and keeps the run id,
+    the completed assistant message and the token usage. An event that ends the
+    run without a reply sets failure, and cancel_run_id if the run is left
+    waiting on tool output and should be cancelled.
+    """
+
+    def __init__(self):
+        self.run_id = None
+        self.latest_message = None
+        self.usage = None
+        self.failure = None
+        self.cancel_run_id = None
+        self._reply = ReplyStream()
+
+    def feed(self, event):
+        """
+        Returns:
+            str: The reply text decoded from this event, possibly empty
+        """
+        if event.event == "thread.run.created":
+            self.run_id = event.data.id
+            logger.info(f"Streaming run created with ID: {self.run_id}")
+        elif event.event == "thread.message.delta":
+            return ''.join(
+                self._reply.feed(block.text.value)
+                for block in event.data.delta.content or []
+                if block.type == "text" and block.text and block.text.value
+            )
+        elif event.event == "thread.message.completed":
+            if event.data.role == "assistant" and event.data.content:
+                self.latest_message = event.data.content[0].text.value
+        elif event.event == "thread.run.completed":
+            self.usage = getattr(event.data, 'usage', None)
+        elif event.event in RUN_FAILED_EVENTS:
+            if event.event == "thread.run.requires_action":
+                self.cancel_run_id = event.data.id
+            self.failure = Exception(f"Run {event.event.rsplit('.', 1)[-1]}: {event.data.last_error or event.data.incomplete_details}")
+        return ''
+
+
+def assistant_reply(messages):
+    """
+    Text of the first assistant message in a run's message listing, or None.
+    """
+    return next((msg.content[0].text.value for msg in messages if msg.role == "assistant"), None)
+
+
+def known_thread_id(conversation_id, conversation_stored, known_threads):
+    """
+    Resolve a conversation's thread without asking OpenAI, if it is stored here or already known to exist.
+
+    Returns:
+        str: The thread id, or None if the thread must be retrieved (or, with no conversation_id, created)
+    """
+    if conversation_id and (conversation_stored or conversation_id in known_threads):
+        known_threads.set(conversation_id, True)
+        return conversation_id
+    return None
+
+
+def is_run_active_error(error):
+    return "Can't add messages to thread" in str(error) and "while a run is active" in str(error)
+
+
+def rerun_delay(error, attempt, policy):
+    """
+    Decide whether to start an assistant run again after it failed with error.
+
+    Raises DeadlineExceeded instead of waiting once the turn's deadline has run
+    out, or would run out during the wait.
+
+    Returns:
+        float: Seconds to wait before the next run, or None once policy's attempts are used up
+    """
+    remaining = remaining_budget()
+    if is_deadline_expired(error) or remaining == 0:
+        raise DeadlineExceeded("Chat turn deadline exceeded") from error
+    if attempt == policy.max_attempts - 1:
+        return None
+    delay = policy.delay(attempt)
+    if remaining is not None and delay >= remaining:
+        raise DeadlineExceeded("Chat turn deadline exceeded") from error
+    return delay
+
+
+# Turns on an existing conversation run one at a time, under the conversation's lease. The
+# lease and drain loop below is written once for both apps as generators ("flows") that
+# do their I/O through the ChatSteps they are given, as `result = yield steps.name(...)`.
+# app.py's steps are plain functions, so the call has already run and run_flow sends its
+# result straight back; asgi.py's return awaitables, which async_run_flow awaits. A flow
+# yields Token(text) to pass streamed reply text out through stream_flow.
+ChatSteps = namedtuple('ChatSteps', [
+    'queue_message', 'acquire_lease', 'renew_lease', 'release_lease', 'is_leased',
+    'claim_queued', 'has_queued', 'get_job', 'record_results',
+    'process_turn', 'stream_turn', 'next_event', 'close_stream', 'wait_for_job', 'schedule_drain'
+])
+
+Token = namedtuple('Token', ['text'])
+
+
+class StreamClosed(Exception):
+    """
+    Raised inside a flow whose consumer stopped reading its tokens, e.g. because the client disconnected.
+
+    GeneratorExit itself cannot be used: `yield from` would close the inner flow
+    instead of letting it run its cleanup steps.
+    """
+
+
+# Job statuses at which a waiter stops polling
+CHAT_JOB_DONE = ('completed', 'failed')
+
+# Seconds between lease renewals while a turn streams
+LEASE_RENEW_INTERVAL = CONVERSATION_LEASE_TTL / 3
+
+
+def coalesce_messages(queued):
+    """
+    Join queued messages into the text of a single turn.
+    """
+    if len(queued) == 1:
+        return queued[0].message
+    return "\n\n".join(q.message for q in queued)
+
+
+def chat_job_settled(job):
+    return job is None or job.status in CHAT_JOB_DONE
+
+
+def chat_job_outcome(job):
+    """
+    Returns:
+        tuple: (payload, status_code) for a job: its stored result once it has
+        finished, 404 if it does not exist, otherwise 202 with its status
+    """
+    if job is None:
+        return {'message': 'Job not found'}, 404
+    if job.status in CHAT_JOB_DONE:
+        return json.loads(job.result), job.status_code
+    return {'job_id': job.job_id, 'status': job.status}, 202
+
+
+def interrupted_outcome(error):
+    """
+    The (payload, status_code) recorded on the jobs of a turn that raised instead of finishing.
+    """
+    if isinstance(error, CircuitOpen):
+        return service_unavailable(error)
+    if is_deadline_expired(error):
+        return turn_timed_out()
+    return {'message': 'The turn was interrupted before it finished.'}, 500
+
+
+def run_serialized_turn(steps, user_id, conversation_id, message):
+    """
+    Run a chat turn on an existing conversation, one run at a time per conversation.
+
+    The message is queued; if no other turn holds the conversation's lease, this
+    request drains the queue itself, otherwise the running turn's next run answers it.
+
+    Returns:
+        tuple: (payload, status_code) for the /api/chat response
+    """
+    job_id = yield steps.queue_message(user_id, conversation_id, message)
+    yield from drain_conversation(steps, conversation_id)
+    return (yield steps.wait_for_job(job_id, conversation_id, CHAT_QUEUE_MAX_WAIT))
+
+
+def drain_conversation(steps, conversation_id):
+    """
+    Run a conversation's queued messages, a batch per run, until none are left.
+
+    Returns at once if another turn holds the conversation's lease; that turn
+    drains the messages instead.
+    """
+    while True:
+        holder = yield steps.acquire_lease(conversation_id)
+        if not holder:
+            return
+        try:
+            while (yield steps.renew_lease(conversation_id, holder)):
+                queued = yield steps.claim_queued(conversation_id)
+                if not queued:
+                    break
+                yield from run_coalesced_turn(steps, conversation_id, queued)
+        finally:
+            yield steps.release_lease(conversation_id, holder)
+        # A message queued after the last claim saw the lease still held, so check once more
+        if not (yield steps.has_queued(conversation_id)):
+            return
+
+
+def run_coalesced_turn(steps, conversation_id, queued):
+    """
+    Answer one or more queued messages with a single chat turn and record the result on each job.
+    """
+    job_ids = [q.job_id for q in queued]
+    if len(queued) > 1:
+        logger.info(f"Coalescing {len(queued)} messages into one run on conversation {conversation_id}")
+    try:
+        payload, status = yield steps.process_turn(queued[0].user_id, conversation_id, coalesce_messages(queued))
+    except Exception as e:
+        logger.exception(f"Error running chat jobs {job_ids}: {str(e)}")
+        payload, status = {'message': f"An error occurred: {str(e)}"}, 500
+    yield steps.record_results(job_ids, payload, status)
+
+
+def fetch_chat_job(steps, job_id, conversation_id):
+    """
+    Read a waiting message's job for one long-poll round.
+
+    If the message is still queued but no turn holds the conversation's lease
+    (the worker running it died), the waiter drains the conversation itself.
+
+    Returns:
+        ChatJob: The job, or None if it does not exist
+    """
+    job = yield steps.get_job(job_id)
+    if job is not None and job.status == 'queued' and not (yield steps.is_leased(conversation_id)):
+        yield from drain_conversation(steps, conversation_id)
+        job = yield steps.get_job(job_id)
+    return job
+
+
+def stream_serialized_turn(steps, user_id, conversation_id, message):
+    """
+    Stream a turn on an existing conversation, taking its lease first.
+
+    Messages already queued on the conversation are answered by the same run. If
+    another turn holds the lease, this message is queued for that turn's next run
+    and no tokens are streamed.
+
+    Returns:
+        tuple: (payload, status_code), as from process_chat_turn
+    """
+    job_id = yield steps.queue_message(user_id, conversation_id, message)
+    holder = yield steps.acquire_lease(conversation_id)
+    if not holder:
+        return (yield steps.wait_for_job(job_id, conversation_id, CHAT_QUEUE_MAX_WAIT))
+
+    try:
+        queued = yield steps.claim_queued(conversation_id)
+        job_ids = [q.job_id for q in queued]
+        try:
+            events = steps.stream_turn(user_id, conversation_id, coalesce_messages(queued))
+            payload, status = yield from relay_stream(steps, events, (conversation_id, holder))
+        except BaseException as e:
+            # Also reached when the client disconnects mid-stream; don't leave the messages running
+            yield steps.record_results(job_ids, *interrupted_outcome(e))
+            raise
+        yield steps.record_results(job_ids, payload, status)
+    finally:
+        yield steps.release_lease(conversation_id, holder)
+
+    # Messages that arrived during the stream are answered in the background
+    if (yield steps.has_queued(conversation_id)):
+        yield steps.schedule_drain(conversation_id)
+    return payload, status
+
+
+def relay_stream(steps, events, lease):
+    """
+    Pass a streamed turn's ('token', text) events on as Tokens, renewing the
+    (conversation_id, holder) lease every LEASE_RENEW_INTERVAL seconds meanwhile.
+
+    Returns:
+        The value of the stream's final ('result', value) event
+    """
+    result = None
+    renewed_at = time.monotonic()
+    try:
+        while True:
+            if time.monotonic() - renewed_at >= LEASE_RENEW_INTERVAL:
+                renewed_at = time.monotonic()
+                if not (yield steps.renew_lease(*lease)):
+                    logger.warning(f"Lease on conversation {lease[0]} lapsed while streaming a turn")
+            event = yield steps.next_event(events)
+            if event is None:
+                return result
+            kind, value = event
+            if kind == 'token':
+                yield Token(value)
+            else:
+                result = value
+    except BaseException:
+        yield steps.close_stream(events)
+        raise
+
+
+def run_flow(flow):
+    """
+    Run a flow whose steps are plain calls.
+
+    Returns:
+        The flow's return value
+    """
+    value = None
+    try:
+        while True:
+            value = flow.send(value)
+    except StopIteration as stop:
+        return stop.value
+
+
+def stream_flow(flow):
+    """
+    Run a flow whose steps are plain calls, yielding ('token', text) for each
+    Token and finally ('result', value) with its return value.
+
+    If the consumer stops early (the client disconnected), the flow sees
+    StreamClosed where it yielded the token, and its cleanup steps still run.
+    """
+    value = None
+    while True:
+        try:
+            step = flow.send(value)
+        except StopIteration as stop:
+            yield 'result', stop.value
+            return
+        value = None
+        if isinstance(step, Token):
+            try:
+                yield 'token', step.text
+            except BaseException as e:
+                _unwind(flow, StreamClosed() if isinstance(e, GeneratorExit) else e)
+                raise
+        else:
+            value = step
+
+
+def _unwind(flow, error):
+    # Raise error inside a plain-call flow and let it run its cleanup steps; further tokens go nowhere
+    try:
+        step = flow.throw(error)
+        while True:
+            step = flow.send(None if isinstance(step, Token) else step)
+    except BaseException:
+        pass
+
+
+async def async_run_flow(flow):
+    """
+    Run a flow whose steps are awaitables, awaiting each and sending its result
+    back (or raising its error inside the flow).
+
+    Returns:
+        The flow's return value
+    """
+    value, error = None, None
+    while True:
+        try:
+            step = flow.throw(error) if error else flow.send(value)
+        except StopIteration as stop:
+            return stop.value
+        value, error = await _async_step(step)
+
+
+async def async_stream_flow(flow):
+    """
+    stream_flow for a flow whose steps are awaitables: an async generator of
+    ('token', text) events and a final ('result', value).
+    """
+    value, error = None, None
+    while True:
+        try:
+            step = flow.throw(error) if error else flow.send(value)
+        except StopIteration as stop:
+            yield 'result', stop.value
+            return
+        value, error = None, None
+        if isinstance(step, Token):
+            try:
+                yield 'token', step.text
+            except BaseException as e:
+                await _async_unwind(flow, StreamClosed() if isinstance(e, GeneratorExit) else e)
+                raise
+        else:
+            value, error = await _async_step(step)
+
+
+async def _async_step(step):
+    # Await one step of an async flow, returning (result, error)
+    try:
+        return (await step if inspect.isawaitable(step) else step), None
+    except BaseException as e:
+        return None, e
+
+
+async def _async_unwind(flow, error):
+    value = None
+    try:
+        while True:
+            step = flow.throw(error) if error else flow.send(value)
+            value, error = (None, None) if isinstance(step, Token) else await _async_step(step)
+    except BaseException:
+        pass
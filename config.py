@@ -1,3 +1,4 @@
+import logging
 import os
 from urllib.parse import urlparse
 
@@ -14,6 +15,201 @@ if not database_url.startswith('sqlite:'):
 SQLALCHEMY_DATABASE_URI = database_url
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pooling. DB_POOL_MODE is 'queue' (a pool per process) or 'null' (no pooling,
+# for use behind PgBouncer in transaction mode, which does the pooling itself)
+DB_POOL_MODE = os.getenv('DB_POOL_MODE', 'queue')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+
+def build_engine_options(url):
+    """
+    SQLAlchemy engine options for the configured pool mode.
+    """
+    from sqlalchemy.pool import NullPool
+    from pool_stats import TimedQueuePool
+
+    if DB_POOL_MODE == 'null':
+        return {'poolclass': NullPool}
+    if DB_POOL_MODE != 'queue':
+        raise ValueError(f"Unknown DB_POOL_MODE: {DB_POOL_MODE}")
+    if url.startswith('sqlite:') and (':memory:' in url or url in ('sqlite://', 'sqlite:///')):
+        # In-memory SQLite needs its single shared connection; leave Flask-SQLAlchemy's pool in place
+        return {}
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+
+# Background chat jobs: worker threads per process, and how many turns may be queued or running at once
+CHAT_WORKERS = int(os.getenv('CHAT_WORKERS', '4'))
+CHAT_MAX_PENDING = int(os.getenv('CHAT_MAX_PENDING', '64'))
+# Longest a client may long-poll for a job result, in seconds
+CHAT_JOB_MAX_WAIT = float(os.getenv('CHAT_JOB_MAX_WAIT', '30'))
+
+# Under the ASGI entry point (asgi.py), threads serving the Flask routes other than chat
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', '8'))
+
+# Logging. LOG_FORMAT is 'json' (one object per line) or 'text'. Full API payloads are logged
+# at DEBUG on the app.payload logger, sampled and capped at LOG_PAYLOAD_MAX_PER_SECOND
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+LOG_FILE = os.getenv('LOG_FILE', 'app.log')
+LOG_FILE_MAX_BYTES = int(os.getenv('LOG_FILE_MAX_BYTES', str(50 * 1024 * 1024)))
+LOG_FILE_BACKUPS = int(os.getenv('LOG_FILE_BACKUPS', '5'))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0.1'))
+LOG_PAYLOAD_MAX_PER_SECOND = float(os.getenv('LOG_PAYLOAD_MAX_PER_SECOND', '5'))
+
+# Turns on an existing conversation run one at a time across all workers. Messages that arrive
+# while a run is active are queued and answered together by the next run, up to CHAT_COALESCE_MAX
+# at once; a plain /api/chat request waits up to CHAT_QUEUE_MAX_WAIT seconds for its answer.
+# The lease of a worker that dies mid-turn lapses after CONVERSATION_LEASE_TTL seconds (below)
+CHAT_COALESCE_MAX = int(os.getenv('CHAT_COALESCE_MAX', '10'))
+CHAT_QUEUE_MAX_WAIT = float(os.getenv('CHAT_QUEUE_MAX_WAIT', '240'))
+
+# Task queue behind /getwork. A leased task is hidden from other workers for TASK_VISIBILITY_TIMEOUT
+# seconds and handed out again if no result arrives by then, up to TASK_MAX_ATTEMPTS leases; tasks
+# out of attempts are marked failed by `flask fail-expired-tasks`. /getwork?batch=N leases at most
+# TASK_LEASE_MAX_BATCH tasks, and placeholder tasks are generated when the queue is empty unless
+# TASK_GENERATE_WHEN_EMPTY is off
+TASK_VISIBILITY_TIMEOUT = float(os.getenv('TASK_VISIBILITY_TIMEOUT', '300'))
+TASK_MAX_ATTEMPTS = int(os.getenv('TASK_MAX_ATTEMPTS', '5'))
+TASK_LEASE_MAX_BATCH = int(os.getenv('TASK_LEASE_MAX_BATCH', '100'))
+TASK_ENQUEUE_MAX_BATCH = int(os.getenv('TASK_ENQUEUE_MAX_BATCH', '1000'))
+TASK_GENERATE_WHEN_EMPTY = os.getenv('TASK_GENERATE_WHEN_EMPTY', 'true').lower() in ('1', 'true', 'yes')
+
+# Task results: most results accepted by one /submit/bulk request, and rows per INSERT statement
+# (kept under SQLite's limit of 999 bound parameters on older builds)
+SUBMIT_MAX_BATCH = int(os.getenv('SUBMIT_MAX_BATCH', '10000'))
+SUBMIT_INSERT_CHUNK = int(os.getenv('SUBMIT_INSERT_CHUNK', '300'))
+
+# Conversation context: token budget for the rolling summary sent with each message,
+# and how many recent messages the assistant run replays from the thread
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1000'))
+CONTEXT_RECENT_MESSAGES = int(os.getenv('CONTEXT_RECENT_MESSAGES', '20'))
+
+# Uploaded file bytes live in a content-addressed blob store, not in the database
+BLOB_STORE_BACKEND = os.getenv('BLOB_STORE_BACKEND', 'local')
+BLOB_STORE_PATH = os.getenv('BLOB_STORE_PATH', 'blobs')
+
+# Uploads of already-seen content reuse the earlier OpenAI file and score until the
+# entry has been idle this long; idle entries are evicted by `flask evict-uploads`
+OPENAI_FILE_IDLE_TTL = int(os.getenv('OPENAI_FILE_IDLE_TTL', str(30 * 24 * 3600)))
+
+# Hard cap on /upload request size in bytes; larger requests are rejected with 413 before the body is read
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', str(25 * 1024 * 1024)))
+
+# Document scoring: tokens per chunk, chunks scored concurrently per process, and
+# (if non-zero) how many evenly spaced chunks to score for documents larger than that
+SCORE_CHUNK_TOKENS = int(os.getenv('SCORE_CHUNK_TOKENS', '3000'))
+SCORE_WORKERS = int(os.getenv('SCORE_WORKERS', '4'))
+SCORE_SAMPLE_CHUNKS = int(os.getenv('SCORE_SAMPLE_CHUNKS', '0'))
+
+# Background processing of uploads (OpenAI upload and scoring), and the longest
+# a client may long-poll /get_file_score, in seconds
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '2'))
+UPLOAD_MAX_PENDING = int(os.getenv('UPLOAD_MAX_PENDING', '32'))
+FILE_SCORE_MAX_WAIT = float(os.getenv('FILE_SCORE_MAX_WAIT', '30'))
+
+# Uploads still pending after this many seconds are assumed lost (their worker exited
+# before finishing) and are processed again by `flask requeue-uploads`
+UPLOAD_REQUEUE_AFTER = float(os.getenv('UPLOAD_REQUEUE_AFTER', '1800'))
+
+# Per-process user cache: maximum entries, and seconds before an entry is re-read
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '1024'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+
+# Per-process cache of OpenAI thread ids known to exist
+THREAD_CACHE_SIZE = int(os.getenv('THREAD_CACHE_SIZE', '4096'))
+THREAD_CACHE_TTL = float(os.getenv('THREAD_CACHE_TTL', '3600'))
+
+# Outbound HTTP (OpenAI, Twitter): keep-alive pool sizes and timeouts in seconds, and the
+# total budget for all OpenAI calls made by one chat turn
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '60'))
+HTTP_WRITE_TIMEOUT = float(os.getenv('HTTP_WRITE_TIMEOUT', '30'))
+HTTP_POOL_TIMEOUT = float(os.getenv('HTTP_POOL_TIMEOUT', '5'))
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '100'))
+HTTP_MAX_KEEPALIVE = int(os.getenv('HTTP_MAX_KEEPALIVE', '20'))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '30'))
+CHAT_TURN_DEADLINE = float(os.getenv('CHAT_TURN_DEADLINE', '120'))
+UPLOAD_PROCESS_DEADLINE = float(os.getenv('UPLOAD_PROCESS_DEADLINE', '600'))
+
+# OpenAI retries: attempts per call and the exponential backoff range in seconds. The circuit
+# breaker opens after OPENAI_BREAKER_FAILURES consecutive failures and tries again after
+# OPENAI_BREAKER_RESET seconds; while open, chat turns are refused with 503
+OPENAI_RETRY_ATTEMPTS = int(os.getenv('OPENAI_RETRY_ATTEMPTS', '4'))
+OPENAI_RETRY_BASE_DELAY = float(os.getenv('OPENAI_RETRY_BASE_DELAY', '0.5'))
+OPENAI_RETRY_MAX_DELAY = float(os.getenv('OPENAI_RETRY_MAX_DELAY', '20'))
+OPENAI_BREAKER_FAILURES = int(os.getenv('OPENAI_BREAKER_FAILURES', '5'))
+OPENAI_BREAKER_RESET = float(os.getenv('OPENAI_BREAKER_RESET', '30'))
+
+# A turn that is not streamed renews its conversation lease only between runs, so the lease must
+# outlive one whole turn: CHAT_TURN_DEADLINE, which also bounds OpenAI retries and their waits,
+# plus time for the database writes. Streamed turns renew it every third of the TTL as they go
+CONVERSATION_LEASE_TTL = float(os.getenv('CONVERSATION_LEASE_TTL', str(CHAT_TURN_DEADLINE + 60)))
+
+# Opt-in SQLite profile for single-node production: WAL journaling so readers never block
+# the writer, fewer fsyncs per commit, waiting on locks instead of failing with
+# "database is locked", and a larger page cache and memory map
+SQLITE_PERFORMANCE_PROFILE = os.getenv('SQLITE_PERFORMANCE_PROFILE', 'false').lower() in ('1', 'true', 'yes')
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '65536'))
+# Seconds between background WAL checkpoints, which keep the -wal file from growing unbounded
+SQLITE_WAL_CHECKPOINT_INTERVAL = float(os.getenv('SQLITE_WAL_CHECKPOINT_INTERVAL', '60'))
+
+SQLITE_DEFAULT_PRAGMAS = [
+    "PRAGMA foreign_keys=ON",
+]
+
+SQLITE_PERFORMANCE_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",  # Safe with WAL: a power loss can drop the last commits but not corrupt the database
+    f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+    f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",  # Negative means KiB rather than pages
+    "PRAGMA temp_store=MEMORY",
+]
+
+def apply_sqlite_pragmas(dbapi_connection, performance=SQLITE_PERFORMANCE_PROFILE):
+    """
+    Run the connection-level PRAGMAs on a new sqlite3 connection.
+    """
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_DEFAULT_PRAGMAS + (SQLITE_PERFORMANCE_PRAGMAS if performance else []):
+        cursor.execute(pragma)
+    cursor.close()
+
+def start_wal_checkpointer(engine, interval=SQLITE_WAL_CHECKPOINT_INTERVAL):
+    """
+    Start a daemon thread that runs a PASSIVE WAL checkpoint every interval seconds.
+
+    PASSIVE checkpoints never wait on readers or writers, so this cannot stall requests.
+    """
+    import threading
+    import time
+    from sqlalchemy import text
+
+    def checkpoint_loop():
+        while True:
+            time.sleep(interval)
+            try:
+                with engine.connect() as connection:
+                    connection.execute(text("PRAGMA wal_checkpoint(PASSIVE)"))
+            except Exception:
+                logging.getLogger(__name__).exception("WAL checkpoint failed")
+
+    thread = threading.Thread(target=checkpoint_loop, name='sqlite-wal-checkpoint', daemon=True)
+    thread.start()
+    return thread
+
 # JSON serialization for SQLite
 if database_url.startswith('sqlite:'):
     from sqlalchemy.engine import Engine
@@ -21,17 +217,10 @@ if database_url.startswith('sqlite:'):
 
     @event.listens_for(Engine, "connect")
     def set_sqlite_pragma(dbapi_connection, connection_record):
-        cursor = dbapi_connection.cursor()
-        cursor.execute("PRAGMA foreign_keys=ON")
-        cursor.close()
+        # Other databases' connections pass through this hook too
+        if type(dbapi_connection).__module__.startswith('sqlite3'):
+            apply_sqlite_pragmas(dbapi_connection)
 else:
     # For non-SQLite databases, define an empty function
     def set_sqlite_pragma(dbapi_connection, connection_record):
         pass
-
-# Ensure the SQLite database file exists
-if database_url.startswith('sqlite:'):
-    db_path = database_url.replace('sqlite:///', '')
-    if not os.path.exists(db_path):
-        open(db_path, 'a').close()
-        print(f"Created SQLite database file: {db_path}")
@@ -0,0 +1,68 @@
+import json
+
+
+def estimate_tokens(text):
+    """
+    Rough token count for budgeting, at about four characters per token.
+    """
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Keep the most recent part of text that fits within max_tokens.
+    """
+    max_chars = max_tokens * 4
+    return text if len(text) <= max_chars else text[-max_chars:]
+
+
+def load_recent(raw):
+    """
+    Decode a stored recent-message window, oldest message first.
+    """
+    return json.loads(raw) if raw else []
+
+
+def dump_recent(recent):
+    return json.dumps(recent)
+
+
+def format_messages(messages):
+    return "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+
+
+def build_context(summary, token_budget):
+    """
+    Build the conversation context sent with a new message.
+
+    Recent messages are already replayed from the OpenAI thread, so only the
+    summary of older turns is sent, capped at token_budget.
+    """
+    return truncate_to_tokens(summary or "", token_budget)
+
+
+def extractive_summary(summary, messages, token_budget):
+    """
+    Fold messages into the summary by appending them and keeping the newest text that fits.
+    """
+    parts = [part for part in (summary, format_messages(messages)) if part]
+    return truncate_to_tokens("\n".join(parts), token_budget)
+
+
+def advance_window(summary, recent, new_messages, window, summarize):
+    """
+    Append new messages to the recent window and fold overflow into the summary.
+
+    Once the window holds more than `window` messages, the oldest are folded
+    down to half a window in one summarize(summary, folded) call, so the
+    summarizer runs once every few turns instead of on every turn.
+
+    Returns:
+        tuple: (summary, recent)
+    """
+    recent = recent + new_messages
+    if len(recent) > window:
+        keep = max(window // 2, 1)
+        folded, recent = recent[:-keep], recent[-keep:]
+        summary = summarize(summary, folded)
+    return summary, recent
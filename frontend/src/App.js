@@ -159,13 +159,18 @@ function App() {
           console.log("File ID received:", data.file_id);
           setUploadedFile(data.filename);
 
-          // Fetch the file score from the new endpoint
+          // Wait for the file score, long-polling while it is still being computed
           try {
             console.log("Fetching file score for file ID:", data.file_id);
-            const scoreResponse = await fetch(`/get_file_score/${data.file_id}`);
-            const scoreData = await scoreResponse.json();
+            let scoreResponse = await fetch(`/get_file_score/${data.file_id}?wait=25`);
+            let scoreData = await scoreResponse.json();
+            while (scoreResponse.ok && scoreData.score_status === 'pending') {
+              console.log("File score still pending, waiting...");
+              scoreResponse = await fetch(`/get_file_score/${data.file_id}?wait=25`);
+              scoreData = await scoreResponse.json();
+            }
             console.log("Score data received:", scoreData);
-            if (scoreResponse.ok) {
+            if (scoreResponse.ok && scoreData.score_status === 'ready') {
               setUserScore(prevScore => {
                 console.log("Current user score before update:", prevScore);
                 const newScore = prevScore + scoreData.score;
@@ -176,7 +181,7 @@ function App() {
               });
               console.log("setUserScore called. New score should be applied.");
             } else {
-              console.error("Failed to fetch file score:", scoreData.error);
+              console.error("Failed to fetch file score:", scoreData.error || scoreData.score_status);
             }
           } catch (scoreError) {
             console.error("Error fetching file score:", scoreError);
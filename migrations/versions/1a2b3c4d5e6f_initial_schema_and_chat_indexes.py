@@ -0,0 +1,127 @@
+"""initial schema and chat hot-path indexes
+
+Revision ID: 1a2b3c4d5e6f
+Revises:
+Create Date: 2026-10-17 09:12:41.338102
+
+Databases created before migrations were tracked already have these tables
+(from db.create_all), so every step only creates what is missing.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a2b3c4d5e6f'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _inspector():
+    return sa.inspect(op.get_bind())
+
+
+def _has_table(name):
+    return _inspector().has_table(name)
+
+
+def _has_column(table, column):
+    return column in {c['name'] for c in _inspector().get_columns(table)}
+
+
+def _has_index(table, name):
+    return name in {i['name'] for i in _inspector().get_indexes(table)}
+
+
+def upgrade():
+    if not _has_table('user'):
+        op.create_table(
+            'user',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.String(), nullable=False),
+            sa.Column('user_score', sa.Integer(), nullable=True),
+            sa.Column('user_notes', sa.Text(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('user_id')
+        )
+
+    if not _has_table('conversation'):
+        op.create_table(
+            'conversation',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('conversation_id', sa.String(), nullable=False),
+            sa.Column('user_id', sa.String(), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('context_summary', sa.Text(), nullable=True),
+            sa.Column('recent_messages', sa.Text(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.user_id']),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('conversation_id')
+        )
+    else:
+        with op.batch_alter_table('conversation') as batch_op:
+            if not _has_column('conversation', 'context_summary'):
+                batch_op.add_column(sa.Column('context_summary', sa.Text(), nullable=True))
+            if not _has_column('conversation', 'recent_messages'):
+                batch_op.add_column(sa.Column('recent_messages', sa.Text(), nullable=True))
+
+    if not _has_table('file'):
+        op.create_table(
+            'file',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.String(), nullable=False),
+            sa.Column('filename', sa.String(), nullable=False),
+            sa.Column('file_content', sa.LargeBinary(), nullable=False),
+            sa.Column('upload_date', sa.DateTime(), nullable=True),
+            sa.Column('mime_type', sa.String(), nullable=False),
+            sa.Column('file_size', sa.Integer(), nullable=False),
+            sa.Column('score', sa.Integer(), nullable=True),
+            sa.Column('openai_file_id', sa.String(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.user_id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    if not _has_table('message'):
+        op.create_table(
+            'message',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('conversation_id', sa.String(), nullable=False),
+            sa.Column('content', sa.Text(), nullable=False),
+            sa.Column('timestamp', sa.DateTime(), nullable=True),
+            sa.Column('file_id', sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(['conversation_id'], ['conversation.conversation_id']),
+            sa.ForeignKeyConstraint(['file_id'], ['file.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    if not _has_table('chat_job'):
+        op.create_table(
+            'chat_job',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('job_id', sa.String(), nullable=False),
+            sa.Column('user_id', sa.String(), nullable=False),
+            sa.Column('conversation_id', sa.String(), nullable=True),
+            sa.Column('message', sa.Text(), nullable=False),
+            sa.Column('status', sa.String(), nullable=False),
+            sa.Column('status_code', sa.Integer(), nullable=True),
+            sa.Column('result', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('job_id')
+        )
+
+    if not _has_index('message', 'ix_message_conversation_id_timestamp'):
+        op.create_index('ix_message_conversation_id_timestamp', 'message', ['conversation_id', 'timestamp'])
+    if not _has_index('conversation', 'ix_conversation_user_id'):
+        op.create_index('ix_conversation_user_id', 'conversation', ['user_id'])
+    if not _has_index('file', 'ix_file_user_id'):
+        op.create_index('ix_file_user_id', 'file', ['user_id'])
+
+
+def downgrade():
+    # Only the indexes are dropped; the tables predate migration tracking
+    op.drop_index('ix_file_user_id', table_name='file')
+    op.drop_index('ix_conversation_user_id', table_name='conversation')
+    op.drop_index('ix_message_conversation_id_timestamp', table_name='message')
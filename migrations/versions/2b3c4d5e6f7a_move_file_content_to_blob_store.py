@@ -0,0 +1,109 @@
+"""move file content to the blob store
+
+Revision ID: 2b3c4d5e6f7a
+Revises: 1a2b3c4d5e6f
+Create Date: 2026-10-17 11:40:05.902114
+
+Adds file.content_hash and copies existing file_content bytes into the
+configured blob store in batches, clearing the column as each row moves.
+The copy runs outside the migration's transaction and commits each row as it
+moves, so locks are held briefly and an interrupted run resumes where it
+stopped.
+On PostgreSQL, run VACUUM on the file table afterwards to reclaim the space.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from blobstore import get_blob_store
+from config import BLOB_STORE_BACKEND, BLOB_STORE_PATH
+
+
+# revision identifiers, used by Alembic.
+revision = '2b3c4d5e6f7a'
+down_revision = '1a2b3c4d5e6f'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 100
+
+file_table = sa.table(
+    'file',
+    sa.column('id', sa.Integer),
+    sa.column('file_content', sa.LargeBinary),
+    sa.column('content_hash', sa.String)
+)
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    with op.batch_alter_table('file') as batch_op:
+        if 'content_hash' not in {c['name'] for c in inspector.get_columns('file')}:
+            batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        batch_op.alter_column('file_content', existing_type=sa.LargeBinary(), nullable=True)
+    if 'ix_file_content_hash' not in {i['name'] for i in inspector.get_indexes('file')}:
+        op.create_index('ix_file_content_hash', 'file', ['content_hash'])
+
+    # Commits the schema changes above; each row's move below is then committed on its own
+    with op.get_context().autocommit_block():
+        copy_content_to_blob_store()
+
+
+def copy_content_to_blob_store():
+    store = get_blob_store(BLOB_STORE_BACKEND, BLOB_STORE_PATH)
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(file_table.c.id, file_table.c.file_content)
+            .where(file_table.c.id > last_id)
+            .where(file_table.c.content_hash.is_(None))
+            .where(file_table.c.file_content.isnot(None))
+            .order_by(file_table.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        for file_id, content in rows:
+            digest, _ = store.put_bytes(bytes(content))
+            conn.execute(
+                file_table.update()
+                .where(file_table.c.id == file_id)
+                .values(content_hash=digest, file_content=None)
+            )
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        copy_content_from_blob_store()
+
+    op.drop_index('ix_file_content_hash', table_name='file')
+    with op.batch_alter_table('file') as batch_op:
+        batch_op.alter_column('file_content', existing_type=sa.LargeBinary(), nullable=False)
+        batch_op.drop_column('content_hash')
+
+
+def copy_content_from_blob_store():
+    store = get_blob_store(BLOB_STORE_BACKEND, BLOB_STORE_PATH)
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(file_table.c.id, file_table.c.content_hash)
+            .where(file_table.c.id > last_id)
+            .where(file_table.c.file_content.is_(None))
+            .order_by(file_table.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        for file_id, digest in rows:
+            with store.open(digest) as f:
+                content = f.read()
+            conn.execute(
+                file_table.update()
+                .where(file_table.c.id == file_id)
+                .values(file_content=content)
+            )
+        last_id = rows[-1][0]
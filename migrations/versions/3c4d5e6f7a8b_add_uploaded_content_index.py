@@ -0,0 +1,36 @@
+"""add uploaded content index
+
+Revision ID: 3c4d5e6f7a8b
+Revises: 2b3c4d5e6f7a
+Create Date: 2026-10-17 14:03:27.551870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c4d5e6f7a8b'
+down_revision = '2b3c4d5e6f7a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if sa.inspect(op.get_bind()).has_table('uploaded_content'):
+        return
+    op.create_table(
+        'uploaded_content',
+        sa.Column('content_hash', sa.String(length=64), nullable=False),
+        sa.Column('openai_file_id', sa.String(), nullable=False),
+        sa.Column('score', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('last_used_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('content_hash')
+    )
+    op.create_index('ix_uploaded_content_last_used_at', 'uploaded_content', ['last_used_at'])
+
+
+def downgrade():
+    op.drop_index('ix_uploaded_content_last_used_at', table_name='uploaded_content')
+    op.drop_table('uploaded_content')
@@ -0,0 +1,30 @@
+"""add file score status
+
+Revision ID: 4d5e6f7a8b9c
+Revises: 3c4d5e6f7a8b
+Create Date: 2026-10-17 16:21:50.117463
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d5e6f7a8b9c'
+down_revision = '3c4d5e6f7a8b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('file')}
+    if 'score_status' in columns:
+        return
+    # Files uploaded before background scoring were scored synchronously, so they are ready
+    with op.batch_alter_table('file') as batch_op:
+        batch_op.add_column(sa.Column('score_status', sa.String(), nullable=False, server_default='ready'))
+
+
+def downgrade():
+    with op.batch_alter_table('file') as batch_op:
+        batch_op.drop_column('score_status')
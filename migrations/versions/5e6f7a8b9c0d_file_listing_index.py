@@ -0,0 +1,29 @@
+"""replace file user_id index with (user_id, id)
+
+Revision ID: 5e6f7a8b9c0d
+Revises: 4d5e6f7a8b9c
+Create Date: 2026-10-17 18:05:12.664029
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e6f7a8b9c0d'
+down_revision = '4d5e6f7a8b9c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    indexes = {i['name'] for i in sa.inspect(op.get_bind()).get_indexes('file')}
+    if 'ix_file_user_id_id' not in indexes:
+        op.create_index('ix_file_user_id_id', 'file', ['user_id', 'id'])
+    if 'ix_file_user_id' in indexes:
+        op.drop_index('ix_file_user_id', table_name='file')
+
+
+def downgrade():
+    op.create_index('ix_file_user_id', 'file', ['user_id'])
+    op.drop_index('ix_file_user_id_id', table_name='file')
@@ -0,0 +1,36 @@
+"""add conversation lease
+
+Revision ID: 7a8b9c0d1e2f
+Revises: 6f7a8b9c0d1e
+Create Date: 2026-10-17 21:12:05.118342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a8b9c0d1e2f'
+down_revision = '6f7a8b9c0d1e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('conversation_lease'):
+        op.create_table(
+            'conversation_lease',
+            sa.Column('conversation_id', sa.String(), nullable=False),
+            sa.Column('holder', sa.String(), nullable=False),
+            sa.Column('expires_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('conversation_id')
+        )
+    indexes = {index['name'] for index in inspector.get_indexes('chat_job')}
+    if 'ix_chat_job_conversation_id_status' not in indexes:
+        op.create_index('ix_chat_job_conversation_id_status', 'chat_job', ['conversation_id', 'status'])
+
+
+def downgrade():
+    op.drop_index('ix_chat_job_conversation_id_status', table_name='chat_job')
+    op.drop_table('conversation_lease')
@@ -0,0 +1,50 @@
+"""add task queue
+
+Revision ID: 8b9c0d1e2f3a
+Revises: 7a8b9c0d1e2f
+Create Date: 2026-10-17 23:40:18.604217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b9c0d1e2f3a'
+down_revision = '7a8b9c0d1e2f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('task'):
+        op.create_table(
+            'task',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('task_id', sa.String(), nullable=False),
+            sa.Column('description', sa.Text(), nullable=False),
+            sa.Column('code_blob', sa.Text(), nullable=False),
+            sa.Column('status', sa.String(), nullable=False),
+            sa.Column('attempts', sa.Integer(), nullable=False),
+            sa.Column('lease_holder', sa.String(), nullable=True),
+            sa.Column('lease_expires_at', sa.DateTime(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('task_id')
+        )
+        inspector = sa.inspect(op.get_bind())
+    indexes = {index['name'] for index in inspector.get_indexes('task')}
+    if 'ix_task_status_id' not in indexes:
+        op.create_index('ix_task_status_id', 'task', ['status', 'id'])
+    if 'ix_task_status_lease_expires_at' not in indexes:
+        op.create_index('ix_task_status_lease_expires_at', 'task', ['status', 'lease_expires_at'])
+    if 'ix_task_lease_holder' not in indexes:
+        op.create_index('ix_task_lease_holder', 'task', ['lease_holder'])
+
+
+def downgrade():
+    op.drop_index('ix_task_lease_holder', table_name='task')
+    op.drop_index('ix_task_status_lease_expires_at', table_name='task')
+    op.drop_index('ix_task_status_id', table_name='task')
+    op.drop_table('task')
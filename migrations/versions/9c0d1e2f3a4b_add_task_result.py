@@ -0,0 +1,34 @@
+"""add task result
+
+Revision ID: 9c0d1e2f3a4b
+Revises: 8b9c0d1e2f3a
+Create Date: 2026-10-18 01:05:47.219930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c0d1e2f3a4b'
+down_revision = '8b9c0d1e2f3a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('task_result'):
+        op.create_table(
+            'task_result',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('task_id', sa.String(), nullable=False),
+            sa.Column('result', sa.Text(), nullable=False),
+            sa.Column('submitted_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('task_id')
+        )
+
+
+def downgrade():
+    op.drop_table('task_result')
@@ -0,0 +1,109 @@
+JSON_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class ReplyStream:
+    """
+    Pull one top-level string field out of a JSON object that arrives in chunks.
+
+    The assistant answers with a JSON envelope such as {"reply": ..., "updated_notes": ...,
+    "score_change": ...}. feed() takes each streamed chunk of that envelope and returns only
+    the newly decoded text of the field, so clients never see the envelope, the notes or
+    the score. Anything that is not a JSON object yields no text.
+    """
+
+    def __init__(self, field='reply'):
+        self.field = field
+        self._depth = 0
+        self._in_string = False
+        self._string_kind = None  # 'key', 'field' or 'other' while inside a string
+        self._escape = None  # None, '' after a backslash, or the hex digits of a \u escape
+        self._high_surrogate = None
+        self._key = []
+        self._last_key = None
+        self._after_colon = False
+        self._done = False
+
+    def feed(self, chunk):
+        """
+        Consume the next chunk of the envelope.
+
+        Returns:
+            str: The field's text decoded from this chunk, possibly empty
+        """
+        out = []
+        for c in chunk:
+            if self._done:
+                break
+            if self._in_string:
+                self._string_char(c, out)
+            elif c == '"':
+                self._in_string = True
+                if self._depth == 1 and not self._after_colon:
+                    self._string_kind = 'key'
+                    self._key = []
+                elif self._depth == 1 and self._last_key == self.field:
+                    self._string_kind = 'field'
+                else:
+                    self._string_kind = 'other'
+            elif c in '{[':
+                if self._depth == 0 and c == '[':
+                    self._done = True
+                self._depth += 1
+            elif c in '}]':
+                self._depth -= 1
+                if self._depth <= 0:
+                    self._done = True
+            elif self._depth == 1 and c == ':':
+                self._after_colon = True
+            elif self._depth == 1 and c == ',':
+                self._after_colon = False
+                self._last_key = None
+            elif self._depth == 0 and not c.isspace():
+                self._done = True  # Not a JSON object
+        return ''.join(out)
+
+    def _string_char(self, c, out):
+        if self._escape is None:
+            if c == '\\':
+                self._escape = ''
+            elif c == '"':
+                self._end_string()
+            else:
+                self._emit(c, out)
+        elif self._escape == '':
+            if c == 'u':
+                self._escape = 'u'
+            else:
+                self._escape = None
+                self._emit(JSON_ESCAPES.get(c, c), out)
+        else:
+            self._escape += c
+            if len(self._escape) == 5:
+                digits, self._escape = self._escape[1:], None
+                try:
+                    self._emit_code_point(int(digits, 16), out)
+                except ValueError:
+                    pass  # Malformed escape; json.loads will reject the full message too
+
+    def _emit_code_point(self, code, out):
+        if 0xD800 <= code < 0xDC00:
+            self._high_surrogate = code
+            return
+        if 0xDC00 <= code < 0xE000 and self._high_surrogate is not None:
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self._high_surrogate = None
+        self._emit(chr(code), out)
+
+    def _emit(self, text, out):
+        if self._string_kind == 'key':
+            self._key.append(text)
+        elif self._string_kind == 'field':
+            out.append(text)
+
+    def _end_string(self):
+        self._in_string = False
+        if self._string_kind == 'key':
+            self._last_key = ''.join(self._key)
+        elif self._string_kind == 'field':
+            self._done = True
+        self._string_kind = None
@@ -0,0 +1,248 @@
+import asyncio
+import email.utils
+import random
+import threading
+import time
+
+from transport import DeadlineExceeded, remaining_budget
+
+# Statuses worth retrying: timeouts, lock conflicts, rate limits and server-side failures
+RETRYABLE_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling an upstream that the circuit breaker has marked unhealthy.
+
+    retry_after is the number of seconds until the breaker lets a trial call through.
+    """
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit '{name}' is open; retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast after failure_threshold consecutive upstream failures.
+
+    Once open, it stays open for reset_timeout seconds, then lets a single trial
+    call through (half-open): success closes it, failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return 'closed'
+        if now - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def before_call(self):
+        """
+        Raise CircuitOpen unless a call may go through now.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(now)
+            if state == 'closed':
+                return
+            if state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self.rejected += 1
+            retry_after = max(0.0, self._opened_at + self.reset_timeout - now) if state == 'open' else 1.0
+        raise CircuitOpen(self.name, retry_after)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._trial_in_flight:
+                    self.opened += 1
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release(self):
+        """
+        End a call whose outcome says nothing about upstream health (e.g. a 404).
+        """
+        with self._lock:
+            if self._trial_in_flight:
+                self._trial_in_flight = False
+                self._failures = 0
+                self._opened_at = None
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self._state(time.monotonic()),
+                'consecutive_failures': self._failures,
+                'opened': self.opened,
+                'rejected': self.rejected,
+            }
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: attempt n waits a random time between
+    0 and min(max_delay, base_delay * 2**n), or longer if the server asked to via Retry-After.
+    """
+
+    def __init__(self, max_attempts, base_delay, max_delay):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, retry_after=None):
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            return max(backoff, retry_after)
+        return backoff
+
+
+def status_code_of(error):
+    """
+    HTTP status of an API error, or None for connection errors and timeouts.
+    """
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        response = getattr(error, 'response', None)
+        status = getattr(response, 'status_code', None)
+    return status
+
+
+def retry_after_seconds(error):
+    """
+    Seconds the server asked us to wait, from Retry-After-Ms or Retry-After (delta or HTTP date).
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_deadline_expired(error):
+    """
+    Whether an error is the caller's own deadline running out (transport.DeadlineExceeded),
+    raised directly or wrapped by the OpenAI SDK. It says nothing about upstream health.
+    """
+    return isinstance(error, DeadlineExceeded) or isinstance(error.__cause__, DeadlineExceeded)
+
+
+def is_transient(error):
+    """
+    Whether an error is an upstream failure worth retrying: no response at all, or a retryable status.
+    """
+    if is_deadline_expired(error):
+        return False
+    status = status_code_of(error)
+    if status is None:
+        return type(error).__name__ in ('APIConnectionError', 'APITimeoutError') or isinstance(error, (ConnectionError, TimeoutError))
+    return status in RETRYABLE_STATUSES
+
+
+def _retry_delay(error, attempt, policy, breaker, retry_on, retry_busy):
+    """
+    Record a failed attempt with the breaker and decide whether to try again.
+
+    Returns:
+        float: Seconds to wait before the next attempt, or None if the error should be raised
+    """
+    remaining = remaining_budget()
+    if is_deadline_expired(error) or remaining == 0:
+        breaker.release()
+        return None
+    if retry_on(error):
+        breaker.record_failure()
+    elif retry_busy is not None and retry_busy(error):
+        breaker.release()
+    else:
+        breaker.release()
+        return None
+    delay = policy.delay(attempt, retry_after_seconds(error))
+    if attempt == policy.max_attempts - 1 or (remaining is not None and delay >= remaining):
+        return None
+    return delay
+
+
+def call_with_retry(fn, policy, breaker, retry_on=is_transient, retry_busy=None, on_retry=None, sleep=time.sleep):
+    """
+    Call fn(), retrying transient failures with backoff under a circuit breaker.
+
+    Only errors matching retry_on count against the breaker. Errors matching
+    retry_busy (OpenAI answered, but the resource is busy) are retried the same
+    way without counting; anything else, including the caller's own deadline
+    running out, is raised at once. Retries stop early when the current deadline
+    (see transport.deadline) would expire before the next attempt.
+    on_retry(error, attempt, delay) is called before each wait.
+    """
+    for attempt in range(policy.max_attempts):
+        breaker.before_call()
+        try:
+            result = fn()
+        except Exception as e:
+            delay = _retry_delay(e, attempt, policy, breaker, retry_on, retry_busy)
+            if delay is None:
+                raise
+            if on_retry:
+                on_retry(e, attempt, delay)
+            sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+
+async def async_call_with_retry(fn, policy, breaker, retry_on=is_transient, retry_busy=None, on_retry=None, sleep=asyncio.sleep):
+    """
+    call_with_retry for a coroutine function: awaits fn(), and waits between
+    attempts without blocking the event loop.
+    """
+    for attempt in range(policy.max_attempts):
+        breaker.before_call()
+        try:
+            result = await fn()
+        except Exception as e:
+            delay = _retry_delay(e, attempt, policy, breaker, retry_on, retry_busy)
+            if delay is None:
+                raise
+            if on_retry:
+                on_retry(e, attempt, delay)
+            await sleep(delay)
+        else:
+            breaker.record_success()
+            return result
@@ -19,6 +19,9 @@ source venv/bin/activate
 # Install the required dependencies
 pip install -r requirements.txt
 
-# Run the Flask app
+# Create or upgrade the database schema
 export FLASK_APP=app.py
+flask db upgrade
+
+# Run the Flask app
 flask run
\ No newline at end of file
@@ -0,0 +1,100 @@
+import io
+import math
+from concurrent.futures import FIRST_COMPLETED, wait
+
+CHARS_PER_TOKEN = 4  # Same rough estimate as conversation_context.estimate_tokens
+
+
+def iter_text_chunks(fileobj, chunk_tokens):
+    """
+    Decode a binary file object and yield text chunks of about chunk_tokens tokens.
+
+    Chunks are cut at the last line break or space in their final tenth where
+    possible, so words are not split between chunks.
+    """
+    chunk_chars = chunk_tokens * CHARS_PER_TOKEN
+    reader = io.TextIOWrapper(fileobj, encoding='utf-8', errors='ignore')
+    carry = ''
+    while True:
+        text = carry + reader.read(chunk_chars - len(carry))
+        if not text:
+            return
+        if len(text) < chunk_chars:
+            yield text
+            return
+        cut = max(text.rfind('\n', chunk_chars * 9 // 10), text.rfind(' ', chunk_chars * 9 // 10))
+        if cut <= 0:
+            cut = len(text)
+        yield text[:cut]
+        carry = text[cut:]
+
+
+def estimate_chunk_count(size, chunk_tokens):
+    """
+    Estimate how many chunks a document of size bytes splits into.
+    """
+    return max(1, math.ceil(size / (chunk_tokens * CHARS_PER_TOKEN)))
+
+
+def sample_indices(total, sample):
+    """
+    Pick `sample` evenly spaced chunk indices out of total, always including the first and last.
+    """
+    if sample >= total:
+        return set(range(total))
+    if sample == 1:
+        return {0}
+    return {round(i * (total - 1) / (sample - 1)) for i in range(sample)}
+
+
+def reduce_scores(results):
+    """
+    Combine (score, chunk length) pairs into one 0-100 score, weighting each chunk by its length.
+
+    Chunks whose score is None (failed) are ignored.
+
+    Returns:
+        int: The combined score, or None if no chunk was scored
+    """
+    scored = [(score, length) for score, length in results if score is not None]
+    total_length = sum(length for _, length in scored)
+    if not total_length:
+        return None
+    weighted = sum(score * length for score, length in scored) / total_length
+    return max(0, min(round(weighted), 100))
+
+
+def score_document(fileobj, score_chunk, executor, chunk_tokens, max_in_flight, size=None, sample=0):
+    """
+    Score a document by scoring its chunks concurrently and reducing the results.
+
+    score_chunk(text) returns a 0-100 score or None on failure. At most
+    max_in_flight chunks are read and queued at once, so memory stays bounded
+    however large the document is. If sample is set and the document (by its
+    size in bytes) splits into more than sample chunks, only sample evenly
+    spaced chunks are scored.
+
+    Returns:
+        int: The combined score, or None if no chunk was scored
+    """
+    selected = None
+    if sample and size is not None:
+        total = estimate_chunk_count(size, chunk_tokens)
+        if total > sample:
+            selected = sample_indices(total, sample)
+
+    results = []
+    pending = {}
+    for index, chunk in enumerate(iter_text_chunks(fileobj, chunk_tokens)):
+        if selected is not None and index not in selected:
+            continue
+        if len(pending) >= max_in_flight:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                results.append((future.result(), pending.pop(future)))
+        pending[executor.submit(score_chunk, chunk)] = len(chunk)
+
+    for future, length in pending.items():
+        results.append((future.result(), length))
+
+    return reduce_scores(results)
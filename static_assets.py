@@ -0,0 +1,155 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:  # Optional: pip install brotli for br variants
+    brotli = None
+
+# Files smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+# Larger files are streamed from disk instead of kept in memory
+MEMORY_MAX_BYTES = 4 * 1024 * 1024
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml', 'application/xml')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+# Source maps are JSON. Only browser devtools fetch them, so they are not worth compressing
+mimetypes.add_type('application/json', '.map')
+UNCOMPRESSED_SUFFIXES = ('.map',)
+
+# Preferred order when the client accepts several encodings equally
+ENCODINGS = ('br', 'gzip')
+
+
+class Asset:
+    """
+    One file of the web build, with its bodies per content encoding.
+
+    bodies maps 'identity', 'gzip' and 'br' to bytes; identity is None for files
+    too large to keep in memory, which are sent from path instead.
+    """
+
+    def __init__(self, path, content_type, digest, immutable, bodies):
+        self.path = path
+        self.content_type = content_type
+        self.digest = digest
+        self.immutable = immutable
+        self.bodies = bodies
+
+    @property
+    def cache_control(self):
+        return IMMUTABLE_CACHE_CONTROL if self.immutable else REVALIDATE_CACHE_CONTROL
+
+    def etag(self, encoding):
+        # Each encoding is a different representation, so it needs its own ETag
+        return self.digest if encoding == 'identity' else f"{self.digest}-{encoding}"
+
+    def choose_encoding(self, accepted):
+        """
+        Pick the best available encoding given the client's quality for each of ENCODINGS.
+        """
+        best, best_quality = 'identity', 0
+        for encoding in ENCODINGS:
+            quality = accepted.get(encoding, 0)
+            if encoding in self.bodies and quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+
+def is_compressible(path, content_type):
+    return content_type.startswith(COMPRESSIBLE_TYPES) and not path.endswith(UNCOMPRESSED_SUFFIXES)
+
+
+def compress(data, encoding):
+    if encoding == 'gzip':
+        # mtime=0 keeps the output, and so the ETag, stable across restarts
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli else ('gzip',)
+
+
+class AssetIndex:
+    """
+    Every file under a web build directory, read, hashed and compressed once when the index is built.
+
+    Files listed in asset-manifest.json (other than index.html) have content hashes
+    in their names and are served as immutable; everything else is revalidated by ETag.
+    Precompressed .gz/.br files next to an asset (e.g. from the build) are used as is.
+    """
+
+    def __init__(self, root, manifest='asset-manifest.json'):
+        self.root = os.path.abspath(root)
+        self.assets = {}
+        if os.path.isdir(self.root):
+            hashed = self._hashed_paths(os.path.join(self.root, manifest))
+            self._build(hashed)
+
+    def _hashed_paths(self, manifest_path):
+        try:
+            with open(manifest_path) as f:
+                files = json.load(f).get('files', {})
+        except (OSError, ValueError):
+            return set()
+        return {url.lstrip('/') for url in files.values() if url.lstrip('/') != 'index.html'}
+
+    def _build(self, hashed):
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(('.gz', '.br')):
+                    continue
+                path = os.path.join(directory, filename)
+                relative = os.path.relpath(path, self.root).replace(os.sep, '/')
+                self.assets[relative] = self._load(path, relative in hashed)
+
+    def _load(self, path, immutable):
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        with open(path, 'rb') as f:
+            data = f.read()
+        bodies = {'identity': data if len(data) <= MEMORY_MAX_BYTES else None}
+        if is_compressible(path, content_type) and len(data) >= COMPRESS_MIN_BYTES:
+            for encoding in available_encodings():
+                bodies[encoding] = self._precompressed(path, encoding) or compress(data, encoding)
+        return Asset(path, content_type, hashlib.sha256(data).hexdigest()[:32], immutable, bodies)
+
+    def _precompressed(self, path, encoding):
+        suffix = '.gz' if encoding == 'gzip' else '.br'
+        try:
+            if os.path.getmtime(path + suffix) >= os.path.getmtime(path):
+                with open(path + suffix, 'rb') as f:
+                    return f.read()
+        except OSError:
+            pass
+        return None
+
+    def get(self, path):
+        return self.assets.get(path)
+
+    def write_precompressed(self):
+        """
+        Write .gz/.br files next to each compressible asset, for a front proxy
+        (e.g. nginx gzip_static/brotli_static) to serve without reaching Python.
+
+        Returns:
+            int: The number of files written
+        """
+        written = 0
+        for asset in self.assets.values():
+            for encoding in available_encodings():
+                body = asset.bodies.get(encoding)
+                if body is None:
+                    continue
+                with open(asset.path + ('.gz' if encoding == 'gzip' else '.br'), 'wb') as f:
+                    f.write(body)
+                written += 1
+        return written
@@ -0,0 +1,163 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Attributes every LogRecord has; anything else was passed through `extra` and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format each record as one JSON object per line, including any `extra` fields.
+    """
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep a random sample_rate fraction of records, and at most max_per_second of those.
+
+    Meant for loggers that carry whole API payloads. Dropped records are counted,
+    and the count is attached to the next record let through as `suppressed`.
+    """
+
+    def __init__(self, sample_rate=1.0, max_per_second=None):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.max_per_second = max_per_second
+        self._lock = threading.Lock()
+        self._tokens = max_per_second or 0
+        self._refilled_at = time.monotonic()
+        self.suppressed = 0
+
+    def filter(self, record):
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return self._drop()
+        if self.max_per_second is not None:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.max_per_second, self._tokens + (now - self._refilled_at) * self.max_per_second)
+                self._refilled_at = now
+                if self._tokens < 1:
+                    self.suppressed += 1
+                    return False
+                self._tokens -= 1
+        with self._lock:
+            if self.suppressed:
+                record.suppressed = self.suppressed
+                self.suppressed = 0
+        return True
+
+    def _drop(self):
+        with self._lock:
+            self.suppressed += 1
+        return False
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener's handlers.
+
+    Only the message and any traceback are rendered in the calling thread, so args and
+    exception objects never cross the queue; formatting happens on the listener thread.
+    """
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class BackgroundListener(QueueListener):
+    """
+    QueueListener whose stop() can be called more than once (e.g. by atexit after a test stops it).
+    """
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+    def restart_after_fork(self):
+        """
+        Start a new listener thread in a forked child (e.g. a gunicorn --preload worker);
+        the parent's thread does not survive the fork.
+        """
+        if self._thread is not None:
+            self._thread = None
+            self.start()
+
+
+def build_formatter(log_format):
+    if log_format == 'json':
+        return JsonFormatter()
+    return logging.Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+
+
+def attach_queue_logging(logger, handlers, level):
+    """
+    Route a logger's records through an in-memory queue to handlers run by a background listener.
+
+    The calling thread only enqueues the record; file and console I/O (and rotation)
+    happen on the listener thread, which is restarted in forked children and is
+    flushed and stopped at exit.
+
+    Returns:
+        QueueListener: The started listener
+    """
+    log_queue = queue.SimpleQueue()
+    listener = BackgroundListener(log_queue, *handlers, respect_handler_level=True)
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    logger.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+    os.register_at_fork(after_in_child=listener.restart_after_fork)
+    return listener
+
+
+def build_handlers(log_format, log_file, max_bytes, backup_count):
+    """
+    A rotating file handler (all levels) and a console handler (INFO and above).
+    With no log_file only the console handler is built.
+    """
+    formatter = build_formatter(log_format)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    console_handler.setLevel(logging.INFO)
+    if not log_file:
+        return [console_handler]
+
+    file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setFormatter(formatter)
+    file_handler.setLevel(logging.DEBUG)
+
+    return [file_handler, console_handler]
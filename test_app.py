@@ -1,14 +1,23 @@
 import pytest
 import io
-from app import app, db, User, Conversation, Message, UserFiles
+import json
+import os
+import time
+import httpx
+from app import create_app, db, User, Conversation, Message, File, known_threads, user_cache, openai_breaker
+from openai import APITimeoutError, NotFoundError
+from transport import DeadlineExceeded, transport_stats
 from unittest.mock import patch, MagicMock
+from blobstore import LocalBlobStore
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 
 @pytest.fixture(scope='function')
 def test_app():
-    app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-    return app
+    user_cache.clear()
+    known_threads.clear()
+    return create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:'})
 
 @pytest.fixture(scope='function')
 def test_client(test_app):
@@ -22,6 +31,9 @@ def init_database(test_app):
         db.session.remove()
         db.drop_all()
         db.create_all()  # Recreate tables for the next test
+    # The caches outlive the database, so drop entries for rows that no longer exist
+    user_cache.clear()
+    known_threads.clear()
 
 @pytest.fixture(autouse=True)
 def app_context(test_app):
@@ -30,7 +42,7 @@ def app_context(test_app):
 
 def test_get_user(init_database):
     # Create a test user
-    user = User(user_id='test_user', important_notes='Test notes', preferences={'key': 'value'})
+    user = User(user_id='test_user', user_notes='Test notes')
     db.session.add(user)
     db.session.commit()
 
@@ -39,16 +51,15 @@ def test_get_user(init_database):
     retrieved_user = get_user('test_user')
     assert retrieved_user is not None
     assert retrieved_user.user_id == 'test_user'
-    assert retrieved_user.important_notes == 'Test notes'
-    assert retrieved_user.preferences == {'key': 'value'}
+    assert retrieved_user.user_notes == 'Test notes'
 
 def test_create_user(init_database):
     from app import create_user
-    new_user = create_user('new_user', important_notes='New user notes', preferences={'pref': 'test'})
+    new_user = create_user('new_user', important_notes='New user notes')
     assert new_user is not None
     assert new_user.user_id == 'new_user'
-    assert new_user.important_notes == 'New user notes'
-    assert new_user.preferences == {'pref': 'test'}
+    assert new_user.user_notes == 'New user notes'
+    assert new_user.user_score == 0
 
 def test_get_conversation(init_database):
     # Create a test user
@@ -160,7 +171,8 @@ def test_chat_endpoint(mock_client, test_client, init_database):
     mock_client.beta.threads.create.return_value = mock_thread
     mock_client.beta.threads.runs.create.return_value = MagicMock(status='completed')
     mock_messages = MagicMock()
-    mock_messages.__iter__.return_value = [MagicMock(role='assistant', content=[MagicMock(text=MagicMock(value='AI response'))])]
+    reply = '{"reply": "AI response", "updated_notes": "", "score_change": 0}'
+    mock_messages.__iter__.return_value = [MagicMock(role='assistant', content=[MagicMock(text=MagicMock(value=reply))])]
     mock_client.beta.threads.messages.list.return_value = mock_messages
 
     # Create a test user
@@ -180,14 +192,494 @@ def test_chat_endpoint(mock_client, test_client, init_database):
     assert data['message'] == 'AI response'
     assert 'conversation_id' in data
 
+@patch('app.client')
+def test_chat_stream_endpoint(mock_client, test_client, init_database):
+    # Mock OpenAI client with a streamed run
+    mock_thread = MagicMock()
+    mock_thread.id = 'test_thread_id'
+    mock_client.beta.threads.create.return_value = mock_thread
+    reply = '{"reply": "Hello mortal", "updated_notes": "Curious", "score_change": 5}'
+    deltas = [
+        MagicMock(event='thread.message.delta', data=MagicMock(delta=MagicMock(content=[MagicMock(type='text', text=MagicMock(value=chunk))])))
+        for chunk in (reply[:16], reply[16:24], reply[24:])
+    ]
+    mock_client.beta.threads.runs.create.return_value = [
+        MagicMock(event='thread.run.created', data=MagicMock(id='run_1')),
+        *deltas,
+        MagicMock(event='thread.message.completed', data=MagicMock(role='assistant', content=[MagicMock(text=MagicMock(value=reply))])),
+        MagicMock(event='thread.run.completed'),
+    ]
+
+    response = test_client.post('/api/chat/stream', json={
+        'message': 'Hello, AI!',
+        'user_id': 'test_user'
+    })
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    assert 'event: done' in body
+    # Only the reply text is streamed, never the JSON envelope around it
+    tokens = [json.loads(line.split('data: ', 1)[1].split('\n')[0])['text']
+              for line in body.split('event: token\n')[1:]]
+    assert ''.join(tokens) == 'Hello mortal'
+    done = json.loads(body.split('event: done\ndata: ')[1].split('\n')[0])
+    assert done['message'] == 'Hello mortal'
+    assert done['score_change'] == 5
+    assert done['conversation_id'] == 'test_thread_id'
+    mock_client.beta.threads.runs.retrieve.assert_not_called()
+
+@patch('app.client')
+def test_chat_stream_ends_with_error_when_run_requires_action(mock_client, test_client, init_database):
+    mock_client.beta.threads.create.return_value = MagicMock(id='test_thread_id')
+    mock_client.beta.threads.runs.create.return_value = [
+        MagicMock(event='thread.run.created', data=MagicMock(id='run_1')),
+        MagicMock(event='thread.run.requires_action', data=MagicMock(id='run_1', last_error=None)),
+    ]
+
+    response = test_client.post('/api/chat/stream', json={'message': 'Hello, AI!', 'user_id': 'test_user'})
+    body = response.get_data(as_text=True)
+    assert 'event: error' in body
+    assert 'event: done' not in body
+    mock_client.beta.threads.runs.cancel.assert_called_once_with(thread_id='test_thread_id', run_id='run_1')
+
+@patch('app.process_chat_turn')
+@patch('app.chat_executor')
+def test_chat_job_mode(mock_executor, mock_process, test_client, init_database):
+    # Run queued jobs inline instead of on the worker pool
+    mock_executor.submit.side_effect = lambda fn, *args: fn(*args)
+    mock_process.return_value = ({'message': 'AI response', 'conversation_id': 'thread_1'}, 200)
+
+    response = test_client.post('/api/chat', json={
+        'message': 'Hello, AI!',
+        'user_id': 'test_user',
+        'async': True
+    })
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+    mock_process.assert_called_once_with('test_user', None, 'Hello, AI!')
+
+    response = test_client.get(f'/api/chat/jobs/{job_id}?wait=1')
+    assert response.status_code == 200
+    assert response.get_json()['message'] == 'AI response'
+
+@patch('app.process_chat_turn')
+@patch('app.chat_executor')
+def test_messages_queued_during_a_run_are_coalesced(mock_executor, mock_process, test_client, init_database):
+    from app import acquire_conversation_lease, release_conversation_lease, drain_conversation
+    mock_executor.submit.side_effect = lambda fn, *args: fn(*args)
+    mock_process.return_value = ({'message': 'AI response', 'conversation_id': 'thread_1'}, 200)
+
+    # Another worker's turn is running on the conversation
+    holder = acquire_conversation_lease('thread_1')
+    job_ids = []
+    for text in ('First', 'Second'):
+        response = test_client.post('/api/chat', json={
+            'message': text, 'user_id': 'test_user', 'conversation_id': 'thread_1', 'async': True
+        })
+        assert response.status_code == 202
+        job_ids.append(response.get_json()['job_id'])
+    mock_process.assert_not_called()
+
+    # When it finishes, both queued messages are answered by one run
+    release_conversation_lease('thread_1', holder)
+    drain_conversation('thread_1')
+    mock_process.assert_called_once_with('test_user', 'thread_1', 'First\n\nSecond')
+    for job_id in job_ids:
+        response = test_client.get(f'/api/chat/jobs/{job_id}')
+        assert response.status_code == 200
+        assert response.get_json()['message'] == 'AI response'
+
+def test_expired_conversation_lease_is_taken_over(init_database):
+    from app import ConversationLease, acquire_conversation_lease
+    from datetime import datetime, timedelta
+    assert acquire_conversation_lease('thread_1')
+    assert acquire_conversation_lease('thread_1') is None
+
+    ConversationLease.query.update({'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    assert acquire_conversation_lease('thread_1')
+
+def test_chat_job_not_found(test_client, init_database):
+    response = test_client.get('/api/chat/jobs/missing')
+    assert response.status_code == 404
+
+def explain_query_plan(query):
+    # SQLite's EXPLAIN QUERY PLAN for a compiled ORM query, one detail string per step
+    sql = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+    return [row[-1] for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+
+@pytest.mark.parametrize('query_factory, index_name', [
+    (lambda: Message.query.filter_by(conversation_id='c').order_by(Message.timestamp), 'ix_message_conversation_id_timestamp'),
+    (lambda: Conversation.query.filter_by(user_id='u'), 'ix_conversation_user_id'),
+    (lambda: File.query.filter_by(user_id='u').order_by(File.id.desc()), 'ix_file_user_id_id'),
+])
+def test_hot_path_queries_use_indexes(init_database, query_factory, index_name):
+    plan = explain_query_plan(query_factory())
+    assert any(index_name in step for step in plan), f"Expected {index_name} in plan: {plan}"
+    # A plain SCAN of the table or a temp sort means the index is no longer serving the query
+    assert not any(step.startswith('SCAN') for step in plan), f"Full scan in plan: {plan}"
+    assert not any('TEMP B-TREE' in step for step in plan), f"Extra sort in plan: {plan}"
+
+@pytest.fixture
+def inline_upload_worker():
+    # Process uploads inline instead of on the background pool
+    with patch('app.upload_executor') as mock_executor:
+        mock_executor.submit.side_effect = lambda fn, *args: fn(*args)
+        yield mock_executor
+
+@patch('app.calculate_file_score', return_value=42)
+@patch('app.client')
+def test_upload_is_scored_in_background(mock_client, mock_score, test_client, init_database, inline_upload_worker, tmp_path):
+    mock_client.files.create.return_value = MagicMock(id='file-abc')
+    user = User(user_id='test_user')
+    db.session.add(user)
+    db.session.commit()
+
+    with patch('app.blob_store', LocalBlobStore(str(tmp_path))):
+        response = test_client.post('/upload', data={
+            'file': (io.BytesIO(b'The forbidden tome'), 'tome.txt'),
+            'user_id': 'test_user'
+        }, content_type='multipart/form-data')
+    assert response.status_code == 202
+    # The upload was spooled into the store's temp dir and moved into place from there
+    assert os.listdir(tmp_path / 'tmp') == []
+    data = response.get_json()
+    assert data['score_status'] == 'pending'
+    inline_upload_worker.submit.assert_called_once()
+
+    response = test_client.get(f"/get_file_score/{data['file_id']}?wait=1")
+    assert response.status_code == 200
+    assert response.get_json() == {'file_id': data['file_id'], 'score': 42, 'score_status': 'ready'}
+
+    # An unchanged ETag is answered with 304
+    etag = response.headers['ETag']
+    response = test_client.get(f"/get_file_score/{data['file_id']}", headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+@patch('app.calculate_file_score', return_value=42)
+@patch('app.client')
+def test_duplicate_upload_reuses_openai_file(mock_client, mock_score, test_client, init_database, inline_upload_worker, tmp_path):
+    mock_client.files.create.return_value = MagicMock(id='file-abc')
+    user = User(user_id='test_user')
+    db.session.add(user)
+    db.session.commit()
+
+    with patch('app.blob_store', LocalBlobStore(str(tmp_path))):
+        for name in ('first.txt', 'second.txt'):
+            response = test_client.post('/upload', data={
+                'file': (io.BytesIO(b'The same tome'), name),
+                'user_id': 'test_user'
+            }, content_type='multipart/form-data')
+            assert response.status_code in (200, 202)
+
+    # The duplicate is answered from the content index without queueing work
+    assert response.status_code == 200
+    assert response.get_json()['openai_file_id'] == 'file-abc'
+    assert response.get_json()['score'] == 42
+    mock_client.files.create.assert_called_once()
+    mock_score.assert_called_once()
+    assert File.query.filter_by(user_id='test_user', score_status='ready').count() == 2
+
+def test_upload_is_refused_when_queue_is_full(test_client, init_database, tmp_path):
+    from workers import QueueFull
+    user = User(user_id='test_user')
+    db.session.add(user)
+    db.session.commit()
+
+    with patch('app.blob_store', LocalBlobStore(str(tmp_path))), \
+            patch('app.upload_executor') as mock_executor, \
+            patch('app.process_file_upload') as mock_process:
+        mock_executor.submit.side_effect = QueueFull('full')
+        response = test_client.post('/upload', data={
+            'file': (io.BytesIO(b'One tome too many'), 'tome.txt'),
+            'user_id': 'test_user'
+        }, content_type='multipart/form-data')
+
+    assert response.status_code == 503
+    mock_process.assert_not_called()
+    assert File.query.count() == 0
+
+def test_requeue_uploads_processes_only_stale_pending_files(test_app, init_database):
+    from datetime import datetime, timedelta
+    user = User(user_id='test_user')
+    db.session.add(user)
+    db.session.commit()
+    old = datetime.utcnow() - timedelta(days=1)
+    files = [
+        File(user_id='test_user', filename='stale.txt', mime_type='text/plain', file_size=1, score_status='pending', upload_date=old),
+        File(user_id='test_user', filename='fresh.txt', mime_type='text/plain', file_size=1, score_status='pending'),
+        File(user_id='test_user', filename='done.txt', mime_type='text/plain', file_size=1, score_status='ready', upload_date=old),
+    ]
+    db.session.add_all(files)
+    db.session.commit()
+
+    with patch('app.process_file_upload') as mock_process:
+        result = test_app.test_cli_runner().invoke(args=['requeue-uploads'])
+    assert 'Reprocessed 1 stale uploads' in result.output
+    mock_process.assert_called_once_with(test_app, files[0].id)
+
+def test_upload_file_too_large(test_client, init_database):
+    with patch('app.UPLOAD_MAX_BYTES', 1024):
+        response = test_client.post('/upload', data={
+            'file': (io.BytesIO(b'x' * 4096), 'big.txt'),
+            'user_id': 'test_user'
+        }, content_type='multipart/form-data')
+        # The cap is the upload route's own; other routes take larger bodies
+        tasks = test_client.post('/api/tasks', json={'description': 'x' * 4096, 'code_blob': 'pass'})
+    assert response.status_code == 413
+    assert 'File too large' in response.get_json()['error']
+    assert tasks.status_code == 201
+
+def test_list_files_paginates_without_loading_content(test_client, init_database):
+    user = User(user_id='test_user')
+    db.session.add(user)
+    db.session.commit()
+    db.session.add_all([
+        File(user_id='test_user', filename=f'tome{i}.txt', content_hash=f'{i:064x}',
+             mime_type='text/plain', file_size=i, score=i)
+        for i in range(5)
+    ])
+    db.session.commit()
+
+    response = test_client.get('/api/files?user_id=test_user&limit=2')
+    page = response.get_json()
+    assert response.status_code == 200
+    assert [f['filename'] for f in page['files']] == ['tome4.txt', 'tome3.txt']
+    assert 'file_content' not in page['files'][0]
+
+    names = [f['filename'] for f in page['files']]
+    while page['next_cursor']:
+        page = test_client.get(f"/api/files?user_id=test_user&limit=2&before={page['next_cursor']}").get_json()
+        names += [f['filename'] for f in page['files']]
+    assert names == [f'tome{i}.txt' for i in range(4, -1, -1)]
+
+def test_list_files_requires_user_id(test_client):
+    response = test_client.get('/api/files')
+    assert response.status_code == 400
+    assert 'User ID is required' in response.get_json()['error']
+
+def test_file_content_is_only_served_to_its_owner(test_client, init_database, tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    content_hash, size = store.put_file(io.BytesIO(b'Secret tome'))
+    db.session.add_all([User(user_id='owner'), User(user_id='someone_else')])
+    db.session.commit()
+    file = File(user_id='owner', filename='tome.txt', content_hash=content_hash, mime_type='text/plain', file_size=size)
+    db.session.add(file)
+    db.session.commit()
+
+    with patch('app.blob_store', store):
+        owned = test_client.get(f'/files/{file.id}/content?user_id=owner')
+        assert owned.status_code == 200
+        assert owned.data == b'Secret tome'
+        owned.close()
+        assert test_client.get(f'/files/{file.id}/content').status_code == 400
+        assert test_client.get(f'/files/{file.id}/content?user_id=someone_else').status_code == 404
+
+def test_file_content_is_deferred(init_database):
+    assert 'file_content' not in str(File.query.statement.compile(db.engine))
+
+def test_user_cache_write_through(init_database):
+    from app import create_user, get_cached_user, update_user_profile, user_cache
+    user_cache.clear()
+    create_user('cached_user', 'Notes')
+    cached = get_cached_user('cached_user')
+    assert user_cache.stats()['hits'] >= 1
+
+    updated = update_user_profile(cached, 'Newer notes', 10)
+    db.session.commit()
+    user_cache.set('cached_user', updated)
+    assert updated.user_score == 10
+    assert updated.version == cached.version + 1
+    assert get_cached_user('cached_user') == updated
+    assert User.query.filter_by(user_id='cached_user').first().user_notes == 'Newer notes'
+
+def test_user_cache_reapplies_stale_update(init_database):
+    from app import create_user, get_cached_user, update_user_profile, user_cache
+    user_cache.clear()
+    create_user('cached_user', 'Notes')
+    cached = get_cached_user('cached_user')
+
+    # Another worker updates the row behind this worker's cache
+    User.query.filter_by(user_id='cached_user').update({'user_score': 50, 'version': cached.version + 1})
+    db.session.commit()
+
+    updated = update_user_profile(cached, 'Notes', 5)
+    db.session.commit()
+    assert updated.user_score == 55
+    assert updated.version == cached.version + 2
+
+def test_user_cache_recreates_deleted_user(init_database):
+    from app import create_user, get_cached_user, update_user_profile, user_cache
+    create_user('cached_user', 'Notes')
+    cached = get_cached_user('cached_user')
+
+    # The row is deleted while this worker still has it cached
+    User.query.filter_by(user_id='cached_user').delete()
+    db.session.commit()
+
+    updated = update_user_profile(cached, 'Fresh notes', 5)
+    db.session.commit()
+    assert 'cached_user' not in user_cache
+    assert updated.user_score == 5
+    assert User.query.filter_by(user_id='cached_user').one().user_notes == 'Fresh notes'
+
+@patch('app.client')
+def test_chat_turn_holds_no_connection_during_assistant_run(mock_client, test_client, init_database):
+    mock_client.beta.threads.create.return_value = MagicMock(id='test_thread_id')
+    user = User(user_id='test_user')
+    db.session.add(user)
+    db.session.commit()
+
+    def assistant_run(thread_id, user):
+        # The session must have handed its connection back before the LLM phase
+        assert not db.session().in_transaction()
+        if hasattr(db.engine.pool, 'checkedout'):
+            assert db.engine.pool.checkedout() == 0
+        return 'Reply', 'Notes', 3
+
+    commits = []
+    listener = lambda session: commits.append(session)
+    event.listen(Session, 'after_commit', listener)
+    try:
+        with patch('app.run_assistant', side_effect=assistant_run):
+            response = test_client.post('/api/chat', json={'message': 'Hello', 'user_id': 'test_user'})
+    finally:
+        event.remove(Session, 'after_commit', listener)
+
+    assert response.status_code == 200
+    assert response.get_json()['updated_score'] == 3
+    # The notes, score and both messages are written in one transaction
+    assert len(commits) == 1
+    assert Message.query.filter_by(conversation_id='test_thread_id').count() == 2
+
+@patch('app.run_assistant', return_value=('Reply', 'Notes', 1))
+@patch('app.client')
+def test_continuing_conversation_skips_thread_retrieve(mock_client, mock_run, test_client, init_database):
+    mock_client.beta.threads.create.return_value = MagicMock(id='thread_known')
+    first = test_client.post('/api/chat', json={'message': 'Hello', 'user_id': 'test_user'})
+    assert first.status_code == 200
+    conversation_id = first.get_json()['conversation_id']
+
+    known_threads.clear()
+    second = test_client.post('/api/chat', json={
+        'message': 'Again', 'user_id': 'test_user', 'conversation_id': conversation_id
+    })
+    assert second.status_code == 200
+    assert second.get_json()['conversation_id'] == conversation_id
+    mock_client.beta.threads.create.assert_called_once()
+    mock_client.beta.threads.retrieve.assert_not_called()
+
+@patch('app.client')
+def test_deleted_thread_returns_not_found(mock_client, test_client, init_database):
+    request = httpx.Request('POST', 'https://api.openai.com/v1/threads/thread_gone/messages')
+    mock_client.beta.threads.retrieve.return_value = MagicMock(id='thread_gone')
+    mock_client.beta.threads.messages.create.side_effect = NotFoundError(
+        'No thread found', response=httpx.Response(404, request=request), body=None
+    )
+    response = test_client.post('/api/chat', json={
+        'message': 'Hello', 'user_id': 'test_user', 'conversation_id': 'thread_gone'
+    })
+    assert response.status_code == 404
+    assert 'thread_gone' not in known_threads
+
+@patch('app.client')
+def test_chat_fails_fast_while_openai_circuit_is_open(mock_client, test_client, init_database):
+    with patch.object(openai_breaker, '_opened_at', time.monotonic()), \
+            patch.object(openai_breaker, '_failures', openai_breaker.failure_threshold):
+        response = test_client.post('/api/chat', json={'message': 'Hello', 'user_id': 'test_user'})
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+    mock_client.beta.threads.create.assert_not_called()
+
+@patch('app.time.sleep')
+@patch('app.client')
+def test_chat_returns_504_once_the_turn_deadline_is_spent(mock_client, mock_sleep, test_client, init_database):
+    request = httpx.Request('POST', 'https://api.openai.com/v1/threads/thread_1/runs')
+    timeout = APITimeoutError(request=request)
+    timeout.__cause__ = DeadlineExceeded('Deadline exceeded before POST /v1/threads/thread_1/runs', request=request)
+    mock_client.beta.threads.create.return_value = MagicMock(id='thread_1')
+    mock_client.beta.threads.runs.create.side_effect = timeout
+    response = test_client.post('/api/chat', json={'message': 'Hello', 'user_id': 'test_user'})
+    assert response.status_code == 504
+    mock_client.beta.threads.runs.create.assert_called_once()
+    mock_sleep.assert_not_called()
+    assert openai_breaker._failures == 0
+
+def test_timed_pool_records_waits_and_timeouts(tmp_path):
+    from sqlalchemy import create_engine
+    from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+    from pool_stats import TimedQueuePool, pool_stats
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=TimedQueuePool,
+                           pool_size=1, max_overflow=0, pool_timeout=0.1)
+    before = pool_stats.snapshot()
+    with engine.connect():
+        assert pool_stats.snapshot(engine.pool)['checked_out'] == 1
+        with pytest.raises(PoolTimeoutError):
+            engine.connect()
+    after = pool_stats.snapshot(engine.pool)
+    assert after['checkouts'] == before['checkouts'] + 1
+    assert after['timeouts'] == before['timeouts'] + 1
+    assert after['wait_seconds_max'] >= 0.1
+    assert after['checked_out'] == 0
+    engine.dispose()
+
+def test_pool_stats_endpoint(test_client):
+    response = test_client.get('/api/pool_stats')
+    assert response.status_code == 200
+    assert {'checkouts', 'timeouts', 'wait_seconds_total', 'pool_class'} <= set(response.get_json())
+
+def test_transport_stats_endpoint(test_client):
+    transport_stats.record('GET api.openai.com/v1/threads/{id}', 0.25)
+    response = test_client.get('/api/transport_stats')
+    assert response.status_code == 200
+    assert response.get_json()['GET api.openai.com/v1/threads/{id}']['requests'] >= 1
+
+@patch('app.run_assistant', return_value=('Reply', 'Notes', 1))
+@patch('app.client')
+def test_metrics_endpoint_reports_chat_phases(mock_client, mock_run, test_client, init_database):
+    mock_client.beta.threads.create.return_value = MagicMock(id='thread_metrics')
+    test_client.post('/api/chat', json={'message': 'Hello', 'user_id': 'test_user'})
+
+    response = test_client.get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    body = response.get_data(as_text=True)
+    for phase in ('read', 'thread', 'add_message', 'persist'):
+        assert f'chat_phase_seconds_count{{phase="{phase}"}}' in body
+    assert 'chat_turn_seconds_count{status="200"}' in body
+    assert 'db_pool_checkouts_total' in body
+    assert 'cache_hits_total{cache="user"}' in body
+
+def test_static_bundle_is_cached_and_compressed(test_app, test_client):
+    # The web build is only indexed and compressed once a static file is requested
+    assert 'asset_index' not in test_app.extensions
+    response = test_client.get('/static/js/main.8c4f9677.js', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert response.headers['Vary'] == 'Accept-Encoding'
+
+    revalidated = test_client.get('/static/js/main.8c4f9677.js', headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']
+    })
+    assert revalidated.status_code == 304
+
+def test_client_routes_fall_back_to_index_html(test_client):
+    response = test_client.get('/some/client/route')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/html'
+    assert response.headers['Cache-Control'] == 'no-cache'
+
 # Add more tests as needed for other functions and edge cases
 
 @pytest.fixture
-def mock_s3_client():
-    with patch('app.s3') as mock_s3:
-        yield mock_s3
+def mock_blob_store():
+    with patch('app.blob_store') as mock_store:
+        yield mock_store
 
-def test_upload_file_success(test_client, init_database, mock_s3_client):
+@patch('app.queue_file_processing')
+def test_upload_file_success(mock_queue, test_client, init_database, mock_blob_store):
     # Create a test user
     user = User(user_id='test_user')
     db.session.add(user)
@@ -201,18 +693,20 @@ def test_upload_file_success(test_client, init_database, mock_s3_client):
         'user_id': 'test_user'
     }
 
-    # Mock S3 upload
-    mock_s3_client.upload_fileobj.return_value = None
+    # Mock blob store write
+    mock_blob_store.put_spooled.return_value = ('a' * 64, len(file_content))
 
     # Test file upload
     response = test_client.post('/upload', data=data, content_type='multipart/form-data')
-    assert response.status_code == 200
+    assert response.status_code == 202
     assert 'File uploaded successfully' in response.get_json()['message']
 
     # Check database entry
-    uploaded_file = UserFiles.query.filter_by(user_id='test_user', filename='test_file.txt').first()
+    uploaded_file = File.query.filter_by(user_id='test_user', filename='test_file.txt').first()
     assert uploaded_file is not None
-    assert uploaded_file.s3_key == 'user_files/test_user/test_file.txt'
+    assert uploaded_file.content_hash == 'a' * 64
+    assert uploaded_file.score_status == 'pending'
+    mock_queue.assert_called_once_with(uploaded_file.id)
 
 def test_upload_file_no_file(test_client):
     response = test_client.post('/upload', data={}, content_type='multipart/form-data')
@@ -227,7 +721,7 @@ def test_upload_file_no_user_id(test_client):
     assert response.status_code == 400
     assert 'User ID is required' in response.get_json()['error']
 
-def test_upload_file_s3_error(test_client, init_database, mock_s3_client):
+def test_upload_file_blob_store_error(test_client, init_database, mock_blob_store):
     # Create a test user
     user = User(user_id='test_user')
     db.session.add(user)
@@ -241,14 +735,117 @@ def test_upload_file_s3_error(test_client, init_database, mock_s3_client):
         'user_id': 'test_user'
     }
 
-    # Mock S3 upload error
-    mock_s3_client.upload_fileobj.side_effect = Exception('S3 upload failed')
+    # Mock blob store write error
+    mock_blob_store.put_spooled.side_effect = Exception('Blob store write failed')
 
-    # Test file upload with S3 error
+    # Test file upload with blob store error
     response = test_client.post('/upload', data=data, content_type='multipart/form-data')
     assert response.status_code == 500
-    assert 'S3 upload failed' in response.get_json()['error']
+    assert 'Blob store write failed' in response.get_json()['error']
 
     # Check that no database entry was created
-    uploaded_file = UserFiles.query.filter_by(user_id='test_user', filename='test_file.txt').first()
+    uploaded_file = File.query.filter_by(user_id='test_user', filename='test_file.txt').first()
     assert uploaded_file is None
+
+def test_startup_is_fast_and_side_effect_free():
+    from bench_startup import DEFAULT_BUDGET_SECONDS, measure_startup
+    result = measure_startup()
+    assert not result['client_built']
+    assert not result['blob_store_built']
+    assert not result['database_created']
+    assert result['import_seconds'] + result['create_app_seconds'] < DEFAULT_BUDGET_SECONDS
+
+def test_getwork_leases_queued_tasks_once(test_client, init_database):
+    response = test_client.post('/api/tasks', json={'tasks': [
+        {'description': f'Task {i}', 'code_blob': 'pass'} for i in range(3)
+    ]})
+    assert response.status_code == 201
+    task_ids = response.get_json()['task_ids']
+
+    first = test_client.get('/getwork?batch=2').get_json()['tasks']
+    assert [task['task_id'] for task in first] == task_ids[:2]
+    second = test_client.get('/getwork?batch=5').get_json()['tasks']
+    assert [task['task_id'] for task in second] == task_ids[2:]
+
+    with patch('app.TASK_GENERATE_WHEN_EMPTY', False):
+        assert test_client.get('/getwork?batch=5').get_json() == {'tasks': []}
+        assert test_client.get('/getwork').status_code == 204
+
+    status = test_client.get(f'/api/tasks/{task_ids[0]}').get_json()
+    assert status['status'] == 'leased' and status['attempts'] == 1
+
+def test_getwork_generates_placeholder_when_queue_is_empty(test_client, init_database):
+    response = test_client.get('/getwork')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert {'task_id', 'description', 'code_blob', 'lease_expires_at'} <= set(data)
+    assert test_client.get(f"/api/tasks/{data['task_id']}").get_json()['status'] == 'leased'
+
+def test_expired_lease_is_handed_out_again_until_attempts_run_out(init_database):
+    from app import Task, enqueue_tasks, fail_expired_tasks, lease_tasks
+    [task_id] = enqueue_tasks([{'description': 'Flaky', 'code_blob': 'pass'}])
+
+    with patch('app.TASK_MAX_ATTEMPTS', 2):
+        assert [t.task_id for t in lease_tasks(1, visibility_timeout=-1)] == [task_id]
+        assert [t.task_id for t in lease_tasks(1, visibility_timeout=-1)] == [task_id]
+        assert lease_tasks(1) == []
+        assert fail_expired_tasks() == 1
+    assert Task.query.filter_by(task_id=task_id).one().status == 'failed'
+
+def test_create_tasks_rejects_invalid_and_duplicate_tasks(test_client, init_database):
+    assert test_client.post('/api/tasks', json={'description': 'No code'}).status_code == 400
+    task = {'task_id': 'fixed-id', 'description': 'Once', 'code_blob': 'pass'}
+    assert test_client.post('/api/tasks', json=task).status_code == 201
+    assert test_client.post('/api/tasks', json=task).status_code == 409
+
+def test_submit_stores_result_once_and_completes_task(test_client, init_database):
+    from app import Task, TaskResult, enqueue_tasks
+    [task_id] = enqueue_tasks([{'description': 'Work', 'code_blob': 'pass'}])
+
+    response = test_client.post('/submit', json={'task_id': task_id, 'result': {'answer': 42}})
+    assert response.status_code == 200
+    assert response.get_json()['message'] == 'Work submitted successfully'
+    retried = test_client.post('/submit', json={'task_id': task_id, 'result': {'answer': 43}})
+    assert retried.status_code == 200
+    assert retried.get_json()['message'] == 'Work was already submitted'
+
+    assert json.loads(TaskResult.query.filter_by(task_id=task_id).one().result) == {'answer': 42}
+    assert Task.query.filter_by(task_id=task_id).one().status == 'completed'
+    assert test_client.post('/submit', json={'task_id': task_id}).status_code == 400
+
+def test_submit_refuses_unknown_task(test_client, init_database):
+    from app import TaskResult
+    response = test_client.post('/submit', json={'task_id': 'never-issued', 'result': 'made up'})
+    assert response.status_code == 404
+    assert response.get_json()['task_id'] == 'never-issued'
+    assert TaskResult.query.filter_by(task_id='never-issued').count() == 0
+
+def test_bulk_submit_reports_status_per_result(test_client, init_database):
+    from app import TaskResult, enqueue_tasks
+    enqueue_tasks([{'task_id': task_id, 'description': 'Work', 'code_blob': 'pass'} for task_id in ('a', 'done-before')])
+    assert test_client.post('/submit', json={'task_id': 'done-before', 'result': 'old'}).status_code == 200
+
+    response = test_client.post('/submit/bulk', json=[
+        {'task_id': 'a', 'result': 1},
+        {'task_id': 'done-before', 'result': 'new'},
+        {'task_id': 'a', 'result': 2},
+        {'result': 'no id'},
+        {'task_id': 'never-issued', 'result': 3},
+    ])
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [entry['status'] for entry in data['results']] == ['stored', 'duplicate', 'duplicate', 'invalid', 'unknown']
+    assert (data['stored'], data['duplicate'], data['unknown'], data['invalid']) == (1, 2, 1, 1)
+    assert data['unknown_task_ids'] == ['never-issued']
+    assert json.loads(TaskResult.query.filter_by(task_id='a').one().result) == 1
+    assert TaskResult.query.filter_by(task_id='never-issued').count() == 0
+
+def test_bulk_submit_accepts_ndjson(test_client, init_database):
+    from app import enqueue_tasks
+    enqueue_tasks([{'task_id': f'task-{i}', 'description': 'Work', 'code_blob': 'pass'} for i in range(500)])
+    body = '\n'.join(json.dumps({'task_id': f'task-{i}', 'result': i}) for i in range(500)) + '\nnot json\n'
+    response = test_client.post('/submit/bulk', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['stored'] == 500 and data['invalid'] == 1
+    assert data['results'][-1]['error'] == 'Line 501 is not valid JSON'
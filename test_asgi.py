@@ -0,0 +1,97 @@
+import json
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from starlette.testclient import TestClient
+
+from app import db, Conversation, known_threads, user_cache, openai_breaker
+from asgi import create_asgi_app
+
+REPLY = '{"reply": "Hello mortal", "updated_notes": "Curious", "score_change": 5}'
+
+@pytest.fixture
+def asgi_app():
+    user_cache.clear()
+    known_threads.clear()
+    asgi_app = create_asgi_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:'})
+    with asgi_app.state.flask_app.app_context():
+        db.create_all()
+    yield asgi_app
+    with asgi_app.state.flask_app.app_context():
+        db.drop_all()
+    user_cache.clear()
+    known_threads.clear()
+
+@pytest.fixture
+def test_client(asgi_app):
+    return TestClient(asgi_app)
+
+@pytest.fixture
+def mock_async_client():
+    mock_client = MagicMock()
+    mock_client.beta.threads.create = AsyncMock(return_value=MagicMock(id='thread_async1'))
+    mock_client.beta.threads.messages.create = AsyncMock()
+    mock_client.beta.threads.runs.create = AsyncMock(return_value=MagicMock(id='run_1', status='completed', usage=None))
+    page = MagicMock(data=[MagicMock(role='assistant', content=[MagicMock(text=MagicMock(value=REPLY))])])
+    mock_client.beta.threads.messages.list = AsyncMock(return_value=page)
+    with patch('asgi.async_client', mock_client):
+        yield mock_client
+
+def test_async_chat_runs_turn_and_saves_it(asgi_app, test_client, mock_async_client):
+    response = test_client.post('/api/chat', json={'message': 'Hello, AI!', 'user_id': 'test_user'})
+    assert response.status_code == 200
+    data = response.json()
+    assert data['message'] == 'Hello mortal'
+    assert data['conversation_id'] == 'thread_async1'
+    assert data['score_change'] == 5
+    mock_async_client.beta.threads.runs.retrieve.assert_not_called()
+    with asgi_app.state.flask_app.app_context():
+        assert Conversation.query.filter_by(conversation_id='thread_async1').count() == 1
+
+def test_async_chat_stream_sends_tokens_then_done(test_client, mock_async_client):
+    async def events():
+        yield MagicMock(event='thread.run.created', data=MagicMock(id='run_1'))
+        block = MagicMock(type='text', text=MagicMock(value=REPLY))
+        yield MagicMock(event='thread.message.delta', data=MagicMock(delta=MagicMock(content=[block])))
+        yield MagicMock(event='thread.message.completed', data=MagicMock(role='assistant', content=[MagicMock(text=MagicMock(value=REPLY))]))
+        yield MagicMock(event='thread.run.completed', data=MagicMock(usage=None))
+    mock_async_client.beta.threads.runs.create = AsyncMock(return_value=events())
+
+    response = test_client.post('/api/chat/stream', json={'message': 'Hello, AI!', 'user_id': 'test_user'})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/event-stream')
+    tokens = [json.loads(line.split('data: ', 1)[1].split('\n')[0])['text']
+              for line in response.text.split('event: token\n')[1:]]
+    assert ''.join(tokens) == 'Hello mortal'
+    done = json.loads(response.text.split('event: done\ndata: ')[1].split('\n')[0])
+    assert done['message'] == 'Hello mortal'
+    assert done['conversation_id'] == 'thread_async1'
+
+def test_async_chat_stream_ends_with_error_when_run_is_incomplete(test_client, mock_async_client):
+    async def events():
+        yield MagicMock(event='thread.run.created', data=MagicMock(id='run_1'))
+        yield MagicMock(event='thread.run.incomplete', data=MagicMock(id='run_1', last_error=None))
+    mock_async_client.beta.threads.runs.create = AsyncMock(return_value=events())
+
+    response = test_client.post('/api/chat/stream', json={'message': 'Hello, AI!', 'user_id': 'test_user'})
+    assert 'event: error' in response.text
+    assert 'event: done' not in response.text
+
+def test_async_chat_rejects_invalid_body(test_client):
+    response = test_client.post('/api/chat', content='not json', headers={'Content-Type': 'application/json'})
+    assert response.status_code == 400
+    assert 'Invalid request format' in response.json()['message']
+
+def test_async_chat_fails_fast_while_openai_circuit_is_open(test_client, mock_async_client):
+    with patch.object(openai_breaker, '_opened_at', time.monotonic()), \
+            patch.object(openai_breaker, '_failures', openai_breaker.failure_threshold):
+        response = test_client.post('/api/chat', json={'message': 'Hello', 'user_id': 'test_user'})
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) >= 1
+    mock_async_client.beta.threads.create.assert_not_called()
+
+def test_other_routes_are_served_by_flask(test_client):
+    response = test_client.get('/api/pool_stats')
+    assert response.status_code == 200
+    assert 'checkouts' in response.json()
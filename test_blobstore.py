@@ -0,0 +1,69 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+from blobstore import BlobStore, BlobTooLarge, LocalBlobStore, get_blob_store
+
+def test_put_file_is_content_addressed(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    data = b'ph\'nglui mglw\'nafh' * 1000
+    digest, size = store.put_file(io.BytesIO(data))
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert size == len(data)
+    with store.open(digest) as f:
+        assert f.read() == data
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    first, _ = store.put_file(io.BytesIO(b'same bytes'))
+    second, _ = store.put_bytes(b'same bytes')
+    assert first == second
+    blobs = [name for _, _, files in os.walk(tmp_path) for name in files]
+    assert blobs == [first]
+
+def test_rejects_invalid_digest(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    with pytest.raises(ValueError):
+        store.path('../../etc/passwd')
+
+def test_unknown_backend(tmp_path):
+    with pytest.raises(ValueError):
+        get_blob_store('s3', str(tmp_path))
+
+def test_put_file_enforces_max_size(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    with pytest.raises(BlobTooLarge):
+        store.put_file(io.BytesIO(b'x' * 100), max_size=10)
+    # The partial spool file is removed
+    assert os.listdir(store.tmp_dir) == []
+
+def test_blob_store_backends_must_implement_every_operation():
+    class PartialStore(BlobStore):
+        def put_bytes(self, data):
+            return hashlib.sha256(data).hexdigest(), len(data)
+
+    with pytest.raises(TypeError):
+        PartialStore()
+
+def test_spooled_upload_is_moved_into_place(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    data = b'Unaussprechlichen Kulten' * 1000
+    spooled = store.spool()
+    for start in range(0, len(data), 4096):
+        spooled.write(data[start:start + 4096])
+    spooled.seek(0)
+    assert spooled.read(5) == data[:5]
+    assert store.put_spooled(spooled) == (hashlib.sha256(data).hexdigest(), len(data))
+    spooled.close()
+    with store.open(hashlib.sha256(data).hexdigest()) as f:
+        assert f.read() == data
+    assert os.listdir(store.tmp_dir) == []
+
+def test_abandoned_spool_is_removed_on_close(tmp_path):
+    store = LocalBlobStore(str(tmp_path))
+    spooled = store.spool()
+    spooled.write(b'never stored')
+    spooled.close()
+    assert os.listdir(store.tmp_dir) == []
@@ -0,0 +1,172 @@
+import asyncio
+from collections import namedtuple
+from types import SimpleNamespace
+
+import chat_flow
+from chat_flow import ChatSteps, RunEvents, async_run_flow, async_stream_flow, chat_job_outcome, run_flow, stream_flow
+
+Queued = namedtuple('Queued', ['job_id', 'user_id', 'message'])
+
+
+class FakeConversation:
+    """
+    One conversation's lease and message queue, with every step recorded in calls.
+    """
+
+    def __init__(self, queued=(), lease_free=True):
+        self.queue = list(queued)
+        self.lease_free = lease_free
+        self.calls = []
+        self.jobs = {}
+
+    def steps(self, wrap=lambda fn: fn, tokens=('Hel', 'lo')):
+        def record(name, result=None):
+            def step(*args):
+                self.calls.append((name,) + args)
+                return result(*args) if callable(result) else result
+            return wrap(step)
+
+        def stream_turn(user_id, conversation_id, message):
+            self.calls.append(('stream_turn', message))
+            return iter([('token', t) for t in tokens] + [('result', ({'message': ''.join(tokens)}, 200))])
+
+        return ChatSteps(
+            queue_message=record('queue_message', 'job_new'),
+            acquire_lease=record('acquire_lease', lambda cid: 'holder' if self.lease_free else None),
+            renew_lease=record('renew_lease', True),
+            release_lease=record('release_lease'),
+            is_leased=record('is_leased', False),
+            claim_queued=record('claim_queued', self.claim),
+            has_queued=record('has_queued', lambda cid: bool(self.queue)),
+            get_job=record('get_job', lambda job_id: self.jobs.get(job_id)),
+            record_results=record('record_results'),
+            process_turn=record('process_turn', ({'message': 'Reply'}, 200)),
+            stream_turn=stream_turn,
+            next_event=wrap(lambda events: next(events, None)),
+            close_stream=wrap(lambda events: None),
+            wait_for_job=record('wait_for_job', ({'message': 'Answered by another turn'}, 200)),
+            schedule_drain=record('schedule_drain')
+        )
+
+    def claim(self, conversation_id):
+        queued, self.queue = self.queue[:2], self.queue[2:]
+        return queued
+
+    def names(self):
+        return [call[0] for call in self.calls]
+
+
+def awaitable(fn):
+    async def step(*args):
+        await asyncio.sleep(0)
+        return fn(*args)
+    return step
+
+
+def test_drain_runs_queued_messages_in_batches_then_releases_the_lease():
+    conversation = FakeConversation([Queued(f'job{i}', 'user', f'm{i}') for i in range(3)])
+    run_flow(chat_flow.drain_conversation(conversation.steps(), 'thread_1'))
+    turns = [call for call in conversation.calls if call[0] == 'process_turn']
+    assert [turn[3] for turn in turns] == ['m0\n\nm1', 'm2']
+    assert ('record_results', ['job0', 'job1'], {'message': 'Reply'}, 200) in conversation.calls
+    assert conversation.names()[-2:] == ['release_lease', 'has_queued']
+
+
+def test_async_drain_takes_the_same_steps():
+    queued = [Queued(f'job{i}', 'user', f'm{i}') for i in range(3)]
+    sync, aio = FakeConversation(queued), FakeConversation(queued)
+    run_flow(chat_flow.drain_conversation(sync.steps(), 'thread_1'))
+    asyncio.run(async_run_flow(chat_flow.drain_conversation(aio.steps(awaitable), 'thread_1')))
+    assert aio.calls == sync.calls
+
+
+def test_drain_records_a_failed_turn_and_still_releases_the_lease():
+    conversation = FakeConversation([Queued('job0', 'user', 'm0')])
+    steps = conversation.steps(awaitable)
+
+    async def failing_turn(*args):
+        raise RuntimeError('boom')
+    steps = steps._replace(process_turn=failing_turn)
+    asyncio.run(async_run_flow(chat_flow.drain_conversation(steps, 'thread_1')))
+    assert ('record_results', ['job0'], {'message': 'An error occurred: boom'}, 500) in conversation.calls
+    assert 'release_lease' in conversation.names()
+
+
+def test_drain_returns_at_once_while_another_turn_holds_the_lease():
+    conversation = FakeConversation([Queued('job0', 'user', 'm0')], lease_free=False)
+    run_flow(chat_flow.drain_conversation(conversation.steps(), 'thread_1'))
+    assert conversation.names() == ['acquire_lease']
+
+
+def test_serialized_stream_relays_tokens_and_records_the_result():
+    conversation = FakeConversation([Queued('job_new', 'user', 'Hello')])
+    events = list(stream_flow(chat_flow.stream_serialized_turn(conversation.steps(), 'user', 'thread_1', 'Hello')))
+    assert events == [('token', 'Hel'), ('token', 'lo'), ('result', ({'message': 'Hello'}, 200))]
+    assert ('record_results', ['job_new'], {'message': 'Hello'}, 200) in conversation.calls
+    assert 'release_lease' in conversation.names()
+
+
+def test_serialized_stream_renews_the_lease_between_events(monkeypatch):
+    monkeypatch.setattr(chat_flow, 'LEASE_RENEW_INTERVAL', 0)
+    conversation = FakeConversation([Queued('job_new', 'user', 'Hello')])
+    list(stream_flow(chat_flow.stream_serialized_turn(conversation.steps(), 'user', 'thread_1', 'Hello')))
+    assert conversation.names().count('renew_lease') == 4  # Before each of the 4 reads, the last finding the end
+    assert ('renew_lease', 'thread_1', 'holder') in conversation.calls
+
+
+def test_serialized_stream_cleans_up_when_the_client_disconnects():
+    conversation = FakeConversation([Queued('job_new', 'user', 'Hello')])
+    events = stream_flow(chat_flow.stream_serialized_turn(conversation.steps(), 'user', 'thread_1', 'Hello'))
+    assert next(events) == ('token', 'Hel')
+    events.close()
+    assert ('record_results', ['job_new'], {'message': 'The turn was interrupted before it finished.'}, 500) in conversation.calls
+    assert conversation.names()[-1] == 'release_lease'
+
+
+def test_async_serialized_stream_cleans_up_when_the_client_disconnects():
+    conversation = FakeConversation([Queued('job_new', 'user', 'Hello')])
+
+    async def consume():
+        events = async_stream_flow(chat_flow.stream_serialized_turn(conversation.steps(awaitable), 'user', 'thread_1', 'Hello'))
+        assert await events.__anext__() == ('token', 'Hel')
+        await events.aclose()
+    asyncio.run(consume())
+    assert ('record_results', ['job_new'], {'message': 'The turn was interrupted before it finished.'}, 500) in conversation.calls
+    assert conversation.names()[-1] == 'release_lease'
+
+
+def test_serialized_stream_waits_for_the_turn_holding_the_lease():
+    conversation = FakeConversation(lease_free=False)
+    events = list(stream_flow(chat_flow.stream_serialized_turn(conversation.steps(), 'user', 'thread_1', 'Hello')))
+    assert events == [('result', ({'message': 'Answered by another turn'}, 200))]
+
+
+def test_fetching_a_deleted_job_reports_not_found():
+    conversation = FakeConversation()
+    job = run_flow(chat_flow.fetch_chat_job(conversation.steps(), 'gone', 'thread_1'))
+    assert job is None
+    assert chat_job_outcome(job) == ({'message': 'Job not found'}, 404)
+    assert conversation.names() == ['get_job']
+
+
+def event(name, **data):
+    return SimpleNamespace(event=name, data=SimpleNamespace(**data))
+
+
+def delta(text):
+    block = SimpleNamespace(type='text', text=SimpleNamespace(value=text))
+    return event('thread.message.delta', delta=SimpleNamespace(content=[block]))
+
+
+def test_run_events_stream_reply_text_and_keep_the_run_id():
+    run = RunEvents()
+    texts = [run.feed(e) for e in (event('thread.run.created', id='run_1'), delta('{"reply": "Hi'), delta(' there"}'))]
+    assert ''.join(texts) == 'Hi there'
+    assert run.run_id == 'run_1' and run.failure is None
+
+
+def test_run_events_flag_a_run_waiting_on_tool_output_for_cancelling():
+    run = RunEvents()
+    run.feed(event('thread.run.requires_action', id='run_1', last_error=None, incomplete_details=None))
+    assert run.cancel_run_id == 'run_1'
+    assert str(run.failure).startswith('Run requires_action')
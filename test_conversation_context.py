@@ -0,0 +1,47 @@
+from conversation_context import (
+    advance_window, build_context, dump_recent, estimate_tokens, extractive_summary, load_recent
+)
+
+def turn(i):
+    return [{'role': 'User', 'content': f'question {i}'}, {'role': 'AI', 'content': f'answer {i}'}]
+
+def test_window_grows_until_full():
+    calls = []
+    summary, recent = None, []
+    for i in range(3):
+        summary, recent = advance_window(summary, recent, turn(i), 6, lambda s, m: calls.append(m) or 'summary')
+    assert summary is None
+    assert len(recent) == 6
+    assert calls == []
+
+def test_overflow_is_folded_into_summary_in_batches():
+    calls = []
+
+    def summarize(summary, messages):
+        calls.append(len(messages))
+        return f"{summary or ''}|{len(messages)}"
+
+    summary, recent = None, []
+    for i in range(10):
+        summary, recent = advance_window(summary, recent, turn(i), 6, summarize)
+        assert len(recent) <= 6
+
+    # Each fold drops the window to half, so the summarizer runs every couple of turns, not every turn
+    assert len(calls) < 10
+    assert recent[-1] == {'role': 'AI', 'content': 'answer 9'}
+    assert sum(calls) + len(recent) == 20
+
+def test_build_context_respects_budget():
+    summary = 'x' * 1000
+    context = build_context(summary, 50)
+    assert estimate_tokens(context) <= 50
+    assert build_context(None, 50) == ''
+
+def test_extractive_summary_keeps_newest_text():
+    summary = extractive_summary('old ' * 100, turn(1), 10)
+    assert summary.endswith('AI: answer 1')
+    assert estimate_tokens(summary) <= 10
+
+def test_recent_round_trip():
+    assert load_recent(None) == []
+    assert load_recent(dump_recent(turn(1))) == turn(1)
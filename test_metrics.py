@@ -0,0 +1,50 @@
+import pytest
+
+from metrics import Registry
+
+
+def test_counter_renders_per_label_series():
+    registry = Registry()
+    retries = registry.counter('retries_total', 'Retried calls', ['call'])
+    retries.inc(call='create')
+    retries.inc(2, call='create')
+    retries.inc(call='retrieve')
+    text = registry.render()
+    assert '# TYPE retries_total counter' in text
+    assert 'retries_total{call="create"} 3' in text
+    assert 'retries_total{call="retrieve"} 1' in text
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram('phase_seconds', 'Phase time', ['phase'], buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        latency.observe(value, phase='read')
+    text = registry.render()
+    assert 'phase_seconds_bucket{phase="read",le="0.1"} 1' in text
+    assert 'phase_seconds_bucket{phase="read",le="1"} 2' in text
+    assert 'phase_seconds_bucket{phase="read",le="+Inf"} 3' in text
+    assert 'phase_seconds_sum{phase="read"} 5.55' in text
+    assert 'phase_seconds_count{phase="read"} 3' in text
+
+
+def test_histogram_time_records_failures_too():
+    latency = Registry().histogram('call_seconds', 'Call time')
+    with pytest.raises(RuntimeError):
+        with latency.time():
+            raise RuntimeError('boom')
+    assert latency.count() == 1
+
+
+def test_labels_must_match():
+    counter = Registry().counter('calls_total', 'Calls', ['call'])
+    with pytest.raises(ValueError):
+        counter.inc(kind='x')
+
+
+def test_collectors_are_rendered_and_escaped():
+    registry = Registry()
+    registry.add_collector(lambda: [('pool_checked_out', 'gauge', 'In use', [({'pool': 'a"b'}, 2)])])
+    text = registry.render()
+    assert '# TYPE pool_checked_out gauge' in text
+    assert 'pool_checked_out{pool="a\\"b"} 2' in text
@@ -0,0 +1,29 @@
+import json
+
+from reply_stream import ReplyStream
+
+ENVELOPE = json.dumps({'updated_notes': 'Said "hi"', 'reply': 'Line one\nQuoth "the raven" é \U0001f600', 'score_change': 5})
+
+def stream(chunks):
+    parser = ReplyStream()
+    return [parser.feed(chunk) for chunk in chunks]
+
+def test_only_the_reply_text_is_returned():
+    assert ''.join(stream([ENVELOPE])) == json.loads(ENVELOPE)['reply']
+
+def test_reply_is_decoded_across_any_chunk_boundary():
+    expected = json.loads(ENVELOPE)['reply']
+    for size in range(1, 8):
+        chunks = [ENVELOPE[i:i + size] for i in range(0, len(ENVELOPE), size)]
+        assert ''.join(stream(chunks)) == expected
+
+def test_text_arrives_as_it_is_streamed():
+    parts = stream(['{"reply": "Hel', 'lo', ' mortal", "score_change": 5}'])
+    assert parts == ['Hel', 'lo', ' mortal']
+
+def test_nested_values_and_other_fields_are_skipped():
+    envelope = '{"meta": {"reply": "not this"}, "notes": ["reply"], "reply": "this"}'
+    assert ''.join(stream([envelope])) == 'this'
+
+def test_non_json_reply_streams_nothing():
+    assert ''.join(stream(['Plain text, "reply": "no"'])) == ''
@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+
+from resilience import CircuitBreaker, CircuitOpen, RetryPolicy, async_call_with_retry, call_with_retry, is_transient
+from resilience import retry_after_seconds
+from transport import DeadlineExceeded, deadline
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = FakeResponse(status_code, headers)
+
+
+def flaky(failures, error):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise error
+        return 'ok'
+    return fn, calls
+
+
+def test_retries_transient_errors_with_growing_backoff():
+    fn, calls = flaky(2, FakeAPIError(503))
+    sleeps = []
+    policy = RetryPolicy(max_attempts=4, base_delay=1, max_delay=30)
+    result = call_with_retry(fn, policy, CircuitBreaker('test', 10, 30), sleep=sleeps.append)
+    assert result == 'ok'
+    assert len(calls) == 3
+    assert 0 <= sleeps[0] <= 1 and 0 <= sleeps[1] <= 2
+
+
+def test_async_retries_without_blocking_and_opens_breaker():
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        raise FakeAPIError(503)
+
+    sleeps = []
+
+    async def sleep(delay):
+        sleeps.append(delay)
+
+    breaker = CircuitBreaker('test', 3, 30)
+    with pytest.raises(FakeAPIError):
+        asyncio.run(async_call_with_retry(fn, RetryPolicy(3, 0, 0), breaker, sleep=sleep))
+    assert len(calls) == 3 and len(sleeps) == 2
+    assert breaker.state == 'open'
+
+
+def test_does_not_retry_client_errors():
+    fn, calls = flaky(1, FakeAPIError(404))
+    with pytest.raises(FakeAPIError):
+        call_with_retry(fn, RetryPolicy(4, 0, 0), CircuitBreaker('test', 10, 30), sleep=lambda s: None)
+    assert len(calls) == 1
+
+
+def test_honors_retry_after():
+    error = FakeAPIError(429, {'retry-after': '7'})
+    assert retry_after_seconds(error) == 7
+    assert retry_after_seconds(FakeAPIError(429, {'retry-after-ms': '250'})) == 0.25
+    fn, _ = flaky(1, error)
+    sleeps = []
+    call_with_retry(fn, RetryPolicy(3, 0.1, 1), CircuitBreaker('test', 10, 30), sleep=sleeps.append)
+    assert sleeps == [7]
+
+
+def test_gives_up_when_backoff_would_pass_the_deadline():
+    fn, calls = flaky(5, FakeAPIError(429, {'retry-after': '60'}))
+    with deadline(5):
+        with pytest.raises(FakeAPIError):
+            call_with_retry(fn, RetryPolicy(5, 0.1, 1), CircuitBreaker('test', 10, 30), sleep=lambda s: None)
+    assert len(calls) == 1
+
+
+def test_breaker_opens_fails_fast_and_recovers(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('resilience.time.monotonic', lambda: now[0])
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=30)
+    fn, calls = flaky(2, FakeAPIError(500))
+    with pytest.raises(FakeAPIError):
+        call_with_retry(fn, RetryPolicy(2, 0, 0), breaker, sleep=lambda s: None)
+    assert breaker.state == 'open'
+
+    with pytest.raises(CircuitOpen) as excinfo:
+        call_with_retry(fn, RetryPolicy(2, 0, 0), breaker, sleep=lambda s: None)
+    assert excinfo.value.retry_after == 30
+    assert len(calls) == 2
+
+    now[0] += 30
+    assert breaker.state == 'half_open'
+    assert call_with_retry(fn, RetryPolicy(2, 0, 0), breaker, sleep=lambda s: None) == 'ok'
+    assert breaker.state == 'closed'
+
+
+def test_failed_trial_reopens_breaker(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('resilience.time.monotonic', lambda: now[0])
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    now[0] += 10
+    breaker.before_call()
+    # Only one trial call is let through while half-open
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+
+def test_busy_errors_are_retried_without_opening_the_breaker():
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=30)
+    fn, calls = flaky(3, FakeAPIError(400))
+    result = call_with_retry(fn, RetryPolicy(4, 0, 0), breaker, retry_busy=lambda e: e.status_code == 400, sleep=lambda s: None)
+    assert result == 'ok' and len(calls) == 4
+    assert breaker.state == 'closed' and breaker._failures == 0
+
+
+def test_expired_deadline_is_raised_at_once_and_not_counted():
+    class APITimeoutError(Exception):
+        pass
+    timeout = APITimeoutError('Request timed out.')
+    timeout.__cause__ = DeadlineExceeded('Deadline exceeded before POST /v1/threads')
+    assert not is_transient(timeout)
+
+    breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=30)
+    fn, calls = flaky(1, timeout)
+    with pytest.raises(APITimeoutError):
+        call_with_retry(fn, RetryPolicy(3, 0, 0), breaker, sleep=lambda s: None)
+    assert len(calls) == 1
+    assert breaker.state == 'closed'
@@ -0,0 +1,40 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+from scoring import iter_text_chunks, reduce_scores, sample_indices, score_document
+
+def test_chunks_cover_the_document_without_splitting_words():
+    text = ' '.join(f'word{i}' for i in range(2000))
+    chunks = list(iter_text_chunks(io.BytesIO(text.encode()), 50))
+    assert ''.join(chunks) == text
+    assert all(len(chunk) <= 200 for chunk in chunks)
+    assert all(chunk.endswith(tuple('0123456789')) for chunk in chunks[:-1])
+
+def test_sample_indices_are_evenly_spaced():
+    assert sample_indices(10, 3) == {0, 4, 9}
+    assert sample_indices(3, 5) == {0, 1, 2}
+
+def test_reduce_scores_weights_by_length_and_skips_failures():
+    assert reduce_scores([(100, 300), (0, 100), (None, 1000)]) == 75
+    assert reduce_scores([(None, 10)]) is None
+
+def test_score_document_scores_chunks_concurrently():
+    text = ('a' * 199 + '\n') * 10
+    seen = []
+
+    def score_chunk(chunk):
+        seen.append(len(chunk))
+        return 40
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        score = score_document(io.BytesIO(text.encode()), score_chunk, executor, 50, max_in_flight=2)
+    assert score == 40
+    assert sum(seen) == len(text)
+
+def test_score_document_sampling():
+    text = 'b' * 200 * 20
+    calls = []
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        score_document(io.BytesIO(text.encode()), lambda chunk: calls.append(chunk) or 10,
+                       executor, 50, max_in_flight=4, size=len(text), sample=4)
+    assert len(calls) == 4
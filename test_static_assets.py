@@ -0,0 +1,54 @@
+import gzip
+import json
+import os
+
+from static_assets import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, AssetIndex
+
+
+def build_web_root(tmp_path):
+    js = tmp_path / 'static' / 'js'
+    js.mkdir(parents=True)
+    (js / 'main.1234abcd.js').write_text('console.log("hello");\n' * 200)
+    (js / 'main.1234abcd.js.map').write_text(json.dumps({'version': 3, 'mappings': 'AAAA;' * 500}))
+    (tmp_path / 'index.html').write_text('<html><body><div id="root"></div></body></html>')
+    (tmp_path / 'favicon.ico').write_bytes(b'\x00' * 2048)
+    (tmp_path / 'asset-manifest.json').write_text(json.dumps({
+        'files': {'main.js': '/static/js/main.1234abcd.js', 'index.html': '/index.html'}
+    }))
+    return tmp_path
+
+
+def test_hashed_assets_are_immutable_and_precompressed(tmp_path):
+    index = AssetIndex(str(build_web_root(tmp_path)))
+    bundle = index.get('static/js/main.1234abcd.js')
+    assert bundle.cache_control == IMMUTABLE_CACHE_CONTROL
+    assert gzip.decompress(bundle.bodies['gzip']) == bundle.bodies['identity']
+    assert len(bundle.bodies['gzip']) < len(bundle.bodies['identity'])
+    assert bundle.choose_encoding({'gzip': 1, 'br': 0}) == 'gzip'
+    assert bundle.choose_encoding({}) == 'identity'
+    assert bundle.etag('gzip') != bundle.etag('identity')
+
+
+def test_unhashed_files_are_revalidated_and_binary_and_source_maps_are_not_compressed(tmp_path):
+    index = AssetIndex(str(build_web_root(tmp_path)))
+    assert index.get('index.html').cache_control == REVALIDATE_CACHE_CONTROL
+    favicon = index.get('favicon.ico')
+    assert set(favicon.bodies) == {'identity'}
+    assert set(index.get('static/js/main.1234abcd.js.map').bodies) == {'identity'}
+    assert index.get('missing.js') is None
+
+
+def test_precompressed_files_are_written_and_reused(tmp_path):
+    root = build_web_root(tmp_path)
+    index = AssetIndex(str(root))
+    assert index.write_precompressed() >= 1
+    bundle_path = root / 'static' / 'js' / 'main.1234abcd.js.gz'
+    assert bundle_path.exists()
+
+    reloaded = AssetIndex(str(root))
+    assert 'static/js/main.1234abcd.js.gz' not in reloaded.assets
+    assert reloaded.get('static/js/main.1234abcd.js').bodies['gzip'] == bundle_path.read_bytes()
+
+
+def test_missing_build_directory_gives_empty_index(tmp_path):
+    assert AssetIndex(os.path.join(str(tmp_path), 'nope')).assets == {}
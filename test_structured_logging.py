@@ -0,0 +1,87 @@
+import io
+import json
+import logging
+import time
+
+from structured_logging import DeferredQueueHandler, JsonFormatter, SamplingFilter, attach_queue_logging, build_handlers
+
+
+def make_record(msg='hello %s', args=('world',), **extra):
+    record = logging.LogRecord('app', logging.INFO, __file__, 10, msg, args, None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+
+def test_json_formatter_includes_extra_fields():
+    entry = json.loads(JsonFormatter().format(make_record(job_id='abc')))
+    assert entry['message'] == 'hello world'
+    assert entry['level'] == 'INFO'
+    assert entry['job_id'] == 'abc'
+
+
+def test_queue_handler_renders_message_and_traceback_before_enqueueing():
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        import sys
+        record = logging.LogRecord('app', logging.ERROR, __file__, 10, 'failed %d', (3,), sys.exc_info())
+    prepared = DeferredQueueHandler(None).prepare(record)
+    assert prepared.msg == 'failed 3' and prepared.args is None
+    assert prepared.exc_info is None and 'ValueError: boom' in prepared.exc_text
+    assert 'ValueError: boom' in json.loads(JsonFormatter().format(prepared))['exc_info']
+
+
+def test_sampling_filter_rate_limits_and_reports_suppressed():
+    sampler = SamplingFilter(max_per_second=2)
+    kept = [sampler.filter(make_record()) for _ in range(5)]
+    assert kept == [True, True, False, False, False]
+    time.sleep(0.6)
+    record = make_record()
+    assert sampler.filter(record)
+    assert record.suppressed == 3
+
+
+def test_sampling_filter_drops_everything_at_zero_rate():
+    sampler = SamplingFilter(sample_rate=0.0)
+    assert not any(sampler.filter(make_record()) for _ in range(10))
+    assert sampler.suppressed == 10
+
+
+def test_queue_logging_writes_on_listener_thread():
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    logger = logging.getLogger('test_queue_logging')
+    logger.propagate = False
+    listener = attach_queue_logging(logger, [handler], logging.INFO)
+    logger.info('queued %s', 'message', extra={'turn': 1})
+    listener.stop()
+    entry = json.loads(stream.getvalue())
+    assert entry['message'] == 'queued message'
+    assert entry['turn'] == 1
+
+
+def test_queue_logging_restarts_listener_in_forked_child(tmp_path):
+    import os
+    log_path = tmp_path / 'child.log'
+    handler = logging.FileHandler(log_path)
+    handler.setFormatter(JsonFormatter())
+    logger = logging.getLogger('test_queue_logging_fork')
+    logger.propagate = False
+    listener = attach_queue_logging(logger, [handler], logging.INFO)
+    pid = os.fork()
+    if pid == 0:
+        logger.info('from child')
+        listener.stop()
+        os._exit(0)
+    os.waitpid(pid, 0)
+    listener.stop()
+    assert json.loads(log_path.read_text())['message'] == 'from child'
+
+
+def test_build_handlers_without_log_file_logs_to_console_only(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    handlers = build_handlers('json', None, 1024, 1)
+    assert [type(h) for h in handlers] == [logging.StreamHandler]
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,47 @@
+import time
+
+import httpx
+import pytest
+
+from transport import DeadlineExceeded, LatencyStats, _apply_deadline, deadline, endpoint_name, remaining_budget
+
+
+def test_endpoint_name_replaces_resource_ids():
+    url = 'https://api.openai.com/v1/threads/thread_abc123XYZ456/runs/run_9f8e7d6c5b4a'
+    assert endpoint_name('GET', url) == 'GET api.openai.com/v1/threads/{id}/runs/{id}'
+    assert endpoint_name('POST', 'https://api.openai.com/v1/threads') == 'POST api.openai.com/v1/threads'
+
+
+def test_deadline_clamps_request_timeouts():
+    request = httpx.Request('GET', 'https://api.openai.com/v1/threads')
+    request.extensions['timeout'] = {'connect': 5.0, 'read': 60.0, 'write': 30.0, 'pool': None}
+    with deadline(2):
+        _apply_deadline(request)
+    timeouts = request.extensions['timeout']
+    assert timeouts['connect'] <= 2 and timeouts['read'] <= 2 and timeouts['pool'] <= 2
+
+
+def test_nested_deadline_cannot_extend_budget():
+    with deadline(1):
+        with deadline(60):
+            assert remaining_budget() <= 1
+    assert remaining_budget() is None
+
+
+def test_spent_deadline_fails_before_sending():
+    request = httpx.Request('GET', 'https://api.openai.com/v1/threads')
+    with deadline(0.01):
+        time.sleep(0.02)
+        with pytest.raises(DeadlineExceeded):
+            _apply_deadline(request)
+
+
+def test_latency_stats_per_endpoint():
+    stats = LatencyStats()
+    stats.record('GET a/b', 0.5)
+    stats.record('GET a/b', 1.5, error=True)
+    snapshot = stats.snapshot()['GET a/b']
+    assert snapshot['requests'] == 2
+    assert snapshot['errors'] == 1
+    assert snapshot['seconds_total'] == 2.0
+    assert snapshot['seconds_max'] == 1.5
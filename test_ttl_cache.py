@@ -0,0 +1,36 @@
+from unittest.mock import patch
+
+from ttl_cache import TTLCache
+
+def test_hits_and_misses_are_counted():
+    cache = TTLCache(maxsize=10, ttl=60)
+    assert cache.get('a') is None
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 1, 'evictions': 0}
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert cache.stats()['evictions'] == 1
+
+def test_entries_expire():
+    cache = TTLCache(maxsize=10, ttl=5)
+    with patch('ttl_cache.time.monotonic', return_value=100.0):
+        cache.set('a', 1)
+    with patch('ttl_cache.time.monotonic', return_value=104.0):
+        assert cache.get('a') == 1
+    with patch('ttl_cache.time.monotonic', return_value=106.0):
+        assert cache.get('a') is None
+    assert len(cache) == 0
+
+def test_invalidate():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set('a', 1)
+    cache.invalidate('a')
+    assert cache.get('a') is None
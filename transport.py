@@ -0,0 +1,266 @@
+import contextvars
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+
+from config import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_WRITE_TIMEOUT, HTTP_POOL_TIMEOUT
+from config import HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY
+
+# Path segments that identify a resource rather than an endpoint: OpenAI object ids
+# (thread_..., run_..., msg_..., asst_..., file-...) and numeric ids
+_ID_SEGMENT_RE = re.compile(r'^([a-z]+[_-][A-Za-z0-9]{8,}|\d+)$')
+
+# Absolute time.monotonic() deadline for the calls made in the current context, if any
+_deadline = contextvars.ContextVar('http_deadline', default=None)
+
+
+class DeadlineExceeded(httpx.TimeoutException):
+    """
+    Raised instead of sending a request once the caller's deadline budget is spent.
+
+    It is an httpx timeout, so the OpenAI SDK surfaces it as APITimeoutError.
+    """
+
+
+def endpoint_name(method, url):
+    """
+    Label a request by method, host and path with resource ids replaced, e.g.
+    "POST api.openai.com/v1/threads/{id}/runs".
+    """
+    url = httpx.URL(str(url))
+    segments = ['{id}' if _ID_SEGMENT_RE.match(segment) else segment for segment in url.path.split('/')]
+    return f"{method} {url.host}{'/'.join(segments)}"
+
+
+class LatencyStats:
+    """
+    Per-endpoint request counts, errors and latency (time until response headers arrive).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, seconds, error=False):
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, {
+                'requests': 0,
+                'errors': 0,
+                'seconds_total': 0.0,
+                'seconds_max': 0.0,
+            })
+            stats['requests'] += 1
+            if error:
+                stats['errors'] += 1
+            stats['seconds_total'] += seconds
+            stats['seconds_max'] = max(stats['seconds_max'], seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: dict(stats) for endpoint, stats in self._endpoints.items()}
+
+
+# Process-wide stats shared by every client built here
+transport_stats = LatencyStats()
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Give every HTTP call made inside the block a shared time budget.
+
+    Each request's timeouts are clamped to what is left of the budget, and
+    requests started after it is spent fail with DeadlineExceeded. Nested
+    deadlines can only shorten the budget, never extend it.
+    """
+    expires_at = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        expires_at = min(expires_at, current)
+    token = _deadline.set(expires_at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget():
+    """
+    Seconds left before the current deadline, or None if no deadline is set.
+    """
+    expires_at = _deadline.get()
+    if expires_at is None:
+        return None
+    return max(0.0, expires_at - time.monotonic())
+
+
+def _apply_deadline(request):
+    remaining = remaining_budget()
+    if remaining is None:
+        return
+    if remaining <= 0:
+        raise DeadlineExceeded(f"Deadline exceeded before {request.method} {request.url}", request=request)
+    timeouts = dict(request.extensions.get('timeout', {}))
+    for key in ('connect', 'read', 'write', 'pool'):
+        value = timeouts.get(key)
+        timeouts[key] = remaining if value is None else min(value, remaining)
+    request.extensions['timeout'] = timeouts
+
+
+class TimedTransport(httpx.HTTPTransport):
+    """
+    HTTPTransport that enforces the current deadline and records per-endpoint latency.
+    """
+
+    def handle_request(self, request):
+        _apply_deadline(request)
+        endpoint = endpoint_name(request.method, request.url)
+        start = time.perf_counter()
+        try:
+            response = super().handle_request(request)
+        except Exception:
+            transport_stats.record(endpoint, time.perf_counter() - start, error=True)
+            raise
+        transport_stats.record(endpoint, time.perf_counter() - start, error=response.status_code >= 500)
+        return response
+
+
+class AsyncTimedTransport(httpx.AsyncHTTPTransport):
+    """
+    TimedTransport for httpx.AsyncClient. The deadline is a context variable, so
+    each asyncio task sees the budget of the request it serves.
+    """
+
+    async def handle_async_request(self, request):
+        _apply_deadline(request)
+        endpoint = endpoint_name(request.method, request.url)
+        start = time.perf_counter()
+        try:
+            response = await super().handle_async_request(request)
+        except Exception:
+            transport_stats.record(endpoint, time.perf_counter() - start, error=True)
+            raise
+        transport_stats.record(endpoint, time.perf_counter() - start, error=response.status_code >= 500)
+        return response
+
+
+def http2_available():
+    """
+    Whether the optional h2 package is installed (pip install 'httpx[http2]').
+    """
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def build_timeout():
+    return httpx.Timeout(
+        connect=HTTP_CONNECT_TIMEOUT,
+        read=HTTP_READ_TIMEOUT,
+        write=HTTP_WRITE_TIMEOUT,
+        pool=HTTP_POOL_TIMEOUT,
+    )
+
+
+def build_limits():
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def build_http_client():
+    """
+    An httpx client with keep-alive pooling, explicit timeouts, HTTP/2 when h2 is
+    installed, deadline budgets and latency stats; pass it to OpenAI(http_client=...).
+    """
+    transport = TimedTransport(limits=build_limits(), http2=http2_available())
+    return httpx.Client(transport=transport, timeout=build_timeout(), follow_redirects=True)
+
+
+def build_async_http_client():
+    """
+    build_http_client for asyncio; pass it to AsyncOpenAI(http_client=...).
+
+    Its connections belong to the event loop that first uses it, so build one per loop.
+    """
+    transport = AsyncTimedTransport(limits=build_limits(), http2=http2_available())
+    return httpx.AsyncClient(transport=transport, timeout=build_timeout(), follow_redirects=True)
+
+
+def bind_deadline(fn):
+    """
+    Wrap fn so it runs under the caller's current deadline, e.g. in an executor thread
+    (context variables do not follow work submitted to a thread pool).
+    """
+    expires_at = _deadline.get()
+    if expires_at is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        token = _deadline.set(expires_at)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _deadline.reset(token)
+    return bound
+
+
+def build_openai_client(api_key, max_retries=2):
+    """
+    An OpenAI client on the shared tuned transport. Pass max_retries=0 when the
+    caller retries on its own (see resilience.call_with_retry).
+    """
+    from openai import OpenAI
+
+    return OpenAI(api_key=api_key, http_client=build_http_client(), timeout=build_timeout(), max_retries=max_retries)
+
+
+def build_async_openai_client(api_key, max_retries=2):
+    """
+    An AsyncOpenAI client on the shared tuned transport, as build_openai_client.
+    """
+    from openai import AsyncOpenAI
+
+    return AsyncOpenAI(api_key=api_key, http_client=build_async_http_client(), timeout=build_timeout(), max_retries=max_retries)
+
+
+def build_requests_session():
+    """
+    A requests Session with a keep-alive pool, default connect/read timeouts and
+    latency stats, for libraries built on requests (tweepy, plain downloads).
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class TimedSession(requests.Session):
+        def request(self, method, url, **kwargs):
+            remaining = remaining_budget()
+            if remaining is not None and remaining <= 0:
+                raise requests.Timeout(f"Deadline exceeded before {method} {url}")
+            timeout = kwargs.get('timeout') or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+            connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+            if remaining is not None:
+                connect, read = min(connect, remaining), min(read, remaining)
+            kwargs['timeout'] = (connect, read)
+            endpoint = endpoint_name(method.upper(), url)
+            start = time.perf_counter()
+            try:
+                response = super().request(method, url, **kwargs)
+            except Exception:
+                transport_stats.record(endpoint, time.perf_counter() - start, error=True)
+                raise
+            transport_stats.record(endpoint, time.perf_counter() - start, error=response.status_code >= 500)
+            return response
+
+    session = TimedSession()
+    adapter = HTTPAdapter(pool_connections=HTTP_MAX_KEEPALIVE, pool_maxsize=HTTP_MAX_CONNECTIONS)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
@@ -1,21 +1,20 @@
 import os
 import time
 import tweepy
-from openai import OpenAI
-import requests
 from io import BytesIO
 from PIL import Image
 from datetime import datetime, timedelta
+from transport import build_openai_client, build_requests_session
 
 # Load API keys from environment variables
 # These keys are essential for authenticating with the OpenAI and Twitter APIs
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+openai_client = build_openai_client(os.getenv('OPENAI_API_KEY'))
 twitter_client_id = os.getenv('TWITTER_CLIENT_ID')
 twitter_client_secret = os.getenv('TWITTER_CLIENT_SECRET')
 
 # Twitter API v2 authentication
 # This client is used for most Twitter operations like tweeting and reading mentions
-client = tweepy.Client(
+twitter_client = tweepy.Client(
     consumer_key=twitter_client_id,
     consumer_secret=twitter_client_secret,
     access_token=os.getenv('TWITTER_ACCESS_TOKEN'),
@@ -28,6 +27,11 @@ auth = tweepy.OAuthHandler(twitter_client_id, twitter_client_secret)
 auth.set_access_token(os.getenv('TWITTER_ACCESS_TOKEN'), os.getenv('TWITTER_ACCESS_TOKEN_SECRET'))
 api = tweepy.API(auth)
 
+# Share one keep-alive session with default timeouts between both Twitter clients and image downloads
+http = build_requests_session()
+twitter_client.session = http
+api.session = http
+
 def generate_image():
     """
     Generate an interesting image using OpenAI's DALL-E.
@@ -41,17 +45,17 @@ def generate_image():
     prompt = "An abstract, colorful representation of artificial intelligence and creativity"
 
     # Create a new thread
-    thread = client.beta.threads.create()
+    thread = openai_client.beta.threads.create()
 
     # Add a message to the thread
-    client.beta.threads.messages.create(
+    openai_client.beta.threads.messages.create(
         thread_id=thread.id,
         role="user",
         content=f"Generate an image with the following prompt: {prompt}"
     )
 
     # Run the assistant
-    run = client.beta.threads.runs.create(
+    run = openai_client.beta.threads.runs.create(
         thread_id=thread.id,
         assistant_id="asst_your_image_assistant_id_here",  # Replace with your actual image generation assistant ID
         instructions="Generate an image based on the given prompt."
@@ -59,10 +63,10 @@ def generate_image():
 
     # Wait for the run to complete
     while run.status != "completed":
-        run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
+        run = openai_client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
 
     # Retrieve the assistant's messages
-    messages = client.beta.threads.messages.list(thread_id=thread.id)
+    messages = openai_client.beta.threads.messages.list(thread_id=thread.id)
 
     # Extract the image URL from the assistant's reply
     image_url = next((msg.content[0].image_file.file_id for msg in messages if msg.role == "assistant" and msg.content[0].type == "image_file"), None)
@@ -87,7 +91,8 @@ def post_image_to_twitter(image_url):
         tweepy.Response: The response from the create_tweet API call
     """
     # Download the image
-    response = requests.get(image_url)
+    response = http.get(image_url)
+    response.raise_for_status()
     img = Image.open(BytesIO(response.content))
 
     # Save the image temporarily
@@ -95,7 +100,7 @@ def post_image_to_twitter(image_url):
 
     # Upload the image and post the tweet
     media = api.media_upload("temp_image.png")
-    tweet = client.create_tweet(text="Here's an AI-generated image for your viewing pleasure!", media_ids=[media.media_id])
+    tweet = twitter_client.create_tweet(text="Here's an AI-generated image for your viewing pleasure!", media_ids=[media.media_id])
 
     # Remove the temporary image file
     os.remove("temp_image.png")
@@ -111,23 +116,23 @@ def respond_to_messages():
     and posts the reply.
     """
     # Get recent messages (mentions)
-    mentions = client.get_users_mentions(id=client.get_me().data.id)
+    mentions = twitter_client.get_users_mentions(id=twitter_client.get_me().data.id)
 
     for mention in mentions.data:
         # Check if we've already replied to this mention
         if not has_replied(mention.id):
             # Create a new thread
-            thread = client.beta.threads.create()
+            thread = openai_client.beta.threads.create()
 
             # Add the mention to the thread
-            client.beta.threads.messages.create(
+            openai_client.beta.threads.messages.create(
                 thread_id=thread.id,
                 role="user",
                 content=f"Respond to this tweet: {mention.text}"
             )
 
             # Run the assistant
-            run = client.beta.threads.runs.create(
+            run = openai_client.beta.threads.runs.create(
                 thread_id=thread.id,
                 assistant_id="asst_your_assistant_id_here",  # Replace with your actual assistant ID
                 instructions="Please provide a concise and engaging response to the tweet."
@@ -135,17 +140,17 @@ def respond_to_messages():
 
             # Wait for the run to complete
             while run.status != "completed":
-                run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
+                run = openai_client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
 
             # Retrieve the assistant's messages
-            messages = client.beta.threads.messages.list(thread_id=thread.id)
+            messages = openai_client.beta.threads.messages.list(thread_id=thread.id)
 
             # Extract the assistant's reply
             ai_reply = next((msg.content[0].text.value for msg in messages if msg.role == "assistant"), None)
 
             if ai_reply:
                 # Reply to the mention
-                client.create_tweet(
+                twitter_client.create_tweet(
                     text=ai_reply[:280],  # Truncate to Twitter's character limit
                     in_reply_to_tweet_id=mention.id
                 )
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFull(Exception):
+    """
+    Raised when a bounded executor already has its maximum number of pending jobs.
+    """
+
+
+class BoundedExecutor:
+    """
+    A thread pool that refuses new work once max_pending jobs are queued or running.
+
+    The underlying pool is created on first use so that it is started in the
+    process that runs the jobs (after gunicorn forks its workers).
+    """
+
+    def __init__(self, max_workers, max_pending, thread_name_prefix='worker'):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.thread_name_prefix = thread_name_prefix
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=self.thread_name_prefix
+                )
+            return self._pool
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedule fn(*args, **kwargs) to run in the pool.
+
+        Raises:
+            QueueFull: If max_pending jobs are already queued or running
+        """
+        if not self._slots.acquire(blocking=False):
+            raise QueueFull(f"{self.max_pending} jobs already pending")
+        try:
+            future = self._get_pool().submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=wait)
+                self._pool = None
+
+
+def long_poll(fetch, is_done, timeout, interval=0.5, event=None):
+    """
+    Call fetch() until is_done(result) is true or timeout seconds have passed.
+
+    If an in-process threading.Event is given, wait on it between fetches so
+    that local completions are seen immediately; otherwise sleep for interval.
+
+    Returns:
+        The last value returned by fetch()
+    """
+    deadline = time.monotonic() + timeout
+    result = fetch()
+    while not is_done(result):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        if event is not None:
+            event.wait(min(interval, remaining))
+        else:
+            time.sleep(min(interval, remaining))
+        result = fetch()
+    return result
+
+
+async def async_long_poll(fetch, is_done, timeout, interval=0.5):
+    """
+    long_poll for a coroutine function fetch, sleeping on the event loop between fetches.
+
+    Returns:
+        The last value returned by fetch()
+    """
+    deadline = time.monotonic() + timeout
+    result = await fetch()
+    while not is_done(result):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        await asyncio.sleep(min(interval, remaining))
+        result = await fetch()
+    return result